@@ -0,0 +1,74 @@
+"""Measure the overhead of `okdata.aws.batch.process_batch`.
+
+Processes synthetic SQS batches: a large batch of trivial records, to show
+the per-record overhead, and a batch of I/O-bound records (each sleeping for
+a millisecond), processed by one and by many threads.
+
+Run with `python benchmarks/bench_batch.py`.
+"""
+
+import json
+import time
+import timeit
+
+from okdata.aws.batch import process_batch
+
+
+def sqs_event(n):
+    return {
+        "Records": [
+            {
+                "messageId": f"message-{i}",
+                "body": json.dumps({"n": i}),
+                "eventSource": "aws:sqs",
+                "eventSourceARN": "arn:aws:sqs:eu-west-1:123456789012:my-queue",
+            }
+            for i in range(n)
+        ]
+    }
+
+
+def bench(name, f, records, number):
+    seconds = min(timeit.repeat(f, number=number, repeat=3)) / number
+    print(
+        f"{name:>36}: {seconds * 1000:9.3f} ms/batch"
+        f" {seconds / records * 1000000:9.3f} us/record"
+    )
+
+
+def trivial(record):
+    json.loads(record["body"])
+
+
+def failing(record):
+    if json.loads(record["body"])["n"] % 10 == 0:
+        raise ValueError("Bad record")
+
+
+def io_bound(record):
+    time.sleep(0.001)
+
+
+def main():
+    large = sqs_event(10000)
+    bench("loop, trivial", lambda: [trivial(r) for r in large["Records"]], 10000, 10)
+    bench("process_batch, trivial", lambda: process_batch(large, trivial), 10000, 10)
+    bench(
+        "process_batch, 10% failing",
+        lambda: process_batch(large, failing),
+        10000,
+        10,
+    )
+
+    small = sqs_event(200)
+    for max_workers in [1, 4, 16]:
+        bench(
+            f"process_batch, I/O, {max_workers} workers",
+            lambda: process_batch(small, io_bound, max_workers),
+            200,
+            3,
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""Measure the cost of acquiring AWS clients.
+
+Compares creating a client in a new session (as on a cold start), creating
+one from the default boto3 session (as `boto3.client` does), and getting a
+warm client from `okdata.aws.clients`. Also compares creating a set of
+clients one by one with warming them up in a background thread.
+
+Run with `python benchmarks/bench_clients.py`.
+"""
+
+import os
+import time
+import timeit
+
+import boto3
+
+from okdata.aws import clients
+
+REGION = "eu-west-1"
+SERVICES = ["dynamodb", "ssm", "s3", "sqs", "lambda", "kinesis"]
+
+
+def bench(name, f, number):
+    seconds = min(timeit.repeat(f, number=number, repeat=3))
+    print(f"{name:>32}: {seconds / number * 1000:9.3f} ms/client")
+
+
+def bench_once(name, f):
+    start_time = time.perf_counter()
+    f()
+    print(f"{name:>32}: {(time.perf_counter() - start_time) * 1000:9.3f} ms")
+
+
+def main():
+    os.environ.setdefault("AWS_REGION", REGION)
+
+    bench(
+        "cold, new session",
+        lambda: boto3.Session().client("dynamodb", region_name=REGION),
+        number=10,
+    )
+    bench(
+        "default session",
+        lambda: boto3.client("dynamodb", region_name=REGION),
+        number=10,
+    )
+    clients.get_client("dynamodb")
+    bench("warm, get_client", lambda: clients.get_client("dynamodb"), number=100000)
+
+    # Created from one session, as `get_client` does; the first session is
+    # already loaded by the benchmarks above.
+    session = boto3.Session()
+    bench_once(
+        f"{len(SERVICES)} clients, sequentially",
+        lambda: [session.client(s, region_name=REGION) for s in SERVICES],
+    )
+    clients.clear()
+    bench_once(
+        f"{len(SERVICES)} clients, warm_up",
+        lambda: clients.warm_up(SERVICES).join(),
+    )
+
+
+if __name__ == "__main__":
+    main()
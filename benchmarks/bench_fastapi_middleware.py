@@ -0,0 +1,78 @@
+"""Compare the throughput of the ASGI logging middleware with the
+`BaseHTTPMiddleware` based one it replaced.
+
+Requires FastAPI and httpx. Run with
+`python benchmarks/bench_fastapi_middleware.py`.
+"""
+
+import asyncio
+import io
+import time
+from contextlib import redirect_stdout
+
+import httpx
+from fastapi import FastAPI
+from starlette.middleware.base import BaseHTTPMiddleware
+
+from okdata.aws import logging
+from okdata.aws.logging import add_fastapi_logging
+
+N_REQUESTS = 2000
+CONCURRENCY = 50
+
+
+async def base_http_logging_middleware(request, call_next):
+    # Equivalent of the middleware `add_fastapi_logging` used to register.
+    invocation = logging._init_logger("async_handler", {}, None)
+    token = logging._invocation.set(invocation)
+    invocation.start_time = time.perf_counter_ns()
+    try:
+        response = await call_next(request)
+        invocation.fields["response_status_code"] = response.status_code
+        invocation.fields["level"] = "info"
+        return response
+    finally:
+        logging._invocation.reset(token)
+        logging._finalize(invocation)
+
+
+def make_app(middleware):
+    app = FastAPI()
+    if middleware == "asgi":
+        add_fastapi_logging(app)
+    elif middleware == "base_http":
+        app.add_middleware(BaseHTTPMiddleware, dispatch=base_http_logging_middleware)
+
+    @app.get("/hello")
+    async def hello():
+        return {"msg": "Hello World"}
+
+    return app
+
+
+async def requests_per_second(app):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as c:
+        semaphore = asyncio.Semaphore(CONCURRENCY)
+
+        async def request():
+            async with semaphore:
+                response = await c.get("/hello")
+                assert response.status_code == 200
+
+        start = time.perf_counter()
+        await asyncio.gather(*[request() for _ in range(N_REQUESTS)])
+        return N_REQUESTS / (time.perf_counter() - start)
+
+
+def main():
+    logging.SERVICE_NAME = "benchmark"
+    for middleware in ["none", "base_http", "asgi"]:
+        app = make_app(middleware)
+        with redirect_stdout(io.StringIO()):
+            rps = max(asyncio.run(requests_per_second(app)) for _ in range(3))
+        print(f"{middleware:>10}: {rps:8.0f} requests/s")
+
+
+if __name__ == "__main__":
+    main()
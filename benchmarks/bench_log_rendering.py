@@ -0,0 +1,118 @@
+"""Measure the cost of rendering and writing log lines.
+
+Compares the per-line render cost of the standard library JSON renderer with
+`orjson`, and the time spent on the request path by `logging_wrapper` when
+writing synchronously versus using the background log writer.
+
+Run with `python benchmarks/bench_log_rendering.py`.
+"""
+
+import io
+import os
+import time
+import timeit
+from contextlib import redirect_stdout
+from datetime import datetime, timezone
+
+import structlog
+
+from okdata.aws import logging
+from okdata.aws.logging import _orjson_dumps, logging_wrapper
+
+from bench_logging import EVENT, Context, handler
+
+EVENT_DICT = {
+    "service_name": "benchmark",
+    "handler_method": "handler",
+    "function_name": "my-function",
+    "function_version": "$LATEST",
+    "git_rev": "0123456789abcdef",
+    "memory_limit_in_mb": 1024,
+    "function_stage": "dev",
+    "function_api_id": "abc123",
+    "aws_account_id": "123456789012",
+    "aws_request_id": "c6af9ac6-7b61-11e6-9a41-93e812345678",
+    "aws_trace_id": "Root=1-5f84c3a7-0e8f4f3c2f7b6a5d4c3b2a19",
+    "logged_in": True,
+    "principal_id": "someuxxx",
+    "source_ip": "10.0.0.x",
+    "request_domain_name": "api.data.oslo.systems",
+    "request_resource": "/datasets/{dataset_id}",
+    "request_path": "/datasets/my-dataset",
+    "request_method": "GET",
+    "request_path_parameters": {"dataset_id": "my-dataset"},
+    "request_query_string_parameters": {"limit": "10", "token": "xxx"},
+    "cold_start": False,
+    "response_status_code": 200,
+    "level": "info",
+    "duration_ms": 1.234,
+    "event": "",
+    "timestamp": datetime.now(timezone.utc).isoformat(),
+}
+
+
+class SlowFile(io.StringIO):
+    """A file where every flush blocks, like a congested stdout pipe."""
+
+    def flush(self):
+        time.sleep(0.0002)
+
+
+def bench_render(name, renderer, number=100000):
+    seconds = min(
+        timeit.repeat(
+            lambda: renderer(None, "msg", dict(EVENT_DICT)), number=number, repeat=5
+        )
+    )
+    print(f"{name:>28}: {seconds / number * 1000000:9.2f} us/line")
+
+
+def bench_wrapper(name, number=20000, file=None, **config):
+    logging.configure(**config)
+    wrapped = logging_wrapper(handler)
+    context = Context()
+
+    with file or open(os.devnull, "w") as out, redirect_stdout(out):
+        seconds = min(
+            timeit.repeat(lambda: wrapped(EVENT, context), number=number, repeat=5)
+        )
+        logging.flush(60)
+    print(f"{name:>28}: {seconds / number * 1000000:9.2f} us/invocation")
+
+
+def main():
+    os.environ.setdefault("SERVICE_NAME", "benchmark")
+
+    bench_render("json renderer", structlog.processors.JSONRenderer())
+    bench_render(
+        "orjson renderer", structlog.processors.JSONRenderer(serializer=_orjson_dumps)
+    )
+
+    bench_wrapper("sync, json", fast_json=False, async_writer=False)
+    bench_wrapper("sync, orjson", fast_json=True, async_writer=False)
+    bench_wrapper("async writer, orjson", fast_json=True, async_writer=True)
+    bench_wrapper(
+        "slow stdout, sync", 2000, SlowFile(), fast_json=True, async_writer=False
+    )
+    bench_wrapper(
+        "slow stdout, async writer",
+        2000,
+        SlowFile(),
+        fast_json=True,
+        async_writer=True,
+    )
+    # Without waiting for the lines to be written at the end of each
+    # invocation, i.e. the time spent on the request path when the flush
+    # happens after the response has been sent (as in the FastAPI middleware).
+    logging.WRITER_FLUSH_TIMEOUT = 0
+    bench_wrapper(
+        "slow stdout, async, no flush",
+        2000,
+        SlowFile(),
+        fast_json=True,
+        async_writer=True,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Measure the overhead `logging_wrapper` adds to each invocation.
+
+Run with `python benchmarks/bench_logging.py`.
+"""
+
+import io
+import os
+import timeit
+from contextlib import redirect_stdout
+
+from okdata.aws.logging import log_add, log_duration, logging_wrapper, timed
+
+EVENT = {
+    "resource": "/datasets/{dataset_id}",
+    "path": "/datasets/my-dataset",
+    "httpMethod": "GET",
+    "headers": {
+        "Host": "api.data.oslo.systems",
+        "X-Amzn-Trace-Id": "Root=1-5f84c3a7-0e8f4f3c2f7b6a5d4c3b2a19",
+    },
+    "pathParameters": {"dataset_id": "my-dataset"},
+    "queryStringParameters": {"limit": "10", "token": "secret"},
+    "requestContext": {
+        "accountId": "123456789012",
+        "apiId": "abc123",
+        "stage": "dev",
+        "domainName": "api.data.oslo.systems",
+        "authorizer": {"principalId": "someuser"},
+        "identity": {"sourceIp": "10.0.0.1"},
+    },
+}
+
+
+class Context:
+    function_name = "my-function"
+    function_version = "$LATEST"
+    aws_request_id = "c6af9ac6-7b61-11e6-9a41-93e812345678"
+    memory_limit_in_mb = 1024
+
+
+def handler(event, context):
+    return {"statusCode": 200, "body": "OK"}
+
+
+def log_add_handler(event, context):
+    for i in range(1000):
+        log_add(**{f"field_{i}": i})
+    return {"statusCode": 200, "body": "OK"}
+
+
+def log_duration_handler(event, context):
+    for i in range(1000):
+        log_duration(lambda: i, "process_record")
+    return {"statusCode": 200, "body": "OK"}
+
+
+def timed_handler(event, context):
+    for i in range(1000):
+        with timed("process_record"):
+            pass
+    return {"statusCode": 200, "body": "OK"}
+
+
+def bench(name, handler, number):
+    wrapped = logging_wrapper(handler)
+    context = Context()
+
+    with redirect_stdout(io.StringIO()):
+        seconds = min(
+            timeit.repeat(lambda: wrapped(EVENT, context), number=number, repeat=5)
+        )
+    print(f"{name:>28}: {seconds / number * 1000000:9.2f} us/invocation")
+
+
+def main():
+    os.environ.setdefault("SERVICE_NAME", "benchmark")
+    bench("logging_wrapper", handler, 20000)
+    bench("1000 x log_add", log_add_handler, 100)
+    bench("1000 x log_duration", log_duration_handler, 100)
+    bench("1000 x timed", timed_handler, 100)
+
+
+if __name__ == "__main__":
+    main()
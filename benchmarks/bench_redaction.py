@@ -0,0 +1,92 @@
+"""Measure the cost of redacting secrets from nested payloads.
+
+Compares `okdata.aws.redact.Redactor` with a naive redactor copying every
+dict and list and checking each key against each pattern, on a regular log
+line and on deeply nested payloads, with the default patterns and with eight
+times as many.
+
+Run with `python benchmarks/bench_redaction.py`.
+"""
+
+import re
+import timeit
+
+from okdata.aws.redact import DEFAULT_PATTERNS, REDACTED, Redactor
+
+from bench_log_rendering import EVENT_DICT
+
+MANY_PATTERNS = DEFAULT_PATTERNS + tuple(
+    f"{pattern}_{i}" for pattern in ["ssn", "pin", "iban", "card"] for i in range(14)
+)
+
+
+class NaiveRedactor:
+    def __init__(self, patterns):
+        self.patterns = [re.compile(p, re.IGNORECASE) for p in patterns]
+
+    def redact(self, value):
+        if isinstance(value, dict):
+            return {
+                k: (
+                    REDACTED
+                    if isinstance(k, str) and any(p.search(k) for p in self.patterns)
+                    else self.redact(v)
+                )
+                for k, v in value.items()
+            }
+        if isinstance(value, (list, tuple)):
+            return [self.redact(v) for v in value]
+        return value
+
+
+def nested(depth, width):
+    if depth == 0:
+        return {"id": 1, "name": "leaf", "api_key": "abc", "values": [1, 2, 3]}
+    return {f"child_{i}": nested(depth - 1, width) for i in range(width)} | {
+        "metadata": {"created_by": "someone", "labels": ["a", "b"]}
+    }
+
+
+def bench(name, f, number):
+    seconds = min(timeit.repeat(f, number=number, repeat=3))
+    print(f"{name:>44}: {seconds / number * 1000000:10.2f} us")
+
+
+def main():
+    payloads = {
+        "log line": (EVENT_DICT, 5000),
+        "nested, depth 4 x 4": (nested(4, 4), 50),
+        "nested, depth 8 x 2": (nested(8, 2), 50),
+    }
+    for patterns_name, patterns in [
+        (f"{len(DEFAULT_PATTERNS)} patterns", DEFAULT_PATTERNS),
+        (f"{len(MANY_PATTERNS)} patterns", MANY_PATTERNS),
+    ]:
+        naive = NaiveRedactor(patterns)
+        redactor = Redactor(patterns)
+        for payload_name, (payload, number) in payloads.items():
+            assert naive.redact(payload) == redactor.redact(payload)
+            bench(
+                f"naive, {payload_name}, {patterns_name}",
+                lambda: naive.redact(payload),
+                number,
+            )
+            bench(
+                f"redactor, {payload_name}, {patterns_name}",
+                lambda: redactor.redact_fields(dict(payload)),
+                number,
+            )
+
+    redactor = Redactor()
+    body = '{"items": [' + ", ".join(['{"id": 1, "name": "x"}'] * 500) + "]}"
+    bench("response body, 12 kB", lambda: redactor.redact_text(body), 200)
+    body = body[:-2] + ', {"token": "abc"}]}'
+    bench(
+        "response body with a secret, 12 kB",
+        lambda: redactor.redact_text(body),
+        200,
+    )
+
+
+if __name__ == "__main__":
+    main()
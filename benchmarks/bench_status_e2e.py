@@ -0,0 +1,153 @@
+"""Measure the latency `status_wrapper` adds to Lambda invocations.
+
+Drives wrapped handlers through `okdata.aws.status.stub_server.StatusAPIStub`,
+a local stand-in for the status API with configurable latency, error rate
+and rate limit, and reports the added latency per invocation (compared to
+the unwrapped handler), the payload size, and the number of requests,
+retries and errors seen by the stub.
+
+The wrapper sends each event once, so retries are measured separately by
+sending events through `update_status` with `retries` set, reporting the
+latency of the requests that needed a retry.
+
+Run with `python benchmarks/bench_status_e2e.py`.
+"""
+
+import asyncio
+import logging
+import os
+import statistics
+import time
+
+from okdata.aws.status import status_add, status_wrapper
+from okdata.aws.status.model import StatusData
+from okdata.aws.status.sdk import _shared_client
+from okdata.aws.status.stub_server import StatusAPIStub
+
+INVOCATIONS = 200
+
+
+def handler(event, context):
+    status_add(
+        domain="dataset",
+        domain_id="my-dataset/1",
+        status_body={"records": [{"id": i, "status": "ok"} for i in range(20)]},
+    )
+    return {"statusCode": 200}
+
+
+async def async_handler(event, context):
+    await asyncio.sleep(0)
+    return handler(event, context)
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(int(len(values) * p / 100), len(values) - 1)]
+
+
+def timings(f, invocations=INVOCATIONS):
+    durations = []
+    for i in range(invocations):
+        event = {"execution_name": f"trace-{i}"}
+        start_time = time.perf_counter()
+        f(event, None)
+        durations.append((time.perf_counter() - start_time) * 1000)
+    return durations
+
+
+def bench(name, baseline_ms, wrapped, stub):
+    # Warm up the connections (and event loop) before measuring.
+    timings(wrapped, 5)
+    stub.reset()
+    durations = [d - baseline_ms for d in timings(wrapped)]
+    # Wait for events delivered in the background.
+    deadline = time.monotonic() + 10
+    while stub.stats()["requests"] < INVOCATIONS and time.monotonic() < deadline:
+        time.sleep(0.01)
+    stats = stub.stats()
+    errors = sum(n for code, n in stats["responses"].items() if code != 200)
+    print(
+        f"{name:>32}: p50 {percentile(durations, 50):7.2f} ms"
+        f"  p99 {percentile(durations, 99):7.2f} ms"
+        f"  payload {stats['payload_bytes_mean']:6.0f} B"
+        f"  requests {stats['requests']:4}"
+        f"  retries {stats['retries']:3}"
+        f"  errors {errors:3}"
+    )
+
+
+def bench_retries(name, retries, stub):
+    client = _shared_client(stub.sdk_config())
+    payload = StatusData(
+        trace_id="trace", domain="dataset", domain_id="my-dataset/1"
+    ).json_dict(exclude_none=True)
+    client.update_status("warm-up", payload)
+    stub.reset()
+
+    durations = []
+    retried_durations = []
+    for i in range(INVOCATIONS):
+        retries_before = stub.stats()["retries"]
+        start_time = time.perf_counter()
+        try:
+            client.update_status(f"trace-{i}", payload, retries=retries)
+        except Exception:
+            # Counted by the stub.
+            pass
+        duration = (time.perf_counter() - start_time) * 1000
+        durations.append(duration)
+        if stub.stats()["retries"] > retries_before:
+            retried_durations.append(duration)
+
+    stats = stub.stats()
+    errors = sum(n for code, n in stats["responses"].items() if code != 200)
+    retried_ms = statistics.median(retried_durations) if retried_durations else 0
+    print(
+        f"{name:>32}: p50 {percentile(durations, 50):7.2f} ms"
+        f"  p99 {percentile(durations, 99):7.2f} ms"
+        f"  requests {stats['requests']:4}"
+        f"  retries {stats['retries']:3}"
+        f"  errors {errors:3}"
+        f"  retried p50 {retried_ms:7.2f} ms"
+    )
+
+
+def main():
+    os.environ.setdefault("SERVICE_NAME", "benchmark")
+    # Status API errors are logged by the wrapper.
+    logging.getLogger().setLevel(logging.CRITICAL)
+
+    baseline_ms = statistics.median(timings(handler, 1000))
+    print(f"{'unwrapped handler':>32}: p50 {baseline_ms:7.2f} ms")
+
+    scenarios = [
+        ("sync, no latency", {}, {}, handler),
+        ("sync, 5 ms", {"latency": 0.005}, {}, handler),
+        ("sync, 5-15 ms", {"latency": 0.005, "jitter": 0.01}, {}, handler),
+        ("background, 5 ms", {"latency": 0.005}, {"background": True}, handler),
+        (
+            "background, 5 ms, no wait",
+            {"latency": 0.005},
+            {"background": True, "flush_timeout": 0},
+            handler,
+        ),
+        ("async, 5 ms", {"latency": 0.005}, {}, async_handler),
+        ("sync, 5 ms, 10% errors", {"latency": 0.005, "error_rate": 0.1}, {}, handler),
+        ("sync, 100 requests/s", {"rate_limit": 100}, {}, handler),
+    ]
+    for name, stub_options, wrapper_options, f in scenarios:
+        with StatusAPIStub(**stub_options) as stub:
+            wrapped = status_wrapper(stub.sdk_config(), **wrapper_options)(f)
+            bench(name, baseline_ms, wrapped, stub)
+
+    print()
+    # The first retry is immediate, further ones wait for the urllib3 backoff.
+    stub_options = {"latency": 0.005, "error_rate": 0.1}
+    for retries in [0, 1, 2]:
+        with StatusAPIStub(**stub_options) as stub:
+            bench_retries(f"update_status, {retries} retries", retries, stub)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""Measure the per-invocation overhead of the status models.
+
+Constructs a `StatusData` the same way `status_wrapper` does, adds fields
+through `Status.add` and serializes the result.
+
+Run with `python benchmarks/bench_status_model.py`.
+"""
+
+import timeit
+
+from okdata.aws.status.model import StatusData, StatusMeta, TraceEventStatus
+from okdata.aws.status.sdk import Status
+
+ERRORS = [{"message": {"nb": "Det er et problem", "en": "There is a problem"}}]
+
+
+def construct():
+    return StatusData.parse_obj(
+        {
+            "trace_id": "my-trace-id",
+            "user": "someuser",
+            "component": "my-component",
+            "meta": StatusMeta(
+                function_name="my-function",
+                function_version="1",
+                function_stage="dev",
+                git_rev="abc123",
+                git_branch="main",
+            ),
+        }
+    )
+
+
+def construct_add_serialize(status):
+    status.status_data = construct()
+    status.add(operation="handler", domain="dataset", domain_id="my-dataset/1")
+    status.add(status_body={"input": "a", "output": "b"}, errors=ERRORS)
+    status.add(trace_event_status=TraceEventStatus.FAILED, duration=12.3)
+    return status.status_data.json_dict(exclude_none=True)
+
+
+def main():
+    status = Status(construct())
+    for name, f in [
+        ("construct", construct),
+        ("construct + add + serialize", lambda: construct_add_serialize(status)),
+    ]:
+        number = 20000
+        seconds = min(timeit.repeat(f, number=number, repeat=5))
+        print(
+            f"{name:>28}: {seconds / number * 1000000:6.2f} us/invocation, "
+            f"{number / seconds:9.0f} invocations/s"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""Compare the cost of building the status API payload from a `StatusData`.
+
+Run with `python benchmarks/bench_status_serialization.py`.
+"""
+
+import json
+import timeit
+from dataclasses import asdict
+
+from okdata.aws.status.model import StatusData, StatusJSONEncoder, StatusMeta
+
+
+def old_payload(status_data):
+    # What `Status._process_payload` used to do.
+    d = asdict(
+        status_data,
+        dict_factory=lambda d: {k: v for (k, v) in d if v is not None},
+    )
+    return json.loads(json.dumps(d, cls=StatusJSONEncoder))
+
+
+def new_payload(status_data):
+    return status_data.json_dict(exclude_none=True)
+
+
+def make_status_data(n_items):
+    return StatusData(
+        trace_id="my-trace-id",
+        domain="dataset",
+        domain_id="my-dataset/1",
+        meta=StatusMeta(function_name="my-function", git_rev="abc123"),
+        status_body={
+            "files": [
+                {"key": f"raw/green/my-dataset/file-{i}.csv", "size": i, "ok": True}
+                for i in range(n_items)
+            ]
+        },
+    )
+
+
+def main():
+    for n_items in [0, 100, 10000]:
+        status_data = make_status_data(n_items)
+        assert old_payload(status_data) == new_payload(status_data)
+        number = max(10, 100000 // (n_items + 1))
+        for name, f in [("old", old_payload), ("new", new_payload)]:
+            seconds = min(
+                timeit.repeat(lambda: f(status_data), number=number, repeat=5)
+            )
+            print(
+                f"status_body items={n_items:>6} {name}: "
+                f"{seconds / number * 1000000:10.1f} us/payload"
+            )
+
+
+if __name__ == "__main__":
+    main()
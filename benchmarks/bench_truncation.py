@@ -0,0 +1,75 @@
+"""Measure the cost of logging oversize fields, with and without truncation.
+
+Runs handlers returning a 6 MB error response body, and adding a large list
+and a large status body using `log_add`, through `logging_wrapper`, and
+reports the time per invocation and the size of the log line. Also measures
+the overhead of truncation on a regular invocation.
+
+Run with `python benchmarks/bench_truncation.py`.
+"""
+
+import io
+import os
+import timeit
+from contextlib import redirect_stdout
+
+from okdata.aws import logging
+from okdata.aws.logging import log_add, logging_wrapper
+from okdata.aws.truncate import truncate
+
+from bench_logging import EVENT, Context, handler
+
+
+def error_body_handler(event, context):
+    return {"statusCode": 500, "body": "x" * 6 * 1024 * 1024}
+
+
+def large_fields_handler(event, context):
+    log_add(
+        items=[{"id": i, "name": f"item-{i}"} for i in range(20000)],
+        status_body={"records": [{"key": f"key-{i}"} for i in range(5000)]},
+    )
+    return {"statusCode": 200, "body": ""}
+
+
+def bench(name, f, number):
+    wrapped = logging_wrapper(f)
+    context = Context()
+
+    out = io.StringIO()
+    with redirect_stdout(out):
+        wrapped(EVENT, context)
+    line_size = len(out.getvalue())
+
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        seconds = min(
+            timeit.repeat(lambda: wrapped(EVENT, context), number=number, repeat=3)
+        )
+    print(
+        f"{name:>36}: {seconds / number * 1000:9.3f} ms/invocation"
+        f" {line_size:>10} characters"
+    )
+
+
+def main():
+    os.environ.setdefault("SERVICE_NAME", "benchmark")
+
+    truncate_fields = logging.truncate_fields
+    for truncation in [False, True]:
+        # Without truncation, as before it was introduced.
+        logging.truncate_fields = truncate_fields if truncation else lambda *a: {}
+        suffix = "truncated" if truncation else "unbounded"
+        bench(f"6 MB error body, {suffix}", error_body_handler, 20)
+        bench(f"large log_add fields, {suffix}", large_fields_handler, 20)
+        bench(f"regular invocation, {suffix}", handler, 20000)
+
+    value = {"records": [{"key": f"key-{i}"} for i in range(5000)]}
+    number = 1000
+    seconds = min(
+        timeit.repeat(lambda: truncate(value, 16384), number=number, repeat=3)
+    )
+    print(f"{'truncate 5000 records':>36}: {seconds / number * 1000:9.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+import queue
+import sys
+import threading
+import time
+
+
+class BackgroundWorker:
+    """Process queued items on a single background thread.
+
+    Items are queued by `submit` and handed, in the order they were queued,
+    to `_process` on a daemon thread started on demand. Each call gets a
+    batch of every item queued since the previous one. Subclasses implement
+    `_process`. Use `flush` to wait, for a bounded amount of time, for the
+    queued items to be processed.
+
+    At most `max_queue_size` items are kept in memory. `submit` returns false
+    for items that don't fit in the queue, leaving it to the caller to
+    process them itself.
+    """
+
+    def __init__(self, name, max_queue_size):
+        self.name = name
+        self._queue = queue.Queue(max_queue_size)
+        self._thread = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._all_processed = threading.Condition(self._lock)
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(
+                target=self._run, name=self.name, daemon=True
+            )
+            self._thread.start()
+
+    def submit(self, item):
+        """Queue `item` to be processed.
+
+        Return false if the item couldn't be queued, in which case it's up to
+        the caller to process it instead.
+        """
+        with self._lock:
+            try:
+                self._ensure_thread()
+                self._queue.put_nowait(item)
+            except (queue.Full, RuntimeError):
+                return False
+            self._pending += 1
+        return True
+
+    def _process(self, items):
+        """Process the batch of queued `items`."""
+        raise NotImplementedError
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._process(batch)
+            except Exception as e:
+                # Logging may be what failed, so report it on stderr.
+                print(f"Error in {self.name}: {e!r}", file=sys.stderr)
+            finally:
+                with self._lock:
+                    self._pending -= len(batch)
+                    if self._pending == 0:
+                        self._all_processed.notify_all()
+
+    def flush(self, timeout):
+        """Wait at most `timeout` seconds for all queued items to be processed.
+
+        Return true if everything was processed in time.
+        """
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            while self._pending:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._all_processed.wait(remaining)
+        return True
+
+    @property
+    def pending(self):
+        return self._pending
@@ -0,0 +1,162 @@
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from okdata.aws.logging import log_add
+from okdata.aws.status import TraceEventStatus, status_add, status_get
+
+# At most this many failed records are listed in the status event.
+MAX_REPORTED_FAILURES = 100
+
+
+def _record_identifier(record):
+    if "messageId" in record:
+        return record["messageId"]
+    if "kinesis" in record:
+        return record["kinesis"]["sequenceNumber"]
+    if "dynamodb" in record:
+        return record["dynamodb"]["SequenceNumber"]
+    raise ValueError(
+        "Unsupported record; expected records from SQS, Kinesis or DynamoDB streams"
+    )
+
+
+def _is_ordered(record):
+    """Return whether records like `record` must be processed in order."""
+    # Stream records, and messages from FIFO queues.
+    return (
+        "kinesis" in record
+        or "dynamodb" in record
+        or record.get("eventSourceARN", "").endswith(".fifo")
+    )
+
+
+def _process_record(record_handler, record):
+    start_time = time.perf_counter_ns()
+    try:
+        record_handler(record)
+        error = None
+    except Exception as e:
+        error = e
+    return time.perf_counter_ns() - start_time, error
+
+
+def process_batch(event, record_handler, max_workers=1):
+    """Call `record_handler` with every record of `event`.
+
+    Meant for Lambda functions triggered by SQS, Kinesis or DynamoDB streams
+    with `ReportBatchItemFailures` enabled. A record fails if
+    `record_handler` raises an exception, and the returned response lists
+    the failed records so that only they are retried.
+
+    With `max_workers` larger than one, the records are processed
+    concurrently by a thread pool, which is useful for I/O-bound work.
+    Records from Kinesis and DynamoDB streams and from FIFO queues are
+    always processed in order, and the records following a failed one are
+    reported as failed without being processed, so as to preserve the
+    ordering.
+
+    The number of records and failures, and the total, minimum and maximum
+    time spent per record, are added to the invocation log (see
+    `okdata.aws.logging`). Failures are also added to the status event (see
+    `okdata.aws.status`), which is marked as failed if every record failed.
+    """
+    start_time = time.perf_counter_ns()
+    records = event.get("Records") or []
+    identifiers = [_record_identifier(record) for record in records]
+    ordered = bool(records) and _is_ordered(records[0])
+
+    if ordered or max_workers <= 1:
+        results = []
+        for record in records:
+            results.append(_process_record(record_handler, record))
+            if ordered and results[-1][1] is not None:
+                break
+    else:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            # Each record gets its own copy of the context, so that the
+            # record handler can log to the current invocation.
+            futures = [
+                executor.submit(
+                    contextvars.copy_context().run,
+                    _process_record,
+                    record_handler,
+                    record,
+                )
+                for record in records
+            ]
+            results = [future.result() for future in futures]
+
+    failures = []
+    error_types = {}
+    durations = []
+    for identifier, (duration_ns, error) in zip(identifiers, results):
+        durations.append(duration_ns)
+        if error is not None:
+            failures.append((identifier, error))
+            error_type = type(error).__name__
+            error_types[error_type] = error_types.get(error_type, 0) + 1
+    # Records skipped after a failure in a stream or FIFO queue.
+    skipped = identifiers[len(results) :]
+
+    _log_batch(len(records), failures, skipped, error_types, durations, start_time)
+    if failures or skipped:
+        _add_batch_status(len(records), failures, skipped)
+
+    return {
+        "batchItemFailures": [
+            {"itemIdentifier": identifier}
+            for identifier in [i for i, _ in failures] + skipped
+        ]
+    }
+
+
+def _log_batch(record_count, failures, skipped, error_types, durations, start_time):
+    fields = {
+        "batch_record_count": record_count,
+        "batch_failure_count": len(failures),
+        "batch_duration_ms": (time.perf_counter_ns() - start_time) / 1000000.0,
+    }
+    if durations:
+        fields["batch_record_ms"] = {
+            "count": len(durations),
+            "total_ms": sum(durations) / 1000000.0,
+            "min_ms": min(durations) / 1000000.0,
+            "max_ms": max(durations) / 1000000.0,
+        }
+    if error_types:
+        fields["batch_error_types"] = error_types
+    if skipped:
+        fields["batch_skipped_count"] = len(skipped)
+    log_add(**fields)
+
+
+def _add_batch_status(record_count, failures, skipped):
+    failed_count = len(failures) + len(skipped)
+    # Added to whatever the handler has put in the status event already.
+    status_body = status_get("status_body")
+    status_add(
+        status_body={
+            **(status_body if isinstance(status_body, dict) else {}),
+            "batch": {
+                "records": record_count,
+                "failed": failed_count,
+                "failures": [
+                    {"item_identifier": identifier, "error": str(error)}
+                    for identifier, error in failures[:MAX_REPORTED_FAILURES]
+                ],
+                "skipped": skipped[:MAX_REPORTED_FAILURES],
+            },
+        },
+        errors=[
+            *(status_get("errors") or []),
+            {
+                "message": {
+                    "nb": f"{failed_count} av {record_count} elementer feilet",
+                    "en": f"{failed_count} of {record_count} records failed",
+                }
+            },
+        ],
+    )
+    if failed_count == record_count:
+        status_add(trace_event_status=TraceEventStatus.FAILED)
@@ -0,0 +1,152 @@
+import logging
+import os
+import threading
+
+log = logging.getLogger()
+
+# Default botocore client configuration, see `configure`.
+MAX_POOL_CONNECTIONS = 10
+TCP_KEEPALIVE = True
+RETRY_MODE = "standard"
+MAX_ATTEMPTS = 3
+
+_clients = {}
+_clients_lock = threading.Lock()
+# One lock per client key, so that clients are only created once without
+# blocking the creation of other clients.
+_client_locks = {}
+# A single session is shared, as creating one reloads the botocore data. As
+# sessions aren't thread-safe, clients are created from it one at a time; the
+# clients themselves are thread-safe.
+_session = None
+_session_lock = threading.Lock()
+
+
+def configure(
+    max_pool_connections=None, tcp_keepalive=None, retry_mode=None, max_attempts=None
+):
+    """Configure the defaults of the clients created by `get_client`.
+
+    `max_pool_connections`: Maximum number of connections kept in the
+    connection pool of each client.
+
+    `tcp_keepalive`: Whether to enable TCP keep-alive on the connections.
+
+    `retry_mode`: The botocore retry mode: `standard`, `adaptive` (which also
+    rate limits the client when it's being throttled) or `legacy`.
+
+    `max_attempts`: Maximum number of attempts per call, including the first.
+
+    Options that aren't given are left unchanged. Only clients created
+    afterwards are affected.
+    """
+    global MAX_POOL_CONNECTIONS, TCP_KEEPALIVE, RETRY_MODE, MAX_ATTEMPTS
+
+    if max_pool_connections is not None:
+        MAX_POOL_CONNECTIONS = max_pool_connections
+    if tcp_keepalive is not None:
+        TCP_KEEPALIVE = tcp_keepalive
+    if retry_mode is not None:
+        RETRY_MODE = retry_mode
+    if max_attempts is not None:
+        MAX_ATTEMPTS = max_attempts
+
+
+def _create_client(service_name, region_name, config):
+    global _session
+
+    import boto3
+
+    with _session_lock:
+        if _session is None:
+            _session = boto3.Session()
+        return _session.client(service_name, region_name=region_name, config=config)
+
+
+def _client_config(config):
+    from botocore.config import Config
+
+    config = dict(config)
+    # `Config.merge` replaces the retry settings as a whole, so any left out
+    # of `config` are filled in from the defaults first.
+    retries = {"mode": RETRY_MODE, "max_attempts": MAX_ATTEMPTS}
+    if config.get("retries"):
+        if "total_max_attempts" in config["retries"]:
+            del retries["max_attempts"]
+        config["retries"] = {**retries, **config["retries"]}
+
+    return Config(
+        max_pool_connections=MAX_POOL_CONNECTIONS,
+        tcp_keepalive=TCP_KEEPALIVE,
+        retries=retries,
+    ).merge(Config(**config))
+
+
+def get_client(service_name, region_name=None, **config):
+    """Return a shared client for `service_name` in `region_name`.
+
+    Clients are created once per service, region and configuration and kept
+    for the lifetime of the process, so that warm Lambda invocations skip
+    loading the service model and setting up connections. `region_name`
+    defaults to the environment variable `AWS_REGION`. Any `config` is passed
+    on to `botocore.config.Config`, overriding the defaults set using
+    `configure`.
+    """
+    region_name = region_name or os.environ["AWS_REGION"]
+    # The config may contain unhashable values such as dicts.
+    key = (service_name, region_name, repr(sorted(config.items())))
+
+    client = _clients.get(key)
+    if client is not None:
+        return client
+
+    with _clients_lock:
+        lock = _client_locks.setdefault(key, threading.Lock())
+    with lock:
+        client = _clients.get(key)
+        if client is None:
+            client = _create_client(service_name, region_name, _client_config(config))
+            _clients[key] = client
+    return client
+
+
+def warm_up(service_names, region_name=None):
+    """Start creating clients for `service_names` in a background thread.
+
+    Meant to be called during the Lambda init phase, so that the clients are
+    created in parallel with the rest of the initialization instead of on
+    the first invocation. They're created one at a time, as they're created
+    from a single session. `get_client` blocks if a client it's asked for is
+    still being created. Returns the background thread.
+
+    This is done automatically when `okdata.aws.clients` is imported if the
+    comma separated environment variable `WARM_UP_CLIENTS` is set.
+    """
+    region_name = region_name or os.environ["AWS_REGION"]
+    service_names = list(dict.fromkeys(service_names))
+
+    def create(service_name):
+        try:
+            get_client(service_name, region_name)
+        except Exception as e:
+            # Errors are raised when the client is requested instead.
+            log.warning(f"Could not warm up {service_name} client: {e}")
+
+    def run():
+        for service_name in service_names:
+            create(service_name)
+
+    thread = threading.Thread(target=run, name="okdata-clients-warm-up", daemon=True)
+    thread.start()
+    return thread
+
+
+def clear():
+    """Forget every shared client."""
+    with _clients_lock:
+        _clients.clear()
+        _client_locks.clear()
+
+
+if os.getenv("WARM_UP_CLIENTS"):
+    warm_up([s.strip() for s in os.environ["WARM_UP_CLIENTS"].split(",") if s.strip()])
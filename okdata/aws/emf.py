@@ -0,0 +1,114 @@
+"""CloudWatch Embedded Metric Format (EMF) documents.
+
+See https://docs.aws.amazon.com/AmazonCloudWatch/latest/monitoring/CloudWatch_Embedded_Metric_Format_Specification.html
+"""
+
+import threading
+import time
+from collections import defaultdict
+
+UNIT_MILLISECONDS = "Milliseconds"
+UNIT_COUNT = "Count"
+
+# Limits set by the EMF specification.
+MAX_METRICS_PER_DOCUMENT = 100
+MAX_VALUES_PER_METRIC = 100
+
+
+def documents(namespace, dimensions, metrics, timestamp_ms=None):
+    """Return EMF documents for `metrics` with the given `dimensions`.
+
+    `dimensions` is a dict of dimension names and values, while `metrics` is
+    a dict of metric names and `(unit, value)` tuples, where `value` is
+    either a number or a list of numbers. The metrics are split over as many
+    documents as needed to stay within the limits of the specification.
+    Dimensions with empty values are left out.
+    """
+    if timestamp_ms is None:
+        timestamp_ms = int(time.time() * 1000)
+    dimensions = {k: str(v) for k, v in dimensions.items() if v not in (None, "")}
+    names = list(metrics)
+
+    for i in range(0, len(names), MAX_METRICS_PER_DOCUMENT):
+        chunk = names[i : i + MAX_METRICS_PER_DOCUMENT]
+        document = {
+            "_aws": {
+                "Timestamp": timestamp_ms,
+                "CloudWatchMetrics": [
+                    {
+                        "Namespace": namespace,
+                        "Dimensions": [list(dimensions)],
+                        "Metrics": [
+                            {"Name": name, "Unit": metrics[name][0]} for name in chunk
+                        ],
+                    }
+                ],
+            },
+            **dimensions,
+        }
+        for name in chunk:
+            document[name] = metrics[name][1]
+        yield document
+
+
+class MetricsEmitter:
+    """Emit metrics as EMF documents using `write`.
+
+    With a `flush_interval` of zero, a document is emitted for every call to
+    `add`. Otherwise the values are aggregated per set of dimension values
+    and emitted (as lists of values) when `flush` is called, when
+    `flush_if_due` is called at least `flush_interval` seconds after the
+    last flush, or when a metric has accumulated the maximum number of
+    values allowed in a document. Values not yet emitted are lost if the
+    process ends without a final `flush`.
+    """
+
+    def __init__(self, namespace, write, flush_interval=0):
+        self.namespace = namespace
+        self.flush_interval = flush_interval
+        self._write = write
+        self._lock = threading.Lock()
+        # Dimensions -> metric name -> (unit, values)
+        self._pending = defaultdict(dict)
+        self._last_flush = time.monotonic()
+
+    def _emit(self, dimensions, metrics):
+        for document in documents(self.namespace, dict(dimensions), metrics):
+            self._write(document)
+
+    def add(self, dimensions, metrics):
+        """Add `metrics` (names and `(unit, value)` tuples) for `dimensions`."""
+        if not metrics:
+            return
+        if self.flush_interval <= 0:
+            self._emit(dimensions, metrics)
+            return
+
+        key = tuple(dimensions.items())
+        with self._lock:
+            pending = self._pending[key]
+            full = False
+            for name, (unit, value) in metrics.items():
+                values = pending.setdefault(name, (unit, []))[1]
+                values.append(value)
+                full = full or len(values) >= MAX_VALUES_PER_METRIC
+            if full:
+                del self._pending[key]
+
+        if full:
+            self._emit(key, pending)
+
+    def flush_if_due(self):
+        """Emit every aggregated metric if `flush_interval` has passed."""
+        with self._lock:
+            due = time.monotonic() - self._last_flush >= self.flush_interval
+        if due:
+            self.flush()
+
+    def flush(self):
+        """Emit every aggregated metric."""
+        with self._lock:
+            pending, self._pending = self._pending, defaultdict(dict)
+            self._last_flush = time.monotonic()
+        for key, metrics in pending.items():
+            self._emit(key, metrics)
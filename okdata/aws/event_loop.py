@@ -0,0 +1,57 @@
+import asyncio
+import inspect
+import threading
+from functools import wraps
+
+# One event loop per thread, kept between invocations so that anything bound
+# to it (such as the connections of an async HTTP client, or tasks left
+# running by the previous invocation) survives until the next one.
+_loops = threading.local()
+
+
+def _loop():
+    loop = getattr(_loops, "loop", None)
+    if loop is None or loop.is_closed():
+        loop = _loops.loop = asyncio.new_event_loop()
+    return loop
+
+
+def run(coroutine):
+    """Run `coroutine` to completion on the persistent loop of this thread.
+
+    Unlike `asyncio.run`, the loop isn't closed afterwards. Raises
+    `RuntimeError` if called from a running event loop.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return _loop().run_until_complete(coroutine)
+    coroutine.close()
+    raise RuntimeError("Can't run an async handler from a running event loop")
+
+
+def async_handler(handler):
+    """Return the async version of `handler`, or None if it's synchronous.
+
+    That is `handler` itself if it's a coroutine function, or the async
+    handler behind a synchronous entrypoint made by `sync_entrypoint`.
+    """
+    if inspect.iscoroutinefunction(handler):
+        return handler
+    return getattr(handler, "async_handler", None)
+
+
+def sync_entrypoint(handler):
+    """Return a synchronous Lambda entrypoint running the async `handler`.
+
+    The async handler is kept as `async_handler` on the entrypoint, so that
+    wrappers applied on top of it can wrap the async handler directly instead
+    of running one event loop inside another.
+    """
+
+    @wraps(handler)
+    def entrypoint(event, context):
+        return run(handler(event, context))
+
+    entrypoint.async_handler = handler
+    return entrypoint
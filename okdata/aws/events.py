@@ -0,0 +1,167 @@
+"""Extraction of log fields from the events of different event sources.
+
+Each event source is identified by a name, such as `http-api` or `aws:sqs`.
+The source of an event is detected by `event_source`, which only looks at a
+couple of keys of the event, and the fields are then extracted by the
+extractor registered for that source.
+"""
+
+API_GATEWAY = "api-gateway"
+HTTP_API = "http-api"
+ALB = "alb"
+EVENTBRIDGE = "eventbridge"
+STEP_FUNCTIONS = "step-functions"
+SQS = "aws:sqs"
+SNS = "aws:sns"
+S3 = "aws:s3"
+
+# Event source name -> extractor.
+_extractors = {}
+# Discriminators of event sources registered by users, checked before the
+# built-in ones.
+_discriminators = []
+
+
+def event_source(event):
+    """Return the name of the source of `event`, or None if it's unknown."""
+    for discriminator, source in _discriminators:
+        if discriminator(event):
+            return source
+
+    if not isinstance(event, dict):
+        return None
+
+    records = event.get("Records")
+    if records and isinstance(records, list) and isinstance(records[0], dict):
+        # SNS spells it `EventSource`.
+        return records[0].get("eventSource") or records[0].get("EventSource")
+
+    request_context = event.get("requestContext")
+    if request_context:
+        if "elb" in request_context:
+            return ALB
+        if "http" in request_context:
+            return HTTP_API
+        return API_GATEWAY
+
+    if "detail-type" in event:
+        return EVENTBRIDGE
+    if "execution_name" in event:
+        return STEP_FUNCTIONS
+    return None
+
+
+def register_extractor(source, extractor, discriminator=None):
+    """Register `extractor` for events from `source`.
+
+    `extractor` is called with the event and should return a dict of fields
+    to log. It replaces any extractor already registered for `source`, which
+    makes it possible to override the built-in ones.
+
+    `discriminator` is needed for sources not detected by `event_source`. It
+    is called with the event and should return true if the event is from
+    `source`. Keep it cheap, as it's called for every event.
+    """
+    _extractors[source] = extractor
+    if discriminator is not None:
+        _discriminators.append((discriminator, source))
+
+
+def extract(event):
+    """Return the fields extracted from `event` by the extractor of its source.
+
+    The fields include `event_source` when the source is known. Returns an
+    empty dict for API Gateway REST API events, as their fields are the
+    default request fields.
+    """
+    source = event_source(event)
+    extractor = _extractors.get(source)
+    if extractor is None:
+        return {}
+    fields = extractor(event)
+    if source != API_GATEWAY:
+        fields = {"event_source": source, **fields}
+    return fields
+
+
+def _api_gateway(event):
+    return {}
+
+
+def _http_api(event):
+    request_context = event["requestContext"]
+    http = request_context["http"]
+    authorizer = request_context.get("authorizer") or {}
+    claims = (authorizer.get("jwt") or {}).get("claims") or {}
+    fields = {
+        "request_resource": event.get("routeKey", ""),
+        "request_path": event.get("rawPath", http.get("path", "")),
+        "request_method": http.get("method", ""),
+        "source_ip": http.get("sourceIp"),
+    }
+    principal_id = claims.get("sub") or authorizer.get("principalId")
+    if principal_id:
+        fields["principal_id"] = principal_id
+    return fields
+
+
+def _alb(event):
+    headers = {k.lower(): v for k, v in (event.get("headers") or {}).items()}
+    forwarded_for = headers.get("x-forwarded-for")
+    return {
+        "request_path": event.get("path", ""),
+        "request_method": event.get("httpMethod", ""),
+        "source_ip": forwarded_for.split(",")[0].strip() if forwarded_for else None,
+        "alb_target_group_arn": event["requestContext"]["elb"].get("targetGroupArn"),
+    }
+
+
+def _sqs(event):
+    records = event["Records"]
+    return {
+        "record_count": len(records),
+        "sqs_queue_arn": records[0].get("eventSourceARN"),
+    }
+
+
+def _sns(event):
+    records = event["Records"]
+    return {
+        "record_count": len(records),
+        "sns_topic_arn": records[0].get("Sns", {}).get("TopicArn"),
+    }
+
+
+def _s3(event):
+    records = event["Records"]
+    s3 = records[0].get("s3", {})
+    return {
+        "record_count": len(records),
+        "s3_event_name": records[0].get("eventName"),
+        "s3_bucket": s3.get("bucket", {}).get("name"),
+        "s3_key": s3.get("object", {}).get("key"),
+    }
+
+
+def _eventbridge(event):
+    return {
+        "eventbridge_source": event.get("source"),
+        "eventbridge_detail_type": event.get("detail-type"),
+    }
+
+
+def _step_functions(event):
+    fields = {"execution_name": event.get("execution_name")}
+    if "task" in event:
+        fields["task"] = event["task"]
+    return fields
+
+
+register_extractor(API_GATEWAY, _api_gateway)
+register_extractor(HTTP_API, _http_api)
+register_extractor(ALB, _alb)
+register_extractor(SQS, _sqs)
+register_extractor(SNS, _sns)
+register_extractor(S3, _s3)
+register_extractor(EVENTBRIDGE, _eventbridge)
+register_extractor(STEP_FUNCTIONS, _step_functions)
@@ -0,0 +1,58 @@
+import sys
+import threading
+
+from okdata.aws.background import BackgroundWorker
+
+
+class LogWriter(BackgroundWorker):
+    """Render and write log lines from a background thread.
+
+    Event dicts are queued by `write` and rendered by running them through
+    `processors` (the last of which must return a string) on a single daemon
+    thread, which writes them to `file` in batches. Use `flush` to wait, for
+    a bounded amount of time, for the queued lines to be written.
+
+    At most `max_queue_size` lines are kept in memory. Lines that don't fit
+    in the queue are rendered and written by the caller instead, so that no
+    lines are dropped.
+
+    `file` defaults to whatever `sys.stdout` is at the time of writing.
+    """
+
+    def __init__(self, processors, file=None, max_queue_size=10000):
+        super().__init__("okdata-log-writer", max_queue_size)
+        self.processors = processors
+        self._file = file
+        # Serializes writes to `file` between the writer thread and callers
+        # writing synchronously because the queue is full.
+        self._write_lock = threading.Lock()
+
+    def _render(self, event_dict):
+        if type(event_dict) is str:
+            return event_dict
+        for processor in self.processors:
+            event_dict = processor(None, "msg", event_dict)
+        return event_dict
+
+    def _write_lines(self, lines):
+        file = self._file or sys.stdout
+        with self._write_lock:
+            file.write("".join(line + "\n" for line in lines))
+            file.flush()
+
+    def write(self, event_dict):
+        """Queue `event_dict` to be rendered and written.
+
+        Strings are taken to be rendered already, and are written as they are.
+        """
+        if not self.submit(event_dict):
+            self._write_lines([self._render(event_dict)])
+
+    def _process(self, items):
+        lines = []
+        for event_dict in items:
+            try:
+                lines.append(self._render(event_dict))
+            except Exception as e:
+                print(f"Error rendering log line: {e!r}", file=sys.stderr)
+        self._write_lines(lines)
@@ -1,84 +1,529 @@
+import asyncio
+import atexit
+import inspect
+import json
 import os
+import random
+import sys
+import threading
 import time
-from contextlib import asynccontextmanager
+import zlib
+from contextvars import ContextVar
 from copy import copy
 from functools import wraps
 
 import structlog
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.responses import JSONResponse, Response as StarletteResponse
-
-structlog.configure(
-    processors=[
-        structlog.processors.TimeStamper(fmt="iso"),
-        structlog.processors.format_exc_info,
-        structlog.processors.UnicodeDecoder(),
-        structlog.processors.JSONRenderer(),
-    ]
-)
+
+from okdata.aws import event_loop, events
+from okdata.aws.truncate import truncate, truncate_fields
+from okdata.aws.emf import UNIT_COUNT, UNIT_MILLISECONDS, MetricsEmitter
+from okdata.aws.log_writer import LogWriter
+from okdata.aws.redact import Redactor
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 logger = structlog.get_logger()
-_logger = None
-_start_time = None
+_base_loggers = {}
 
 COLD_START = True
 SERVICE_NAME = None
+# Whether to log a breakdown of where the time of each invocation went; see
+# `configure`.
+PHASE_TIMING = False
+# Whether to render log lines using `orjson` (when installed); see `configure`.
+FAST_JSON = False
+# Maximum time (in seconds) to wait for the background log writer to write
+# the lines of an invocation before returning.
+WRITER_FLUSH_TIMEOUT = 1.0
+# Fraction of successful, fast invocations to log; see `configure`.
+SAMPLE_RATE = 1.0
+# Invocations slower than this (in milliseconds) are always logged.
+SLOW_THRESHOLD_MS = 1000.0
 
+# Approximate maximum size (in characters) of each field logged per
+# invocation, and of all of them together; see `configure`. CloudWatch Logs
+# cuts log events larger than 256 KB.
+MAX_FIELD_SIZE = 16384
+MAX_LINE_SIZE = 131072
 
-def _logging_middleware(request, call_next):
-    async def async_handler(event, context):
-        global _start_time
+# Dimensions of the metrics emitted when EMF is enabled; see `configure`.
+EMF_DIMENSIONS = ("service_name", "function_stage")
 
-        _init_logger(async_handler, event, context)
-        _start_time = time.perf_counter_ns()
+# Fields holding the library's own instrumentation, which are keyed by the
+# names of AWS operations (`secretsmanager.GetSecretValue`), timed spans,
+# error types and fields rather than by anything secret, or are counters
+# named after what they count.
+_INSTRUMENTATION_FIELDS = (
+    "aws_calls",
+    "timings",
+    "batch_error_types",
+    "truncated_fields",
+    "status_token_refreshes",
+)
 
-        return _handle_response(await call_next(request))
+_writer = None
+_emf_emitter = None
+# Redacts secrets from every log line; see `configure`.
+_redactor = Redactor(exclude_fields=_INSTRUMENTATION_FIELDS)
+_sampling_lock = threading.Lock()
+_sampling_counts = {"logged": 0, "suppressed": 0}
 
-    return async_handler(
-        request.scope.get("aws.event", {}), request.scope.get("aws.context")
-    )
 
+def _orjson_dumps(obj, default=None, **kwargs):
+    try:
+        return orjson.dumps(
+            obj, default=default, option=orjson.OPT_NON_STR_KEYS
+        ).decode()
+    except TypeError:
+        # Values `orjson` can't handle, such as integers larger than 64 bits.
+        return json.dumps(obj, default=default, **kwargs)
 
-def _fastapi_lifespan_context(app):
-    # https://fastapi.tiangolo.com/advanced/events/#lifespan
 
-    global SERVICE_NAME
-    SERVICE_NAME = os.getenv("SERVICE_NAME")
+def _event_dict_to_kwargs(logger, method_name, event_dict):
+    return event_dict
+
+
+def _resolve_exc_info(logger, method_name, event_dict):
+    # `exc_info=True` refers to the exception being handled by the calling
+    # thread, so it has to be looked up before the event is handed over to
+    # the background writer.
+    if event_dict.get("exc_info") is True:
+        event_dict["exc_info"] = sys.exc_info()
+    return event_dict
+
+
+class _WriterLogger:
+    """Logger handing unrendered event dicts over to a `LogWriter`."""
+
+    def __init__(self, writer):
+        self._writer = writer
+
+    def msg(self, **event_dict):
+        self._writer.write(event_dict)
+
+    debug = info = warning = error = critical = exception = log = msg
+
+
+def _bound_exception(logger, method_name, event_dict):
+    # Exceptions are only rendered (by `format_exc_info`) after the fields
+    # of the invocation have been truncated, so they're bounded separately,
+    # before being scanned for secrets.
+    exception = event_dict.get("exception")
+    if type(exception) is str and len(exception) + 2 > MAX_FIELD_SIZE:
+        event_dict["exception"], notes = truncate(exception, MAX_FIELD_SIZE)
+        truncated = event_dict.get("truncated_fields")
+        if not isinstance(truncated, dict):
+            truncated = event_dict["truncated_fields"] = {}
+        truncated["exception"] = notes
+    return event_dict
+
+
+def _configure_structlog(async_writer=False):
+    global _writer
+
+    if FAST_JSON and orjson is not None:
+        renderer = structlog.processors.JSONRenderer(serializer=_orjson_dumps)
+    else:
+        renderer = structlog.processors.JSONRenderer()
+    render_processors = [structlog.processors.format_exc_info, _bound_exception]
+    if _redactor is not None:
+        render_processors.append(_redactor)
+    render_processors += [structlog.processors.UnicodeDecoder(), renderer]
+
+    if _writer is not None:
+        _writer.flush(WRITER_FLUSH_TIMEOUT)
+        _writer = None
+
+    if async_writer:
+        # Only the timestamp is taken on the calling thread, the rest of the
+        # processing is done by the writer.
+        _writer = LogWriter(render_processors)
+        structlog.configure(
+            processors=[
+                structlog.processors.TimeStamper(fmt="iso"),
+                _resolve_exc_info,
+                _event_dict_to_kwargs,
+            ],
+            logger_factory=lambda *args: _WriterLogger(_writer),
+        )
+    else:
+        structlog.configure(
+            processors=[structlog.processors.TimeStamper(fmt="iso")]
+            + render_processors,
+            logger_factory=structlog.PrintLoggerFactory(),
+        )
+    # Loggers bound using the previous configuration.
+    _base_loggers.clear()
+
+
+_configure_structlog()
+
+
+def configure(
+    phase_timing=None,
+    fast_json=None,
+    async_writer=None,
+    sample_rate=None,
+    slow_threshold_ms=None,
+    emf=None,
+    emf_namespace="okdata",
+    emf_dimensions=None,
+    emf_flush_interval=0,
+    max_field_size=None,
+    max_line_size=None,
+    redact_patterns=None,
+):
+    """Configure optional logging features.
+
+    `phase_timing`: Log the duration of each phase of the invocation (setup,
+    handler, time to first byte, status delivery and total) as `phase_*_ms`
+    fields.
+
+    `fast_json`: Render log lines using `orjson` when it's installed. Note
+    that non-ASCII characters are then written as UTF-8 instead of being
+    escaped.
+
+    `async_writer`: Render and write log lines from a background thread
+    instead of on the request path. The lines of each invocation are flushed
+    (waiting at most `WRITER_FLUSH_TIMEOUT` seconds) when it ends.
+
+    `sample_rate`: Fraction (between 0 and 1) of successful invocations to
+    log. Errors (exceptions and status codes of 500 and above) and
+    invocations slower than `slow_threshold_ms` milliseconds are always
+    logged. Whether an invocation is sampled is decided by its trace ID (or
+    request ID), so that correlated lines are kept or dropped together.
+
+    `emf`: Emit the metrics of each invocation (duration, cold start, and
+    those recorded by `log_dynamodb` and `log_duration`) as CloudWatch
+    Embedded Metric Format documents in namespace `emf_namespace`, with the
+    dimensions `emf_dimensions` (any of `service_name`, `function_name`,
+    `function_stage` and `handler_method`). With an `emf_flush_interval`
+    (in seconds), metrics are aggregated across invocations and emitted
+    together at the end of the first invocation after that much time has
+    passed; the metrics aggregated since then are lost if the execution
+    environment is shut down (use `flush_metrics` to emit them explicitly).
+    Metrics are emitted regardless of sampling.
+
+    `max_field_size`, `max_line_size`: Approximate maximum size (in
+    characters of JSON) of each field logged by an invocation, such as
+    `response_body` and those added by `log_add`, and of all of them
+    together. Longer strings are cut, lists and dicts are capped at 100
+    items, and bytes are summarized. The fields that were truncated are
+    listed in `truncated_fields`, along with what was dropped.
+
+    `redact_patterns`: Regular expressions matching the names of fields,
+    dict keys and query parameters whose values are secret, at any depth,
+    replacing the default patterns (see `okdata.aws.redact`). The values are
+    replaced by `[REDACTED]`, and JSON properties and parameters in
+    `response_body` and tracebacks are redacted too. An empty list turns
+    redaction off.
+
+    Options that aren't given are left unchanged.
+    """
+    global PHASE_TIMING, FAST_JSON, SAMPLE_RATE, SLOW_THRESHOLD_MS
+    global EMF_DIMENSIONS, MAX_FIELD_SIZE, MAX_LINE_SIZE, _emf_emitter, _redactor
+
+    if phase_timing is not None:
+        PHASE_TIMING = phase_timing
+    if sample_rate is not None:
+        if not 0 <= sample_rate <= 1:
+            raise ValueError("sample_rate must be between 0 and 1")
+        SAMPLE_RATE = sample_rate
+    if slow_threshold_ms is not None:
+        SLOW_THRESHOLD_MS = slow_threshold_ms
+    if emf is not None:
+        if _emf_emitter is not None:
+            _emf_emitter.flush()
+        _emf_emitter = None
+        if emf:
+            _emf_emitter = MetricsEmitter(emf_namespace, _write_emf, emf_flush_interval)
+    if emf_dimensions is not None:
+        EMF_DIMENSIONS = tuple(emf_dimensions)
+    if max_field_size is not None:
+        MAX_FIELD_SIZE = max_field_size
+    if max_line_size is not None:
+        MAX_LINE_SIZE = max_line_size
+    if redact_patterns is not None:
+        _redactor = (
+            Redactor(redact_patterns, exclude_fields=_INSTRUMENTATION_FIELDS)
+            if redact_patterns
+            else None
+        )
+    if fast_json is not None:
+        FAST_JSON = fast_json
+    if any(o is not None for o in (fast_json, async_writer, redact_patterns)):
+        if async_writer is None:
+            async_writer = _writer is not None
+        _configure_structlog(async_writer)
+
+
+def flush(timeout=None):
+    """Wait for buffered log lines to be written.
+
+    Waits at most `timeout` seconds, defaulting to `WRITER_FLUSH_TIMEOUT`.
+    Only has an effect when the background log writer is enabled. Return
+    true if everything was written in time.
+    """
+    if _writer is None:
+        return True
+    return _writer.flush(WRITER_FLUSH_TIMEOUT if timeout is None else timeout)
+
+
+def _flush_writer():
+    if _writer is not None:
+        _writer.flush(WRITER_FLUSH_TIMEOUT)
+
+
+async def _flush_writer_async():
+    # Waited for on another thread, so as not to block the event loop.
+    if _writer is not None:
+        await asyncio.to_thread(_writer.flush, WRITER_FLUSH_TIMEOUT)
+
+
+def _write_emf(document):
+    if FAST_JSON and orjson is not None:
+        line = _orjson_dumps(document)
+    else:
+        line = json.dumps(document)
+    # Written by the background writer when enabled, to keep the documents
+    # in order with the log lines.
+    if _writer is not None:
+        _writer.write(line)
+    else:
+        print(line, flush=True)
+
+
+def flush_metrics():
+    """Emit any metrics aggregated across invocations."""
+    if _emf_emitter is not None:
+        _emf_emitter.flush()
+        _flush_writer()
+
+
+def _flush_at_exit():
+    # The background writer is a daemon thread, so lines it hasn't written
+    # yet would be lost when the interpreter exits.
+    flush_metrics()
+    _flush_writer()
+
+
+atexit.register(_flush_at_exit)
+
+
+def _emit_metrics(invocation, fields):
+    metrics = invocation.metrics
+    metrics["duration_ms"] = (UNIT_MILLISECONDS, fields["duration_ms"])
+    metrics["cold_start"] = (UNIT_COUNT, int(fields["cold_start"]))
+    context = structlog.get_context(invocation.logger)
+    values = {
+        "service_name": SERVICE_NAME,
+        "function_name": context.get("function_name"),
+        "function_stage": fields.get("function_stage"),
+        "handler_method": context.get("handler_method"),
+    }
+    _emf_emitter.add({d: values.get(d) for d in EMF_DIMENSIONS}, metrics)
+
+
+def _add_metric(name, unit, value):
+    if _emf_emitter is not None:
+        invocation = _invocation.get()
+        if invocation is not None:
+            invocation.metrics[name] = (unit, value)
+
+
+def sampling_stats():
+    """Return the number of invocations logged and suppressed by sampling."""
+    with _sampling_lock:
+        return dict(_sampling_counts)
+
+
+def _sample_key(fields):
+    # Only the root of the trace ID, as the parent segment differs between
+    # the services taking part in the same trace.
+    trace_id = fields.get("aws_trace_id") or ""
+    return trace_id.split(";", 1)[0] or fields.get("aws_request_id")
+
+
+def _sampled(fields):
+    """Return whether the invocation with `fields` should be logged."""
+    if SAMPLE_RATE >= 1:
+        return True
+    if (
+        fields.get("level") == "error"
+        or "exc_info" in fields
+        or fields["duration_ms"] >= SLOW_THRESHOLD_MS
+    ):
+        keep = True
+    else:
+        key = _sample_key(fields)
+        if key:
+            keep = zlib.crc32(key.encode()) / 2**32 < SAMPLE_RATE
+        else:
+            keep = random.random() < SAMPLE_RATE
+        if keep:
+            fields["sample_rate"] = SAMPLE_RATE
+    with _sampling_lock:
+        _sampling_counts["logged" if keep else "suppressed"] += 1
+    return keep
+
+
+class _Invocation:
+    """Logging state of a single invocation (or request).
+
+    `fields` are the fields logged by the invocation so far, rendered together
+    with the fields bound to `logger` when the invocation is finalized.
+    """
+
+    __slots__ = ("logger", "fields", "metrics", "timings", "start_time", "init_time")
+
+    def __init__(self, logger, fields):
+        self.logger = logger
+        self.fields = fields
+        # Metric names and `(unit, value)` tuples, when EMF is enabled.
+        self.metrics = {}
+        # Span paths and their `_Timing`, recorded by `timed`.
+        self.timings = {}
+        self.start_time = None
+        # When phase timing is enabled: the time the invocation began, before
+        # the logging context was set up.
+        self.init_time = None
+
 
-    default_lifespan = app.router.lifespan_context
+# The invocation currently being handled. Kept in a context variable so that
+# concurrent requests served by the same event loop (or by different threads)
+# each log their own fields.
+_invocation = ContextVar("okdata_aws_logging_invocation", default=None)
 
-    @asynccontextmanager
-    async def _lifespan(app):
-        # Wrap the existing lifespan generator in order to not override
-        # any additional lifespan events configured for the app using
-        # `FastAPI(lifespan=...)`.
-        async with default_lifespan(app) as state:
-            yield state
 
-        # Take advantage of the fact that shutdown is called after each
-        # Lambda function invocation to finalize the logging after any
-        # exceptions are logged.
-        _finalize(_start_time)
+# Maximum number of bytes of error response bodies logged by the FastAPI
+# middleware.
+MAX_ERROR_BODY_SIZE = 1024
 
-    return _lifespan
+
+class _LoggingMiddleware:
+    """ASGI middleware logging every HTTP request to a FastAPI application.
+
+    The request is logged once the last part of the response body has been
+    sent, so that the duration covers streaming responses too.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        # The `handler_method` logged by earlier versions of the middleware
+        # is kept for continuity.
+        init_time = time.perf_counter_ns() if PHASE_TIMING else None
+        invocation = _init_logger(
+            "async_handler", scope.get("aws.event", {}), scope.get("aws.context")
+        )
+        fields = invocation.fields
+        token = _invocation.set(invocation)
+        invocation.start_time = time.perf_counter_ns()
+        if init_time is not None:
+            _start_phase_timing(invocation, init_time)
+
+        finalized = False
+        response_size = 0
+        error_body = None
+
+        async def send_wrapper(message):
+            nonlocal finalized, response_size, error_body
+
+            if message["type"] == "http.response.start":
+                if init_time is not None:
+                    _log_phase_since_start(invocation, "handler")
+                status_code = message["status"]
+                fields["response_status_code"] = status_code
+                fields["level"] = "info" if status_code < 500 else "error"
+                if status_code >= 400:
+                    error_body = bytearray()
+
+            await send(message)
+
+            if message["type"] == "http.response.body":
+                body = message.get("body", b"")
+                if init_time is not None and response_size == 0 and body:
+                    _log_phase_since_start(invocation, "ttfb")
+                response_size += len(body)
+                if error_body is not None:
+                    error_body += body[: MAX_ERROR_BODY_SIZE - len(error_body)]
+                if not message.get("more_body", False):
+                    fields["response_size_bytes"] = response_size
+                    if error_body:
+                        fields["response_body"] = error_body.decode(errors="replace")
+                    finalized = True
+                    _finalize(invocation)
+                    await _flush_writer_async()
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception as e:
+            if not finalized:
+                fields.update(exc_info=e, level="error")
+            raise e
+        finally:
+            _invocation.reset(token)
+            if not finalized:
+                _finalize(invocation)
+                await _flush_writer_async()
 
 
 def add_fastapi_logging(app):
-    app.router.lifespan_context = _fastapi_lifespan_context(app)
-    app.add_middleware(BaseHTTPMiddleware, dispatch=_logging_middleware)
+    from starlette.responses import JSONResponse
+
+    global SERVICE_NAME
+    SERVICE_NAME = os.getenv("SERVICE_NAME")
+
+    app.add_middleware(_LoggingMiddleware)
 
     @app.exception_handler(Exception)
     async def exception_handler(request, e):
-        global _logger
-        _logger = _logger.bind(exc_info=e, level="error")
+        # The exception itself is logged by the middleware.
         return JSONResponse(
             status_code=500, content={"detail": "Oops! Something went wrong!"}
         )
 
 
-def _init_logger(handler, event, context):
+def _base_logger(handler_name, context):
+    """Return a logger bound with the fields that are static for a container.
+
+    These fields are the same for every invocation handled by the same Lambda
+    container, so they're only bound once and the logger is cached.
+    """
+    function_name = getattr(context, "function_name", "")
+    function_version = getattr(context, "function_version", "")
+    memory_limit_in_mb = getattr(context, "memory_limit_in_mb", 0)
+
+    key = (
+        SERVICE_NAME,
+        handler_name,
+        function_name,
+        function_version,
+        memory_limit_in_mb,
+    )
+    base_logger = _base_loggers.get(key)
+    if base_logger is None:
+        base_logger = _base_loggers[key] = logger.bind(
+            service_name=SERVICE_NAME,
+            handler_method=handler_name,
+            function_name=function_name,
+            function_version=function_version,
+            git_rev=os.getenv("GIT_REV"),
+            memory_limit_in_mb=memory_limit_in_mb,
+        )
+    return base_logger
+
+
+def _init_logger(handler_name, event, context):
     global COLD_START
-    global _logger
 
     headers = event.get("headers", {}) or {}
     headers = {k.lower(): v for k, v in headers.items()}
@@ -89,75 +534,123 @@ def _init_logger(handler, event, context):
         domain_name = headers.get("host", None)
 
     authorizer = request_context.get("authorizer", {})
-    principal_id = authorizer.get("principalId", None)
-    if principal_id:
-        # Strip last characters of principal ID for privacy
-        principal_id = principal_id[0:-3] + "xxx"
+    principal_id = _mask_principal_id(authorizer.get("principalId", None))
 
     identity = request_context.get("identity", {})
-    source_ip = identity.get("sourceIp", None)
-    if source_ip:
-        # Strip final octet of IP address for privacy
-        source_ip = ".".join(source_ip.split(".")[0:-1]) + ".x"
-
-    _logger = logger.bind(
-        service_name=SERVICE_NAME,
-        handler_method=handler.__name__,
-        function_name=getattr(context, "function_name", ""),
-        function_version=getattr(context, "function_version", ""),
-        function_stage=request_context.get("stage", ""),
-        function_api_id=request_context.get("apiId", ""),
-        git_rev=os.getenv("GIT_REV"),
-        aws_account_id=request_context.get("accountId", ""),
-        aws_request_id=getattr(context, "aws_request_id", ""),
-        aws_trace_id=headers.get("x-amzn-trace-id", ""),
-        memory_limit_in_mb=getattr(context, "memory_limit_in_mb", 0),
-        logged_in=principal_id is not None,
-        principal_id=principal_id,
-        source_ip=source_ip,
-        request_domain_name=domain_name,
-        request_resource=event.get("resource", ""),
-        request_path=event.get("path", ""),
-        request_method=event.get("httpMethod", ""),
-        request_path_parameters=event.get("pathParameters", {}),
-        request_query_string_parameters=remove_secret_query_parameters(
-            event.get("queryStringParameters", {})
+    source_ip = _mask_source_ip(identity.get("sourceIp", None))
+
+    invocation = _Invocation(
+        _base_logger(handler_name, context),
+        dict(
+            function_stage=request_context.get("stage", ""),
+            function_api_id=request_context.get("apiId", ""),
+            aws_account_id=request_context.get("accountId", ""),
+            aws_request_id=getattr(context, "aws_request_id", ""),
+            aws_trace_id=headers.get("x-amzn-trace-id", ""),
+            logged_in=principal_id is not None,
+            principal_id=principal_id,
+            source_ip=source_ip,
+            request_domain_name=domain_name,
+            request_resource=event.get("resource", ""),
+            request_path=event.get("path", ""),
+            request_method=event.get("httpMethod", ""),
+            request_path_parameters=event.get("pathParameters", {}),
+            request_query_string_parameters=remove_secret_query_parameters(
+                event.get("queryStringParameters", {})
+            ),
+            cold_start=COLD_START,
         ),
-        cold_start=COLD_START,
     )
     COLD_START = False
 
+    try:
+        extracted = events.extract(event)
+    except Exception as e:
+        extracted = {"event_extraction_error": repr(e)}
+    if extracted:
+        if "principal_id" in extracted:
+            extracted["principal_id"] = _mask_principal_id(extracted["principal_id"])
+            extracted["logged_in"] = extracted["principal_id"] is not None
+        if "source_ip" in extracted:
+            extracted["source_ip"] = _mask_source_ip(extracted["source_ip"])
+        invocation.fields.update(extracted)
 
-def _finalize(start_time):
-    global _logger
-    duration_ms = (time.perf_counter_ns() - start_time) / 1000000.0
-    _logger.msg("", duration_ms=duration_ms)
-    _logger = None
+    return invocation
 
 
-def _handle_response(response):
-    global _logger
+def _mask_principal_id(principal_id):
+    if principal_id:
+        # Strip last characters of principal ID for privacy
+        return principal_id[0:-3] + "xxx"
+    return principal_id
+
 
+def _mask_source_ip(source_ip):
+    if source_ip:
+        # Strip final octet of IP address for privacy
+        return ".".join(source_ip.split(".")[0:-1]) + ".x"
+    return source_ip
+
+
+def _start_phase_timing(invocation, init_time):
+    invocation.init_time = init_time
+    invocation.fields["phase_init_ms"] = (invocation.start_time - init_time) / 1000000.0
+
+
+def _log_phase_since_start(invocation, phase):
+    invocation.fields[f"phase_{phase}_ms"] = (
+        time.perf_counter_ns() - invocation.start_time
+    ) / 1000000.0
+
+
+def _finalize(invocation):
+    fields = invocation.fields
+    end_time = time.perf_counter_ns()
+    fields["duration_ms"] = (end_time - invocation.start_time) / 1000000.0
+    if invocation.init_time is not None:
+        fields["phase_total_ms"] = (end_time - invocation.init_time) / 1000000.0
+    fields.pop("event", None)
+    if invocation.timings:
+        fields["timings"] = {
+            path: timing.as_dict() for path, timing in invocation.timings.items()
+        }
+        if _emf_emitter is not None:
+            for path, timing in invocation.timings.items():
+                invocation.metrics[path] = (
+                    UNIT_MILLISECONDS,
+                    timing.total_ns / 1000000.0,
+                )
+    if _emf_emitter is not None:
+        _emit_metrics(invocation, fields)
+    if _sampled(fields):
+        # Truncated before being redacted (when rendered), so that huge
+        # response bodies aren't scanned for secrets in full. Values cut off
+        # by the truncation are still redacted.
+        truncated = truncate_fields(fields, MAX_FIELD_SIZE, MAX_LINE_SIZE)
+        if truncated:
+            fields["truncated_fields"] = truncated
+        invocation.logger.msg("", **fields)
+    if _emf_emitter is not None:
+        # Aggregated metrics are only emitted as part of an invocation, as
+        # the execution environment may be frozen or shut down in between.
+        _emf_emitter.flush_if_due()
+
+
+def _handle_response(response):
+    fields = _invocation.get().fields
     status_code = None
     body = None
     if isinstance(response, dict) and "statusCode" in response:
-        # Regular Lambda function
         status_code = response["statusCode"]
         body = response.get("body", "")
-    elif isinstance(response, StarletteResponse):
-        # FastAPI application
-        status_code = response.status_code
-        # TODO Get body from different response types?
 
     if status_code:
-        _logger = _logger.bind(
-            response_status_code=status_code,
-            level="info" if status_code < 500 else "error",
-        )
+        fields["response_status_code"] = status_code
+        fields["level"] = "info" if status_code < 500 else "error"
         if status_code >= 400 and body:
-            _logger = _logger.bind(response_body=body)
+            fields["response_body"] = body
     else:
-        _logger = _logger.bind(level="info")
+        fields["level"] = "info"
 
     return response
 
@@ -188,22 +681,188 @@ def logging_wrapper(*args, **kwargs):
 
     handler = args[0]
 
+    async_handler = event_loop.async_handler(handler)
+    if async_handler is not None:
+
+        @wraps(handler)
+        async def async_wrapper(event, context):
+            invocation, token = _start_invocation(handler.__name__, event, context)
+            try:
+                response = await async_handler(event, context)
+                if invocation.init_time is not None:
+                    _log_phase_since_start(invocation, "handler")
+                return _handle_response(response)
+            except Exception as e:
+                invocation.fields.update(exc_info=e, level="error")
+                raise e
+            finally:
+                _invocation.reset(token)
+                _finalize(invocation)
+                await _flush_writer_async()
+
+        return event_loop.sync_entrypoint(async_wrapper)
+
     @wraps(handler)
     def wrapper(event, context):
-        global _logger
-        _init_logger(handler, event, context)
-        start_time = time.perf_counter_ns()
+        invocation, token = _start_invocation(handler.__name__, event, context)
         try:
-            return _handle_response(handler(event, context))
+            response = handler(event, context)
+            if invocation.init_time is not None:
+                _log_phase_since_start(invocation, "handler")
+            return _handle_response(response)
         except Exception as e:
-            _logger = _logger.bind(exc_info=e, level="error")
+            invocation.fields.update(exc_info=e, level="error")
             raise e
         finally:
-            _finalize(start_time)
+            _invocation.reset(token)
+            _finalize(invocation)
+            _flush_writer()
 
     return wrapper
 
 
+def _start_invocation(handler_name, event, context):
+    init_time = time.perf_counter_ns() if PHASE_TIMING else None
+    invocation = _init_logger(handler_name, event, context)
+    token = _invocation.set(invocation)
+    invocation.start_time = time.perf_counter_ns()
+    if init_time is not None:
+        _start_phase_timing(invocation, init_time)
+    return invocation, token
+
+
+_AWS_CALL_HOOK_ID = "okdata-aws-logging"
+
+
+def _aws_call_stats(key):
+    invocation = _invocation.get()
+    if invocation is None:
+        return None
+    aws_calls = invocation.fields.setdefault("aws_calls", {})
+    stats = aws_calls.get(key)
+    if stats is None:
+        stats = aws_calls[key] = {
+            "count": 0,
+            "errors": 0,
+            "retries": 0,
+            "total_ms": 0.0,
+            "max_ms": 0.0,
+            "status_codes": {},
+        }
+    return stats
+
+
+def _before_aws_call(context, **kwargs):
+    context["okdata_start_time"] = time.perf_counter_ns()
+
+
+def _on_aws_call_retry(attempts, request_dict, **kwargs):
+    # Called after every attempt, whether it's going to be retried or not.
+    request_dict["context"]["okdata_attempts"] = attempts
+
+
+def _record_aws_call(event_name, context):
+    # Event names are on the form `after-call.<service>.<operation>`.
+    stats = _aws_call_stats(event_name.split(".", 1)[1])
+    start_time = context.get("okdata_start_time")
+    if stats is None or start_time is None:
+        return None
+    duration_ms = (time.perf_counter_ns() - start_time) / 1000000.0
+    stats["count"] += 1
+    stats["total_ms"] += duration_ms
+    stats["max_ms"] = max(stats["max_ms"], duration_ms)
+    return stats
+
+
+def _after_aws_call(http_response, parsed, context, event_name, **kwargs):
+    stats = _record_aws_call(event_name, context)
+    if stats is None:
+        return
+
+    metadata = parsed.get("ResponseMetadata", {})
+    status_code = str(
+        getattr(http_response, "status_code", None) or metadata.get("HTTPStatusCode")
+    )
+    stats["status_codes"][status_code] = stats["status_codes"].get(status_code, 0) + 1
+    if "Error" in parsed:
+        stats["errors"] += 1
+    retries = metadata.get("RetryAttempts")
+    if retries is None:
+        retries = context.get("okdata_attempts", 1) - 1
+    stats["retries"] += retries
+
+    if event_name.startswith("after-call.dynamodb."):
+        consumed_capacity = parsed.get("ConsumedCapacity")
+        if isinstance(consumed_capacity, dict):
+            consumed_capacity = [consumed_capacity]
+        if consumed_capacity:
+            stats["consumed_capacity"] = stats.get("consumed_capacity", 0.0) + sum(
+                c.get("CapacityUnits", 0.0) for c in consumed_capacity
+            )
+        if "Count" in parsed:
+            item_count = parsed["Count"]
+        elif "Item" in parsed:
+            item_count = 1
+        else:
+            item_count = None
+        if item_count is not None:
+            stats["item_count"] = stats.get("item_count", 0) + item_count
+
+
+def _after_aws_call_error(context, event_name, **kwargs):
+    stats = _record_aws_call(event_name, context)
+    if stats is not None:
+        stats["errors"] += 1
+        stats["retries"] += context.get("okdata_attempts", 1) - 1
+
+
+def log_aws_calls(client_or_session):
+    """Log the AWS API calls made by `client_or_session`.
+
+    `client_or_session` may be a boto3 (or botocore) client, or a session, in
+    which case every client created from it afterwards is instrumented.
+    Calls made during an invocation are logged in the `aws_calls` field,
+    holding the number of calls, errors and retries per service and
+    operation, along with their total and maximum latency and the HTTP
+    status codes returned. DynamoDB calls also record the consumed capacity
+    (when requested using `ReturnConsumedCapacity`) and item count.
+
+    Calls made from threads that don't share the context of the invocation
+    are not logged. Instrumenting the same client or session more than once
+    has no effect.
+    """
+    if hasattr(client_or_session, "meta"):
+        events = client_or_session.meta.events
+        # First, so that the start time is recorded before e.g. a `Stubber`
+        # short-circuits the call.
+        events.register_first(
+            "before-call.*.*",
+            _before_aws_call,
+            unique_id=_AWS_CALL_HOOK_ID + "-before",
+        )
+    else:
+        # A boto3 session exposes its event system as `events`, while a
+        # botocore session can be registered on directly.
+        events = getattr(client_or_session, "events", client_or_session)
+        events.register(
+            "before-call.*.*",
+            _before_aws_call,
+            unique_id=_AWS_CALL_HOOK_ID + "-before",
+        )
+    events.register(
+        "needs-retry.*.*", _on_aws_call_retry, unique_id=_AWS_CALL_HOOK_ID + "-retry"
+    )
+    events.register(
+        "after-call.*.*", _after_aws_call, unique_id=_AWS_CALL_HOOK_ID + "-after"
+    )
+    events.register(
+        "after-call-error.*.*",
+        _after_aws_call_error,
+        unique_id=_AWS_CALL_HOOK_ID + "-error",
+    )
+    return client_or_session
+
+
 def log_dynamodb(f):
     start_time = time.perf_counter_ns()
     try:
@@ -214,27 +873,164 @@ def log_dynamodb(f):
 
         if "Count" in db_response:
             log_add(dynamodb_item_count=db_response["Count"])
+            _add_metric("dynamodb_item_count", UNIT_COUNT, db_response["Count"])
 
         return db_response
     finally:
         duration_ms = (time.perf_counter_ns() - start_time) / 1000000.0
         log_add(dynamodb_duration_ms=duration_ms)
+        _add_metric("dynamodb_duration_ms", UNIT_MILLISECONDS, duration_ms)
+
+
+class _Timing:
+    """Accumulated durations of every span with the same path."""
+
+    __slots__ = ("parent", "count", "total_ns", "min_ns", "max_ns")
+
+    def __init__(self, parent, duration_ns):
+        self.parent = parent
+        self.count = 1
+        self.total_ns = self.min_ns = self.max_ns = duration_ns
+
+    def add(self, duration_ns):
+        self.count += 1
+        self.total_ns += duration_ns
+        if duration_ns < self.min_ns:
+            self.min_ns = duration_ns
+        elif duration_ns > self.max_ns:
+            self.max_ns = duration_ns
+
+    def as_dict(self):
+        timing = {
+            "count": self.count,
+            "total_ms": self.total_ns / 1000000.0,
+            "min_ms": self.min_ns / 1000000.0,
+            "max_ms": self.max_ns / 1000000.0,
+        }
+        if self.parent is not None:
+            timing["parent"] = self.parent
+        return timing
+
+
+# Path of the innermost `timed` span currently running.
+_span = ContextVar("okdata_aws_logging_span", default=None)
+
+
+class timed:
+    """Time a block of code as a named span of the current invocation.
+
+    Usable as a decorator (of both regular and async functions), as a context
+    manager and as an async context manager:
+
+        @timed("process_record")
+        def process_record(record):
+            with timed("write"):
+                ...
+
+    Every span with the same name (and parent) is accumulated into a single
+    entry of the `timings` field of the invocation log, holding the number of
+    times it ran along with the total, minimum and maximum duration. Spans
+    started within another span are nested under it: the span `write` above
+    is logged as `process_record/write`, with `process_record` as its
+    parent. Spans that raise an exception are timed all the same.
+    """
+
+    __slots__ = ("name", "_path", "_parent", "_token", "_start_time")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self._parent = _span.get()
+        if self._parent is None:
+            self._path = self.name
+        else:
+            self._path = f"{self._parent}/{self.name}"
+        self._token = _span.set(self._path)
+        self._start_time = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        duration_ns = time.perf_counter_ns() - self._start_time
+        _span.reset(self._token)
+        invocation = _invocation.get()
+        if invocation is not None:
+            timing = invocation.timings.get(self._path)
+            if timing is None:
+                invocation.timings[self._path] = _Timing(self._parent, duration_ns)
+            else:
+                timing.add(duration_ns)
+        return False
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        return self.__exit__(exc_type, exc_value, traceback)
+
+    def __call__(self, f):
+        name = self.name
+
+        if inspect.iscoroutinefunction(f):
+
+            @wraps(f)
+            async def async_wrapper(*args, **kwargs):
+                async with timed(name):
+                    return await f(*args, **kwargs)
+
+            return async_wrapper
+
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            with timed(name):
+                return f(*args, **kwargs)
+
+        return wrapper
+
+
+def _log_duration_since(start_time, duration_field):
+    duration_ms = (time.perf_counter_ns() - start_time) / 1000000.0
+    log_add(**{duration_field: duration_ms})
+    _add_metric(duration_field, UNIT_MILLISECONDS, duration_ms)
+
+
+async def _log_awaited_duration(awaitable, start_time, duration_field):
+    try:
+        return await awaitable
+    finally:
+        _log_duration_since(start_time, duration_field)
 
 
 def log_duration(f, duration_field):
+    """Log the time it takes to call `f` as `duration_field`.
+
+    `f` may also be an awaitable, or return one, in which case an awaitable
+    is returned that logs the duration once it's done.
+    """
     start_time = time.perf_counter_ns()
+    if inspect.isawaitable(f):
+        return _log_awaited_duration(f, start_time, duration_field)
     try:
-        return f()
-    finally:
-        duration_ms = (time.perf_counter_ns() - start_time) / 1000000.0
-        log_add(**{duration_field: duration_ms})
+        result = f()
+    except BaseException:
+        _log_duration_since(start_time, duration_field)
+        raise
+    if inspect.isawaitable(result):
+        return _log_awaited_duration(result, start_time, duration_field)
+    _log_duration_since(start_time, duration_field)
+    return result
 
 
-def log_add(**kwargs):
-    global _logger
+def log_phase(phase, duration_ns):
+    """Log the duration of `phase` of the invocation, if phase timing is on."""
+    if PHASE_TIMING:
+        log_add(**{f"phase_{phase}_ms": duration_ns / 1000000.0})
+
 
-    if _logger:
-        _logger = _logger.bind(**kwargs)
+def log_add(**kwargs):
+    invocation = _invocation.get()
+    if invocation is not None:
+        invocation.fields.update(kwargs)
 
 
 def log_exception(e):
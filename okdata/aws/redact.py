@@ -0,0 +1,204 @@
+"""Redaction of secrets from log fields and status payloads.
+
+Values are redacted by key: the value of any dict key matching one of a set
+of patterns is replaced, however deeply it's nested. The patterns are
+compiled into a single regular expression, and the decision for each key is
+remembered, so that the cost per field doesn't grow with the number of
+patterns. Text fields such as response bodies are also scanned for JSON
+properties and query parameters with matching names.
+"""
+
+import re
+
+REDACTED = "[REDACTED]"
+
+# Regular expressions matched against any part of a key, in lower case.
+DEFAULT_PATTERNS = (
+    "token",
+    "passw(?:or)?d",
+    "secret",
+    "authorization",
+    "cookie",
+    "api[-_]?key",
+    "credential",
+    "private[-_]?key",
+)
+
+# Top-level fields containing text to scan for secrets.
+DEFAULT_TEXT_FIELDS = ("response_body", "exception")
+
+# A JSON property with a string value, and a query or form parameter, whose
+# names are checked for the patterns. A string value may be cut off by the
+# end of the text, as texts such as response bodies are often truncated.
+_JSON_PROPERTY = re.compile(
+    r'"(?P<name>[^"\\]*)"\s*:\s*(?P<value>"(?:[^"\\]|\\.)*(?:"|\\?\Z))'
+)
+_PARAMETER = re.compile(r"(?P<name>[\w.\-\[\]]*)=(?P<value>[^&;\s#\"]*)")
+_PARAMETER_NAME = re.compile(r"[\w.\-\[\]]*")
+_PARAMETER_NAME_CHAR = re.compile(r"[\w.\-\[\]]")
+
+# Maximum number of keys to remember the decision for, to bound the memory
+# used when keys are generated (such as IDs used as keys).
+MAX_CACHED_KEYS = 10000
+
+
+class Redactor:
+    """Replace the values of sensitive keys in nested dicts and lists.
+
+    Usable as a structlog processor. `patterns` are regular expressions, any
+    of which matching part of a key (converted to lower case) makes it
+    sensitive; they should thus be written in lower case. `text_fields` are
+    the top-level fields whose string values are scanned for secrets, while
+    `exclude_fields` are top-level fields left as they are.
+    """
+
+    def __init__(
+        self,
+        patterns=DEFAULT_PATTERNS,
+        replacement=REDACTED,
+        text_fields=DEFAULT_TEXT_FIELDS,
+        exclude_fields=(),
+    ):
+        self.replacement = replacement
+        self.text_fields = frozenset(text_fields)
+        self.exclude_fields = frozenset(exclude_fields)
+        # Matched against lower case keys and text, as case-insensitive
+        # matching is many times slower.
+        self._key_regex = re.compile("|".join(f"(?:{p})" for p in patterns))
+        self._decisions = {}
+
+    def sensitive(self, key):
+        """Return whether the value of `key` should be redacted."""
+        decision = self._decisions.get(key)
+        if decision is None:
+            decision = (
+                type(key) is str and self._key_regex.search(key.lower()) is not None
+            )
+            if len(self._decisions) < MAX_CACHED_KEYS:
+                self._decisions[key] = decision
+        return decision
+
+    def redact(self, value):
+        """Return `value` with the values of sensitive keys replaced.
+
+        Dicts and lists are only copied when something in them is redacted,
+        and `value` itself is never modified.
+        """
+        if isinstance(value, dict):
+            redacted = None
+            for key, item in value.items():
+                if self.sensitive(key):
+                    new_item = self.replacement
+                elif isinstance(item, (dict, list, tuple)):
+                    new_item = self.redact(item)
+                else:
+                    continue
+                if new_item is not item:
+                    if redacted is None:
+                        redacted = dict(value)
+                    redacted[key] = new_item
+            return value if redacted is None else redacted
+
+        if isinstance(value, (list, tuple)):
+            redacted = None
+            for i, item in enumerate(value):
+                if not isinstance(item, (dict, list, tuple)):
+                    continue
+                new_item = self.redact(item)
+                if new_item is not item:
+                    if redacted is None:
+                        redacted = list(value)
+                    redacted[i] = new_item
+            return value if redacted is None else redacted
+
+        return value
+
+    def _json_value(self, text, quote, hit):
+        match = _JSON_PROPERTY.match(text, quote)
+        if match is None or match.end("name") < hit.end():
+            return None
+        return match.start("value"), match.end("value"), f'"{self.replacement}"'
+
+    def _parameter_value(self, text, hit, floor):
+        """Return the value of the parameter whose name `hit` is part of.
+
+        Also returns the end of the name, which is not looked back beyond
+        `floor`.
+        """
+        start = hit.start()
+        while start > floor and _PARAMETER_NAME_CHAR.match(text, start - 1):
+            start -= 1
+        name_end = max(_PARAMETER_NAME.match(text, start).end(), hit.end())
+        if start > 0 and not (text[start - 1] in "?&;" or text[start - 1].isspace()):
+            return None, name_end
+        match = _PARAMETER.match(text, start)
+        if match is None or match.end("name") < hit.end():
+            return None, name_end
+        return (match.start("value"), match.end("value"), self.replacement), name_end
+
+    def redact_text(self, text):
+        """Return `text` with JSON properties and parameters redacted.
+
+        Only the mentions of the patterns found in `text` are looked into, so
+        texts without any are only scanned once. Each JSON property and
+        parameter name is looked into once, however many mentions it
+        contains, so that the time taken grows linearly with the text.
+        """
+        lower_text = text.lower()
+        hits = self._key_regex.finditer(lower_text)
+        hit = next(hits, None)
+        if hit is None:
+            return text
+        if len(lower_text) != len(text):
+            # Some characters change length in lower case, so the positions
+            # found don't correspond; give up on the text as a whole.
+            return self.replacement
+
+        parts = []
+        position = 0
+        # The last quote before the current mention, how far the text has
+        # been searched for it, and the last quote looked into.
+        quote = -1
+        quote_searched = 0
+        checked_quote = -1
+        # The end of the last parameter name looked into.
+        name_end = 0
+        while hit is not None:
+            hit_start = hit.start()
+            if hit_start >= position:
+                found = lower_text.rfind('"', quote_searched, hit_start)
+                if found >= 0:
+                    quote = found
+                quote_searched = hit_start
+
+                value = None
+                if quote > checked_quote:
+                    checked_quote = quote
+                    value = self._json_value(lower_text, quote, hit)
+                if value is None and hit_start >= name_end:
+                    value, name_end = self._parameter_value(
+                        lower_text, hit, max(name_end, position)
+                    )
+                if value is not None:
+                    start, end, replacement = value
+                    parts += [text[position:start], replacement]
+                    position = end
+            hit = next(hits, None)
+        parts.append(text[position:])
+        return "".join(parts)
+
+    def redact_fields(self, fields):
+        """Redact the values of the dict `fields` in place."""
+        for key, value in fields.items():
+            if key in self.exclude_fields:
+                continue
+            if self.sensitive(key):
+                fields[key] = self.replacement
+            elif isinstance(value, (dict, list, tuple)):
+                fields[key] = self.redact(value)
+            elif key in self.text_fields and type(value) is str:
+                fields[key] = self.redact_text(value)
+        return fields
+
+    def __call__(self, logger, method_name, event_dict):
+        return self.redact_fields(event_dict)
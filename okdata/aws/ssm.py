@@ -1,6 +1,266 @@
+import asyncio
+import logging
 import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
-import boto3
+log = logging.getLogger()
+
+# `GetParameters` accepts at most this many names per call.
+GET_PARAMETERS_MAX_NAMES = 10
+
+
+def _default_client_factory(region_name):
+    from okdata.aws.clients import get_client
+
+    return get_client("ssm", region_name)
+
+
+class SecretStore:
+    """In-memory cache of secrets (SecureStrings) fetched from SSM.
+
+    Clients are created once per region and reused. Values are cached for
+    `ttl` seconds, and at most `max_size` values are kept at once, evicting
+    the least recently used ones first.
+
+    `client_factory` is called with a region name and should return an SSM
+    client. It defaults to using the shared clients of `okdata.aws.clients`,
+    but can be replaced to e.g. inject a stubbed client in tests.
+    """
+
+    def __init__(self, ttl=300, max_size=256, client_factory=None):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._client_factory = client_factory or _default_client_factory
+        self._clients = {}
+        self._cache = OrderedDict()
+        self._lock = threading.RLock()
+        self._pending = {}
+        self._prefetch_ns = 0
+        self._prefetch_wait_ns = 0
+
+    @staticmethod
+    def _region(region_name):
+        return region_name or os.environ["AWS_REGION"]
+
+    def _client(self, region_name=None):
+        region_name = self._region(region_name)
+        with self._lock:
+            if region_name not in self._clients:
+                self._clients[region_name] = self._client_factory(region_name)
+            return self._clients[region_name]
+
+    # Cached values and pending prefetches are keyed by `(region_name, name)`,
+    # as the same name may refer to different parameters in different regions.
+
+    def _get_cached(self, key):
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._cache[key]
+                return None
+            self._cache.move_to_end(key)
+            return value
+
+    def _set_cached(self, key, value):
+        with self._lock:
+            self._cache[key] = (value, time.monotonic() + self.ttl)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+
+    def _wait_for_prefetch(self, key):
+        done = self._pending.get(key)
+        if done is not None and not done.is_set():
+            start_time = time.perf_counter_ns()
+            done.wait()
+            with self._lock:
+                self._prefetch_wait_ns += time.perf_counter_ns() - start_time
+
+    def _fetch_chunk(self, region_name, names):
+        """Fetch and cache `names`.
+
+        Returns a dict of the values found by requested name, and a list of
+        the names that don't exist.
+        """
+        response = self._client(region_name).get_parameters(
+            Names=names, WithDecryption=True
+        )
+        # Parameters requested with a version or label selector (`name:1`)
+        # or by ARN are returned under their plain name, with the selector
+        # and ARN given separately.
+        found = {}
+        for parameter in response["Parameters"]:
+            found[parameter["Name"]] = parameter["Value"]
+            if parameter.get("Selector"):
+                found[parameter["Name"] + parameter["Selector"]] = parameter["Value"]
+            if parameter.get("ARN"):
+                found[parameter["ARN"]] = parameter["Value"]
+
+        values = {}
+        invalid = list(response.get("InvalidParameters", []))
+        for name in names:
+            if name in found:
+                values[name] = found[name]
+                self._set_cached((region_name, name), found[name])
+            elif name not in invalid:
+                invalid.append(name)
+        return values, invalid
+
+    def get_secret(self, key, region_name=None):
+        """Return the secret stored under `key`, fetching it if necessary.
+
+        Blocks until any ongoing prefetch of `key` has completed.
+
+        Raises `botocore.exceptions.ClientError` if the parameter couldn't be
+        fetched.
+        """
+        region_name = self._region(region_name)
+        self._wait_for_prefetch((region_name, key))
+        value = self._get_cached((region_name, key))
+        if value is None:
+            response = self._client(region_name).get_parameter(
+                Name=key, WithDecryption=True
+            )
+            value = response["Parameter"]["Value"]
+            self._set_cached((region_name, key), value)
+        return value
+
+    def get_secrets(self, keys, region_name=None):
+        """Return a dict of the secrets stored under each of `keys`.
+
+        Uncached secrets are fetched in as few `GetParameters` calls as
+        possible. Raises `botocore.exceptions.ClientError` with the error code
+        `ParameterNotFound` if any of the parameters don't exist.
+        """
+        region_name = self._region(region_name)
+        secrets = {}
+        missing = []
+        for key in dict.fromkeys(keys):
+            self._wait_for_prefetch((region_name, key))
+            value = self._get_cached((region_name, key))
+            if value is None:
+                missing.append(key)
+            else:
+                secrets[key] = value
+
+        for i in range(0, len(missing), GET_PARAMETERS_MAX_NAMES):
+            chunk = missing[i : i + GET_PARAMETERS_MAX_NAMES]
+            values, invalid = self._fetch_chunk(region_name, chunk)
+            if invalid:
+                from botocore.exceptions import ClientError
+
+                raise ClientError(
+                    {
+                        "Error": {
+                            "Code": "ParameterNotFound",
+                            "Message": "Parameters not found: {}".format(
+                                ", ".join(invalid)
+                            ),
+                        }
+                    },
+                    "GetParameters",
+                )
+            secrets.update(values)
+
+        return {key: secrets[key] for key in keys}
+
+    def get_secrets_by_path(self, path, recursive=True, region_name=None):
+        """Return a dict of every secret stored under `path`.
+
+        All the fetched secrets are cached, making this suitable for
+        prefetching every secret a function needs at cold start.
+        """
+        region_name = self._region(region_name)
+        paginator = self._client(region_name).get_paginator("get_parameters_by_path")
+        secrets = {}
+        for page in paginator.paginate(
+            Path=path, Recursive=recursive, WithDecryption=True
+        ):
+            for parameter in page["Parameters"]:
+                self._set_cached((region_name, parameter["Name"]), parameter["Value"])
+                secrets[parameter["Name"]] = parameter["Value"]
+        return secrets
+
+    def prefetch(self, keys, region_name=None, max_workers=4):
+        """Start fetching the secrets stored under `keys` in the background.
+
+        Meant to be called during the Lambda init phase so that the SSM
+        round-trips overlap with the rest of the initialization instead of
+        being paid on the first invocation. Secrets that are requested before
+        the prefetch has finished block until it's done. Returns the
+        background thread.
+        """
+        # Errors due to a missing region are logged by the prefetch thread.
+        region_name = region_name or os.getenv("AWS_REGION")
+        done = threading.Event()
+        with self._lock:
+            keys = [
+                k for k in dict.fromkeys(keys) if (region_name, k) not in self._pending
+            ]
+            for key in keys:
+                self._pending[(region_name, key)] = done
+
+        thread = threading.Thread(
+            target=self._prefetch,
+            args=(keys, region_name, max_workers, done),
+            name="okdata-ssm-prefetch",
+            daemon=True,
+        )
+        thread.start()
+        return thread
+
+    def _prefetch(self, keys, region_name, max_workers, done):
+        start_time = time.perf_counter_ns()
+        try:
+            chunks = [
+                keys[i : i + GET_PARAMETERS_MAX_NAMES]
+                for i in range(0, len(keys), GET_PARAMETERS_MAX_NAMES)
+            ]
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                for _, invalid in executor.map(
+                    lambda chunk: self._fetch_chunk(region_name, chunk), chunks
+                ):
+                    if invalid:
+                        log.warning(f"Could not prefetch secrets: {invalid}")
+        except Exception as e:
+            # Secrets that failed to prefetch are fetched (and their errors
+            # raised) on first use instead.
+            log.warning(f"Secret prefetch failed: {e}")
+        finally:
+            with self._lock:
+                self._prefetch_ns += time.perf_counter_ns() - start_time
+                for key in keys:
+                    self._pending.pop((region_name, key), None)
+            done.set()
+
+    def prefetch_stats(self):
+        """Return timings of the prefetching done so far, in milliseconds.
+
+        `prefetch_overlap_ms` is the part of the prefetching that ran in
+        parallel with other work, while `prefetch_wait_ms` is the time spent
+        blocking on it.
+        """
+        with self._lock:
+            prefetch_ms = self._prefetch_ns / 1000000.0
+            wait_ms = self._prefetch_wait_ns / 1000000.0
+        return {
+            "prefetch_duration_ms": prefetch_ms,
+            "prefetch_wait_ms": wait_ms,
+            "prefetch_overlap_ms": max(prefetch_ms - wait_ms, 0.0),
+        }
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+
+_store = SecretStore()
 
 
 def get_secret(key):
@@ -13,6 +273,64 @@ def get_secret(key):
     fetched for some reason, such as missing permissions or that it doesn't
     exist.
     """
-    client = boto3.client("ssm", region_name=os.environ["AWS_REGION"])
-    response = client.get_parameter(Name=key, WithDecryption=True)
-    return response["Parameter"]["Value"]
+    return _store.get_secret(key)
+
+
+def get_secrets(keys):
+    """Return a dict of secrets from SSM stored under each of `keys`.
+
+    See `get_secret` for details.
+    """
+    return _store.get_secrets(keys)
+
+
+async def get_secret_async(key):
+    """Like `get_secret`, but without blocking the event loop.
+
+    The secret is fetched from a worker thread, so that it can be awaited
+    concurrently with other I/O.
+    """
+    return await asyncio.get_running_loop().run_in_executor(None, get_secret, key)
+
+
+async def get_secrets_async(keys):
+    """Like `get_secrets`, but without blocking the event loop."""
+    return await asyncio.get_running_loop().run_in_executor(None, get_secrets, keys)
+
+
+def get_secrets_by_path(path, recursive=True):
+    """Return a dict of every secret from SSM stored under `path`.
+
+    See `get_secret` for details.
+    """
+    return _store.get_secrets_by_path(path, recursive=recursive)
+
+
+def prefetch_secrets(keys=None):
+    """Start fetching secrets from SSM in the background.
+
+    Call this at module level in the Lambda handler module to resolve the
+    secrets during the init phase. When `keys` isn't given, the keys are read
+    from the comma separated environment variable `PREFETCH_SECRETS`.
+
+    This is done automatically when `okdata.aws.ssm` is imported if
+    `PREFETCH_SECRETS` is set.
+    """
+    if keys is None:
+        keys = [
+            k.strip() for k in os.getenv("PREFETCH_SECRETS", "").split(",") if k.strip()
+        ]
+    if keys:
+        return _store.prefetch(keys)
+
+
+def prefetch_stats():
+    """Return timings of the secret prefetching done so far.
+
+    See `SecretStore.prefetch_stats` for details.
+    """
+    return _store.prefetch_stats()
+
+
+if os.getenv("PREFETCH_SECRETS"):
+    prefetch_secrets()
@@ -1,4 +1,10 @@
-from .wrapper import status_wrapper, status_add
+from .wrapper import status_wrapper, status_add, status_get
 from .model import TraceStatus, TraceEventStatus
 
-__all__ = ["status_wrapper", "status_add", "TraceStatus", "TraceEventStatus"]
+__all__ = [
+    "status_wrapper",
+    "status_add",
+    "status_get",
+    "TraceStatus",
+    "TraceEventStatus",
+]
@@ -1,4 +1,4 @@
-from dataclasses import asdict, dataclass, field
+from dataclasses import asdict, dataclass, fields
 from datetime import datetime, timezone
 from enum import Enum
 from json import dumps, JSONEncoder
@@ -25,7 +25,68 @@ class StatusJSONEncoder(JSONEncoder):
         return super().default(obj)
 
 
+_PLAIN_TYPES = frozenset([str, int, float, bool])
+
+
+def _jsonable(value, exclude_none):
+    """Return `value` converted to JSON serializable types.
+
+    Converts the same types as `StatusJSONEncoder`, in addition to enums and
+    nested models.
+    """
+    if type(value) in _PLAIN_TYPES or value is None:
+        return value
+    if isinstance(value, BaseModel):
+        return value.json_dict(exclude_none)
+    if isinstance(value, dict):
+        return {k: _jsonable(v, exclude_none) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_jsonable(v, exclude_none) for v in value]
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, Exception):
+        return str(value)
+    return value
+
+
+def _build_json_dict(cls):
+    """Generate a function converting instances of `cls` to a JSON ready dict.
+
+    The generated function reads every field directly in one pass instead of
+    going through `asdict`, which deep-copies every value, followed by a JSON
+    round-trip.
+    """
+    lines = ["def json_dict(self, exclude_none):", "    d = {}"]
+    for f in fields(cls):
+        lines += [
+            f"    v = self.{f.name}",
+            "    if type(v) in _PLAIN_TYPES:",
+            f"        d[{f.name!r}] = v",
+            "    elif v is not None:",
+            f"        d[{f.name!r}] = _jsonable(v, exclude_none)",
+            "    elif not exclude_none:",
+            f"        d[{f.name!r}] = None",
+        ]
+    lines.append("    return d")
+
+    namespace = {}
+    exec(
+        "\n".join(lines),
+        {"_jsonable": _jsonable, "_PLAIN_TYPES": _PLAIN_TYPES},
+        namespace,
+    )
+    return namespace["json_dict"]
+
+
+# Generated `json_dict` functions per model class.
+_json_dict_functions = {}
+
+
 class BaseModel:
+    __slots__ = ()
+
     def dict(self, exclude_none=False):
         if exclude_none:
             return asdict(
@@ -34,9 +95,17 @@ class BaseModel:
             )
         return asdict(self)
 
+    def json_dict(self, exclude_none=False):
+        """Return the model as a dict of JSON serializable values."""
+        cls = type(self)
+        json_dict = _json_dict_functions.get(cls)
+        if json_dict is None:
+            json_dict = _json_dict_functions[cls] = _build_json_dict(cls)
+        return json_dict(self, exclude_none)
+
     def json(self, exclude_none=False, **kwargs):
         return dumps(
-            self.dict(exclude_none=exclude_none),
+            self.json_dict(exclude_none=exclude_none),
             cls=StatusJSONEncoder,
             **kwargs,
         )
@@ -46,7 +115,7 @@ class BaseModel:
         return cls(**obj)
 
 
-@dataclass
+@dataclass(slots=True)
 class StatusMeta(BaseModel):
     function_name: Optional[str] = None
     function_version: Optional[str] = None
@@ -56,17 +125,56 @@ class StatusMeta(BaseModel):
     git_branch: Optional[str] = None
 
 
+def _validate_errors(errors):
+    if not isinstance(errors, list):
+        raise TypeError("`errors` must be provided as a list.")
+
+    for error in errors:
+        if not isinstance(error, dict):
+            raise TypeError(f"{error} is not a dict.")
+        if "message" not in error:
+            raise ValueError("Missing key 'message'.")
+        if not isinstance(error["message"], dict):
+            raise TypeError("error['message'] is not a dict.")
+        if "nb" not in error["message"]:
+            raise ValueError("Missing key 'nb' in error['message'].")
+
+
+def _validated_field(name, validate):
+    """Class decorator validating values assigned to the field `name`.
+
+    Replaces the slot of the field with a property calling `validate` on
+    every value other than `None` before storing it, so that assigning the
+    other fields doesn't pay for the validation.
+    """
+
+    def decorator(cls):
+        slot = cls.__dict__[name]
+
+        def set_value(self, value):
+            if value is not None:
+                validate(value)
+            slot.__set__(self, value)
+
+        setattr(cls, name, property(slot.__get__, set_value))
+        return cls
+
+    return decorator
+
+
 # TODO: Rework optional vs required and defaults when currents users are updated
 # and if to be used as a basis for the status api. Both trace_id (for new traces)
 # and trace_event_id are currently generated in status-api.
-@dataclass
+@_validated_field("errors", _validate_errors)
+@dataclass(slots=True)
 class StatusData(BaseModel):
     trace_id: Optional[str] = None  # TODO: Generate here as default?
     # trace_event_id: UUID = None  # = Field(default_factory=uuid4)
     domain: str = "N/A"  # TODO: Temporary default (required)
     domain_id: Optional[str] = None
-    start_time: datetime = field(default_factory=lambda: datetime.now(timezone.utc))
-    end_time: datetime = field(default_factory=lambda: datetime.now(timezone.utc))
+    # Both default to the time of creation; see `__post_init__`.
+    start_time: datetime = None
+    end_time: datetime = None
     trace_status: TraceStatus = TraceStatus.CONTINUE
     trace_event_status: TraceEventStatus = TraceEventStatus.OK
     user: Optional[str] = None
@@ -79,20 +187,10 @@ class StatusData(BaseModel):
     exception: Optional[str] = None
     errors: Optional[List] = None
 
-    def __setattr__(self, name, value):
-        # Validate and ensure format of errors
-        if name == "errors" and value is not None:
-            if not isinstance(value, list):
-                raise TypeError("`errors` must be provided as a list.")
-
-            for error in value:
-                if not isinstance(error, dict):
-                    raise TypeError(f"{error} is not a dict.")
-                if "message" not in error:
-                    raise ValueError("Missing key 'message'.")
-                if not isinstance(error["message"], dict):
-                    raise TypeError("error['message'] is not a dict.")
-                if "nb" not in error["message"]:
-                    raise ValueError("Missing key 'nb' in error['message'].")
-
-        super().__setattr__(name, value)
+    def __post_init__(self):
+        if self.start_time is None or self.end_time is None:
+            now = datetime.now(timezone.utc)
+            if self.start_time is None:
+                self.start_time = now
+            if self.end_time is None:
+                self.end_time = now
@@ -1,58 +1,388 @@
+import asyncio
 import json
 import logging
+import threading
+import weakref
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, fields, replace
 from datetime import datetime, timezone
-from typing import Dict, Union
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Union
 
-from okdata.sdk.config import Config
-from okdata.sdk.status import Status as StatusSDK
-from requests.exceptions import HTTPError, RetryError
+from okdata.aws.redact import Redactor
+from okdata.aws.truncate import truncate_fields
 
 from .model import StatusData
 
+if TYPE_CHECKING:
+    from okdata.sdk.config import Config
+
 log = logging.getLogger()
 
+# Approximate maximum size (in characters of JSON) of each of the free-form
+# fields of status events, and of all of them together. Larger values are
+# truncated, and what was dropped is noted under `truncated` in the status
+# body.
+MAX_FIELD_SIZE = 65536
+MAX_PAYLOAD_SIZE = 262144
+# Redacts secrets from the free-form fields of status events (see
+# `okdata.aws.redact`), or None to send them as they are.
+REDACTOR = Redactor()
+_FREE_FORM_FIELDS = ("status_body", "exception", "errors")
+
+
+def _httpx():
+    """Return the `httpx` module, or None if it isn't installed."""
+    try:
+        import httpx
+    except ImportError:
+        return None
+    return httpx
+
+
+def _http_errors():
+    from requests.exceptions import HTTPError, RetryError
+
+    httpx = _httpx()
+    if httpx is None:
+        return (HTTPError, RetryError)
+    return (HTTPError, RetryError, httpx.HTTPError)
+
+
+def _bound_payload(payload):
+    """Truncate and redact the free-form fields of `payload` in place."""
+    fields = {k: payload[k] for k in _FREE_FORM_FIELDS if k in payload}
+    # Truncated first, so that huge exceptions aren't scanned for secrets in
+    # full. Values cut off by the truncation are still redacted.
+    truncated = truncate_fields(fields, MAX_FIELD_SIZE, MAX_PAYLOAD_SIZE)
+    if REDACTOR is not None:
+        REDACTOR.redact_fields(fields)
+    payload.update(fields)
+    if not truncated:
+        return
+    status_body = payload.get("status_body")
+    if status_body is None:
+        payload["status_body"] = {"truncated": truncated}
+    elif isinstance(status_body, dict):
+        status_body["truncated"] = truncated
+
+
+def _as_status_data(status_data):
+    if isinstance(status_data, str):
+        # TODO: Remove in future - for backwards-compatibility:
+        # Status-class used directly in state-machine-event only(?),
+        # passes trace_id
+        status_data = StatusData(trace_id=status_data)
+    if isinstance(status_data, dict):
+        status_data = StatusData.parse_obj(status_data)
+    return status_data
+
+
+class _StatusClient:
+    """Status SDK instance reusing its HTTP connections and access token.
+
+    The SDK normally sets up a new session (and thus new connections) for
+    every request. Sessions are instead created once per retry setting here,
+    with a connection pool large enough for `pool_size` concurrent requests.
+
+    Keeps count of access token refreshes and new connections made, to make
+    it possible to verify that they're actually reused.
+    """
+
+    def __init__(self, sdk_config=None, pool_size=10):
+        from okdata.sdk.status import Status as StatusSDK
+
+        self.pool_size = pool_size
+        self.token_refreshes = 0
+        self._sessions = {}
+        # Async HTTP clients are bound to the event loop they're used from.
+        self._async_clients = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+        self.sdk = StatusSDK(sdk_config)
+        self.sdk.prepared_request_with_retries = self._session
+
+        refresh_access_token = self.sdk.auth.refresh_access_token
+
+        def counting_refresh_access_token():
+            if self.sdk.auth.token_provider:
+                self.token_refreshes += 1
+            return refresh_access_token()
+
+        self.sdk.auth.refresh_access_token = counting_refresh_access_token
+
+    def _session(self, retries):
+        from okdata.sdk.status import Status as StatusSDK
+        from requests.adapters import HTTPAdapter
+
+        with self._lock:
+            if retries not in self._sessions:
+                session = StatusSDK.prepared_request_with_retries(retries)
+                adapter = HTTPAdapter(
+                    pool_connections=self.pool_size,
+                    pool_maxsize=self.pool_size,
+                    max_retries=session.get_adapter("https://").max_retries,
+                )
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                self._sessions[retries] = session
+            return self._sessions[retries]
+
+    @property
+    def new_connections(self):
+        with self._lock:
+            sessions = list(self._sessions.values())
+        pool_managers = [s.get_adapter("https://").poolmanager for s in sessions]
+        return sum(
+            pm.pools[key].num_connections
+            for pm in pool_managers
+            for key in pm.pools.keys()
+        )
+
+    def update_status(self, trace_id, payload, retries=0):
+        return self.sdk.update_status(trace_id, payload, retries=retries)
+
+    def _async_client(self, httpx):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            client = self._async_clients.get(loop)
+            if client is None:
+                client = self._async_clients[loop] = httpx.AsyncClient(
+                    limits=httpx.Limits(
+                        max_connections=self.pool_size,
+                        max_keepalive_connections=self.pool_size,
+                    )
+                )
+            return client
+
+    async def update_status_async(self, trace_id, payload):
+        """Send `payload` to the status API without blocking the event loop.
+
+        Uses `httpx` when it's installed, and otherwise sends it using
+        `update_status` from a worker thread.
+        """
+        loop = asyncio.get_running_loop()
+        httpx = _httpx()
+        if httpx is None:
+            return await loop.run_in_executor(
+                None, self.update_status, trace_id, payload
+            )
+
+        url = "{}/{}".format(self.sdk.config.get("statusApiUrl"), trace_id)
+        # Fetching the headers may refresh the access token, which is done
+        # synchronously by the SDK.
+        headers = await loop.run_in_executor(None, self.sdk.headers)
+        response = await self._async_client(httpx).post(
+            url, json=payload, headers=headers
+        )
+        response.raise_for_status()
+        return response.json()
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def _shared_client(sdk_config=None, pool_size=10):
+    """Return a process-wide status client for `sdk_config`.
+
+    Clients are kept for the lifetime of the process, so that warm Lambda
+    invocations can skip setting up connections and fetching tokens.
+    """
+    config_key = None
+    if sdk_config is not None:
+        config_key = json.dumps(sdk_config.config, sort_keys=True, default=str)
+    key = (config_key, pool_size)
+    with _clients_lock:
+        if key not in _clients:
+            _clients[key] = _StatusClient(sdk_config, pool_size)
+        return _clients[key]
+
 
 class Status:
     def __init__(
         self,
         status_data: Union[StatusData, Dict, str],
-        sdk_config: Config = None,
+        sdk_config: "Config" = None,
     ):
-        if isinstance(status_data, str):
-            # TODO: Remove in future - for backwards-compatibility:
-            # Status-class used directly in state-machine-event only(?),
-            # passes trace_id
-            status_data = StatusData(trace_id=status_data)
-        if isinstance(status_data, dict):
-            status_data = StatusData.parse_obj(status_data)
+        self.status_data = _as_status_data(status_data)
+        self._client = _shared_client(sdk_config)
+        self._sdk = self._client.sdk
 
-        self.status_data = status_data
-        self._sdk = StatusSDK(sdk_config)
-
-    def _process_payload(self):
+    def _payload(self):
         if self.status_data.trace_id is None:
             log.warning(
                 "dataplatform.status: status_data.trace_id is None, will not process payload"
             )
+            return None
+        payload = self.status_data.json_dict(exclude_none=True)
+        _bound_payload(payload)
+        log.info(f"Sending payload to status API: {payload}")
+        return payload
+
+    def _log_response(self, response):
+        log.info(
+            f"Response from status API: {response} "
+            f"(token_refreshes={self._client.token_refreshes}, "
+            f"new_connections={self._client.new_connections})"
+        )
+
+    def _process_payload(self):
+        payload = self._payload()
+        if payload is None:
             return {}
 
-        payload = json.loads(self.status_data.json(exclude_none=True))
+        try:
+            response = self._client.update_status(self.status_data.trace_id, payload)
+            self._log_response(response)
+            return response
+        except _http_errors() as e:
+            log.error(f"Status API error: {e}")
+            return None
+
+    async def _process_payload_async(self):
+        payload = self._payload()
+        if payload is None:
+            return {}
 
         try:
-            log.info(f"Sending payload to status API: {payload}")
-            response = self._sdk.update_status(self.status_data.trace_id, payload)
-            log.info(f"Response from status API: {response}")
+            response = await self._client.update_status_async(
+                self.status_data.trace_id, payload
+            )
+            self._log_response(response)
             return response
-        except (HTTPError, RetryError) as e:
+        except _http_errors() as e:
             log.error(f"Status API error: {e}")
             return None
 
     def add(self, **kwargs):
+        fields = self.status_data.__dataclass_fields__
         for key, value in kwargs.items():
-            setattr(self.status_data, key, value)
+            if key in fields:
+                setattr(self.status_data, key, value)
+            else:
+                log.warning(f"dataplatform.status: Ignoring unknown field {key}")
 
-    def done(self):
+    def done(self, sender=None):
         # TODO: Currently in use by state-machine-event. Mark internal ("_")
         # or remove once updated (DP-1259)?
         self.status_data.end_time = datetime.now(timezone.utc)
+        if sender is not None and sender.submit(self):
+            # Delivered in the background by `sender`; fall back to sending
+            # it synchronously if it couldn't be queued.
+            return None
         return self._process_payload()
+
+    async def done_async(self):
+        """Like `done`, but sends the status event without blocking the loop."""
+        self.status_data.end_time = datetime.now(timezone.utc)
+        return await self._process_payload_async()
+
+
+@dataclass
+class StatusBatchResult:
+    status_data: StatusData
+    response: Optional[Any] = None
+    error: Optional[Exception] = None
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+def _coalesce(events):
+    """Merge `events`, all for the same trace, into a single event.
+
+    Fields set in later events (i.e. not left at their default) replace those
+    of earlier ones, the way `Status.add` updates a single event. The merged
+    event starts when the first event started and ends when the last one
+    ended.
+    """
+    if len(events) == 1:
+        return events[0]
+    merged = replace(events[0])
+    for status_data in events[1:]:
+        for f in fields(StatusData):
+            value = getattr(status_data, f.name)
+            if f.name not in ("start_time", "end_time") and value != f.default:
+                setattr(merged, f.name, value)
+    merged.end_time = events[-1].end_time
+    return merged
+
+
+class StatusBatch:
+    """Collect many status events and send them to the status API together.
+
+    Meant for handlers processing batches of records, where sending one
+    event per record as it's done would add up to many sequential
+    round-trips. The events are grouped by trace ID; events belonging to the
+    same trace are sent in the order they were added, while different traces
+    are sent concurrently (at most `max_concurrency` requests at a time) over
+    a shared connection pool.
+
+    With `coalesce`, the events of each trace are merged into one (see
+    `_coalesce`) and sent in a single request instead. This is off by
+    default, as the status API records every event it receives, and merging
+    them drops the intermediate ones from the trace.
+    """
+
+    def __init__(self, sdk_config: "Config" = None, max_concurrency=4, coalesce=False):
+        self.max_concurrency = max_concurrency
+        self.coalesce = coalesce
+        self._client = _shared_client(sdk_config, pool_size=max_concurrency)
+        self._events: List[StatusData] = []
+
+    def __len__(self):
+        return len(self._events)
+
+    def add(self, status_data: Union[StatusData, Dict, str]):
+        status_data = _as_status_data(status_data)
+        status_data.end_time = datetime.now(timezone.utc)
+        self._events.append(status_data)
+        return status_data
+
+    def _send_trace(self, events):
+        from requests.exceptions import RequestException
+
+        groups = [events] if self.coalesce else [[event] for event in events]
+        results = []
+        for group in groups:
+            status_data = _coalesce([event for _, event in group])
+            try:
+                payload = status_data.json_dict(exclude_none=True)
+                _bound_payload(payload)
+                outcome = {
+                    "response": self._client.update_status(
+                        status_data.trace_id, payload
+                    )
+                }
+            except RequestException as e:
+                log.error(f"Status API error for trace {status_data.trace_id}: {e}")
+                outcome = {"error": e}
+            results += [(i, StatusBatchResult(event, **outcome)) for i, event in group]
+        return results
+
+    def send(self) -> List[StatusBatchResult]:
+        """Send every collected event, returning one result per event.
+
+        The results are in the same order as the events were added. Events
+        without a trace ID are not sent, and are reported with a `ValueError`.
+        Coalesced events share the result of the request they were sent in.
+        """
+        events, self._events = self._events, []
+        results = [None] * len(events)
+        traces = defaultdict(list)
+        for i, status_data in enumerate(events):
+            if status_data.trace_id is None:
+                results[i] = StatusBatchResult(
+                    status_data, error=ValueError("status_data.trace_id is None")
+                )
+            else:
+                traces[status_data.trace_id].append((i, status_data))
+
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            for trace_results in executor.map(self._send_trace, traces.values()):
+                for i, result in trace_results:
+                    results[i] = result
+
+        return results
@@ -0,0 +1,60 @@
+import logging
+import time
+
+from okdata.aws.background import BackgroundWorker
+
+log = logging.getLogger()
+
+
+class StatusSender(BackgroundWorker):
+    """Deliver status events to the status API from a background thread.
+
+    Events are queued by `submit` and sent in order by a single daemon
+    thread, so that the HTTP round-trip (including any retries) doesn't have
+    to be waited on in full by the caller. Use `flush` to wait, for a bounded
+    amount of time, for the queued events to be delivered, and
+    `delivery_timings` for the time they spent queued and being delivered.
+    """
+
+    def __init__(self, max_queue_size=100):
+        super().__init__("okdata-status-sender", max_queue_size)
+        self._queued_ns = 0
+        self._delivery_ns = 0
+
+    def submit(self, status):
+        """Queue `status` for delivery.
+
+        Return false if the event couldn't be queued, in which case it's up to
+        the caller to deliver it synchronously instead.
+        """
+        return super().submit((status, time.perf_counter_ns()))
+
+    def _process(self, items):
+        for status, enqueued_at in items:
+            started_at = time.perf_counter_ns()
+            try:
+                status._process_payload()
+            except Exception as e:
+                log.exception(f"Error delivering status in background: {e}")
+            finally:
+                delivered_at = time.perf_counter_ns()
+                with self._lock:
+                    self._queued_ns += started_at - enqueued_at
+                    self._delivery_ns += delivered_at - started_at
+
+    def delivery_timings(self):
+        """Return the time spent on the events delivered since the last call.
+
+        Returns a dict of the total time (in milliseconds) the events spent
+        queued (`status_queued_ms`) and being delivered (`status_delivery_ms`),
+        or an empty dict if no events were delivered.
+        """
+        with self._lock:
+            queued_ns, delivery_ns = self._queued_ns, self._delivery_ns
+            self._queued_ns = self._delivery_ns = 0
+        if not (queued_ns or delivery_ns):
+            return {}
+        return {
+            "status_queued_ms": queued_ns / 1000000.0,
+            "status_delivery_ms": delivery_ns / 1000000.0,
+        }
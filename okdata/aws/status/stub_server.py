@@ -0,0 +1,188 @@
+import json
+import random
+import threading
+import time
+from collections import Counter, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StatusAPIStub:
+    """An in-process stand-in for the status API.
+
+    Accepts status events posted to `{url}/{trace_id}` (which is what
+    `okdata.sdk.status.Status.update_status` does), so that the cost of
+    `status_wrapper` can be measured and tested without the real API. Use
+    `sdk_config` for an SDK configuration pointing at it.
+
+    `latency`: Time (in seconds) to wait before responding, plus up to
+    `jitter` seconds more, drawn at random.
+
+    `error_rate`: Fraction (between 0 and 1) of requests answered by an
+    internal server error.
+
+    `rate_limit`: Maximum number of requests accepted per second. Requests
+    beyond it are answered by `429 Too Many Requests`.
+
+    The events accepted are collected in `payloads`, and `stats` reports the
+    number of requests, responses per status code, retries and payload
+    sizes. A request is counted as a retry when the previous request for the
+    same trace failed.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, rate_limit=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.payloads = []
+        self._lock = threading.Lock()
+        self._random = random.Random(0)
+        self._request_times = deque()
+        self._failed_traces = set()
+        self._server = None
+        self.reset()
+
+    def reset(self):
+        """Forget the events and statistics collected so far."""
+        with self._lock:
+            self.payloads.clear()
+            self._request_times.clear()
+            self._failed_traces.clear()
+            self._requests = 0
+            self._retries = 0
+            self._responses = Counter()
+            self._payload_sizes = []
+
+    def stats(self):
+        """Return the statistics collected since the stub was (re)set."""
+        with self._lock:
+            sizes = self._payload_sizes
+            return {
+                "requests": self._requests,
+                "retries": self._retries,
+                "responses": dict(self._responses),
+                "payload_bytes_total": sum(sizes),
+                "payload_bytes_max": max(sizes, default=0),
+                "payload_bytes_mean": sum(sizes) / len(sizes) if sizes else 0,
+            }
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/status"
+
+    def sdk_config(self, **config):
+        """Return an SDK configuration sending status events to the stub.
+
+        No client credentials are configured, so no access token is fetched.
+        """
+        from okdata.sdk.config import Config
+
+        return Config(
+            config={
+                "cacheCredentials": False,
+                "env": "dev",
+                "statusApiUrl": self.url,
+                **config,
+            }
+        )
+
+    def _status_code(self, trace_id, now):
+        """Decide how to answer a request, and record it."""
+        with self._lock:
+            self._requests += 1
+            if trace_id in self._failed_traces:
+                self._retries += 1
+
+            if self.rate_limit is not None:
+                while self._request_times and now - self._request_times[0] >= 1:
+                    self._request_times.popleft()
+                throttled = len(self._request_times) >= self.rate_limit
+                if not throttled:
+                    self._request_times.append(now)
+            else:
+                throttled = False
+
+            if throttled:
+                status_code = 429
+            elif self.error_rate and self._random.random() < self.error_rate:
+                status_code = 500
+            else:
+                status_code = 200
+
+            self._responses[status_code] += 1
+            if status_code == 200:
+                self._failed_traces.discard(trace_id)
+            else:
+                self._failed_traces.add(trace_id)
+            delay = self.latency
+            if self.jitter:
+                delay += self._random.random() * self.jitter
+            return status_code, delay
+
+    def _record(self, payload, size):
+        with self._lock:
+            self.payloads.append(payload)
+            self._payload_sizes.append(size)
+
+    def start(self):
+        """Start serving from a background thread. Return the stub itself."""
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # Otherwise the body, written separately from the headers, waits
+            # for the client's delayed ACK (40 ms on Linux).
+            disable_nagle_algorithm = True
+
+            def _respond(self, status_code, body):
+                body = json.dumps(body).encode()
+                self.send_response(status_code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                if status_code == 429:
+                    self.send_header("Retry-After", "1")
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                prefix, _, trace_id = self.path.rpartition("/")
+                if prefix != "/status" or not trace_id:
+                    self._respond(404, {"message": "Not Found"})
+                    return
+
+                status_code, delay = stub._status_code(trace_id, time.monotonic())
+                if delay:
+                    time.sleep(delay)
+                if status_code != 200:
+                    self._respond(status_code, {"message": "Stubbed error"})
+                    return
+                stub._record(json.loads(body), len(body))
+                self._respond(200, {"trace_id": trace_id})
+
+            def log_message(self, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(
+            target=self._server.serve_forever,
+            kwargs={"poll_interval": 0.01},
+            name="okdata-status-api-stub",
+            daemon=True,
+        ).start()
+        return self
+
+    def stop(self):
+        """Stop serving."""
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
@@ -1,9 +1,11 @@
+import asyncio
 import logging
 import os
+import sys
 import time
 from functools import wraps
 
-from requests.exceptions import HTTPError
+from okdata.aws import event_loop
 
 from .model import (
     StatusData,
@@ -12,16 +14,45 @@ from .model import (
     TraceStatus,
 )
 from .sdk import Status
+from .sender import StatusSender
 
 _status_logger = None
+_sender = StatusSender()
 
+# Time (in milliseconds) to leave for the Lambda runtime after flushing
+# status events delivered in the background.
+FLUSH_MARGIN_MS = 100
+
+
+def status_wrapper(sdk_config=None, background=False, flush_timeout=1.0):
+    """Decorate a Lambda handler to report its execution to the status API.
+
+    With `background=True` the status event is delivered from a background
+    thread. The wrapper waits at most `flush_timeout` seconds (bounded by the
+    remaining execution time of the invocation) for it to be delivered before
+    returning; events that are still pending are delivered when the function
+    is thawed by its next invocation.
+
+    Async handlers are supported as well, and deliver the status event using
+    an async HTTP client (when `httpx` is installed) on the event loop the
+    handler runs on.
+    """
 
-def status_wrapper(sdk_config=None):
     def _status_wrapper(handler):
+        async_handler = event_loop.async_handler(handler)
+        if async_handler is not None:
+            return event_loop.sync_entrypoint(
+                _async_status_wrapper(
+                    handler, async_handler, sdk_config, background, flush_timeout
+                )
+            )
+
         @wraps(handler)
         def wrapper(event, context):
             global _status_logger
 
+            from requests.exceptions import HTTPError
+
             _status_logger = Status(
                 _status_from_lambda_context(event, context), sdk_config
             )
@@ -40,22 +71,121 @@ def status_wrapper(sdk_config=None):
                 end_time = time.perf_counter_ns()
                 duration_ms = (end_time - start_time) / 1000000.0
                 _status_logger.add(duration=duration_ms)
+                delivery_start_time = time.perf_counter_ns()
+                client = _status_logger._client
                 try:
-                    _status_logger.done()
+                    _status_logger.done(sender=_sender if background else None)
                 except HTTPError as e:
                     logging.exception(f"Error response from status API: {e}")
                 _status_logger = None
 
+                if background and not _sender.flush(
+                    _flush_timeout(context, flush_timeout)
+                ):
+                    logging.warning(
+                        f"{_sender.pending} status event(s) not yet delivered, "
+                        "delivering them on the next invocation"
+                    )
+                if background:
+                    _log_add(**_sender.delivery_timings())
+                _log_client_counters(client)
+                _log_phase(
+                    "status_delivery", time.perf_counter_ns() - delivery_start_time
+                )
+
         return wrapper
 
     return _status_wrapper
 
 
+def _async_status_wrapper(
+    handler, async_handler, sdk_config, background, flush_timeout
+):
+    @wraps(handler)
+    async def wrapper(event, context):
+        global _status_logger
+
+        _status_logger = Status(_status_from_lambda_context(event, context), sdk_config)
+        _status_logger.add(operation=handler.__name__)
+
+        start_time = time.perf_counter_ns()
+        try:
+            return await async_handler(event, context)
+        except Exception as e:
+            _status_logger.add(exception=e)
+            _status_logger.add(trace_event_status=TraceEventStatus.FAILED)
+            _status_logger.add(trace_status=TraceStatus.FINISHED)
+            raise e
+        finally:
+            end_time = time.perf_counter_ns()
+            duration_ms = (end_time - start_time) / 1000000.0
+            _status_logger.add(duration=duration_ms)
+            delivery_start_time = time.perf_counter_ns()
+            client = _status_logger._client
+            delivery = asyncio.ensure_future(_status_logger.done_async())
+            _status_logger = None
+
+            if background:
+                # Deliveries that aren't done in time are left running on the
+                # (persistent) event loop, and finish on the next invocation.
+                done, _ = await asyncio.wait(
+                    {delivery}, timeout=_flush_timeout(context, flush_timeout)
+                )
+                if not done:
+                    logging.warning(
+                        "Status event not yet delivered, "
+                        "delivering it on the next invocation"
+                    )
+            else:
+                await delivery
+            _log_client_counters(client)
+            _log_phase("status_delivery", time.perf_counter_ns() - delivery_start_time)
+
+    return wrapper
+
+
+def _flush_timeout(context, flush_timeout):
+    get_remaining_time = getattr(context, "get_remaining_time_in_millis", None)
+    if get_remaining_time is None:
+        return flush_timeout
+    remaining_ms = get_remaining_time() - FLUSH_MARGIN_MS
+    return max(min(flush_timeout, remaining_ms / 1000.0), 0)
+
+
+def _log_phase(phase, duration_ns):
+    # Only log phase timings when `okdata.aws.logging` is already in use, so
+    # as not to import it (and configure structlog) as a side effect.
+    logging_module = sys.modules.get("okdata.aws.logging")
+    if logging_module is not None:
+        logging_module.log_phase(phase, duration_ns)
+
+
+def _log_add(**fields):
+    logging_module = sys.modules.get("okdata.aws.logging")
+    if logging_module is not None and fields:
+        logging_module.log_add(**fields)
+
+
+def _log_client_counters(client):
+    # Totals for the process-wide client, i.e. since the last cold start.
+    _log_add(
+        status_token_refreshes=client.token_refreshes,
+        status_new_connections=client.new_connections,
+    )
+
+
 def status_add(**kwargs):
     if _status_logger:
         _status_logger.add(**kwargs)
 
 
+def status_get(key, default=None):
+    """Return the value of `key` added to the current status event so far."""
+    if _status_logger:
+        return getattr(_status_logger.status_data, key, default)
+    return default
+
+
 def _status_from_lambda_context(event, context):
     request_context = event.get("requestContext") or {}
     authorizer = request_context.get("authorizer") or {}
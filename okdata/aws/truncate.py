@@ -0,0 +1,183 @@
+"""Bounded copies of large values, for logging them or sending them on.
+
+Sizes are approximate numbers of characters of JSON output (as rendered by
+`json.dumps` with its default separators), estimated while walking the values
+instead of by serializing them. Strings are cut, lists and dicts are capped
+at a number of items and at the remaining size, bytes that don't fit are
+replaced by a summary, and structures nested too deeply are summarized. A
+note is kept of everything that was dropped.
+"""
+
+# Maximum number of items kept of each list or dict.
+MAX_ITEMS = 100
+# Lists and dicts nested deeper than this are summarized.
+MAX_DEPTH = 10
+# Maximum number of notes kept per value about what was dropped.
+MAX_NOTES = 3
+
+# Estimated size of numbers, booleans, None and other scalars.
+_SCALAR_SIZE = 8
+
+
+class _Budget:
+    __slots__ = ("remaining", "max_items", "notes", "dropped")
+
+    def __init__(self, max_size, max_items):
+        self.remaining = max_size
+        self.max_items = max_items
+        self.notes = []
+        self.dropped = 0
+
+    def drop(self, note):
+        self.dropped += 1
+        if len(self.notes) < MAX_NOTES:
+            self.notes.append(note)
+
+
+def _bound(value, budget, depth):
+    value_type = type(value)
+
+    if value_type is str:
+        size = len(value) + 2
+        if size <= budget.remaining:
+            budget.remaining -= size
+            return value
+        keep = max(budget.remaining - 2, 0)
+        budget.remaining -= keep + 2
+        budget.drop(f"string of {len(value)} characters cut to {keep}")
+        return value[:keep]
+
+    if value_type in (int, float, bool) or value is None:
+        budget.remaining -= _SCALAR_SIZE
+        return value
+
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        size = value.nbytes if value_type is memoryview else len(value)
+        # Rendered as their `repr`, which is at least three characters longer.
+        if size + 5 <= budget.remaining:
+            budget.remaining -= size + 5
+            return value
+        summary = f"<{size} bytes>"
+        budget.remaining -= len(summary) + 2
+        budget.drop(f"{size} bytes summarized")
+        return summary
+
+    if isinstance(value, dict):
+        if depth >= MAX_DEPTH:
+            summary = f"<dict of {len(value)} items>"
+            budget.remaining -= len(summary) + 2
+            budget.drop(f"dict nested deeper than {MAX_DEPTH} levels summarized")
+            return summary
+        budget.remaining -= 2
+        bounded = {}
+        for key, item in value.items():
+            if len(bounded) == budget.max_items or budget.remaining <= 0:
+                budget.drop(f"dict of {len(value)} items cut to {len(bounded)}")
+                break
+            budget.remaining -= len(key) + 6 if type(key) is str else _SCALAR_SIZE
+            bounded[key] = _bound(item, budget, depth + 1)
+        return bounded
+
+    if isinstance(value, (list, tuple)):
+        if depth >= MAX_DEPTH:
+            summary = f"<list of {len(value)} items>"
+            budget.remaining -= len(summary) + 2
+            budget.drop(f"list nested deeper than {MAX_DEPTH} levels summarized")
+            return summary
+        budget.remaining -= 2
+        bounded = []
+        for item in value:
+            if len(bounded) == budget.max_items or budget.remaining <= 0:
+                budget.drop(f"list of {len(value)} items cut to {len(bounded)}")
+                break
+            budget.remaining -= 2
+            bounded.append(_bound(item, budget, depth + 1))
+        return bounded
+
+    # Anything else (exceptions, datetimes, enums and so on) is left as it
+    # is, as its rendering is up to the renderer.
+    budget.remaining -= _SCALAR_SIZE
+    return value
+
+
+def _notes(budget):
+    notes = list(budget.notes)
+    if budget.dropped > len(notes):
+        notes.append(f"{budget.dropped - len(notes)} more")
+    return notes
+
+
+def truncate(value, max_size, max_items=MAX_ITEMS):
+    """Return `value` bounded to about `max_size` characters of JSON.
+
+    Also returns a list of notes about what was dropped, which is empty if
+    `value` was within the bounds. Lists and dicts are copied rather than
+    modified, while tuples are returned as lists.
+    """
+    budget = _Budget(max_size, max_items)
+    value = _bound(value, budget, 0)
+    return value, _notes(budget)
+
+
+def _size_cap(sizes, available):
+    """Return the largest size to cut `sizes` down to to fit in `available`.
+
+    Returns None if they fit as they are.
+    """
+    if sum(sizes) <= available:
+        return None
+    sizes = sorted(sizes)
+    for i, size in enumerate(sizes):
+        remaining_count = len(sizes) - i
+        if size * remaining_count > available:
+            return max(available // remaining_count, 0)
+        available -= size
+    return None
+
+
+def truncate_fields(fields, max_field_size, max_size, max_items=MAX_ITEMS):
+    """Bound the values of the dict `fields` in place.
+
+    Each value is bounded to about `max_field_size` characters of JSON, and
+    all of them together to about `max_size` characters. When they don't
+    fit, the largest values are cut down first, to a common size, so that
+    small fields (such as the log level and status code) are kept as they
+    are. Returns a dict of the names of the fields that were truncated and
+    notes about what was dropped, which is empty if every value was within
+    the bounds.
+    """
+    sizes = {}
+    # The original values of those that were bounded, to bound them again
+    # from scratch if they have to be cut further.
+    originals = {}
+    truncated = {}
+    keys_size = 0
+    for key, value in fields.items():
+        keys_size += len(key) + 6 if type(key) is str else _SCALAR_SIZE
+        # Short strings and scalars, by far the most common values.
+        if type(value) is str and len(value) + 2 <= max_field_size:
+            sizes[key] = len(value) + 2
+            continue
+        if type(value) in (int, float, bool) or value is None:
+            continue
+
+        budget = _Budget(max_field_size, max_items)
+        fields[key] = _bound(value, budget, 0)
+        originals[key] = value
+        sizes[key] = max_field_size - budget.remaining
+        if budget.dropped:
+            truncated[key] = _notes(budget)
+
+    # Scalars can't be cut, so their size is set aside along with the keys.
+    scalars_size = (len(fields) - len(sizes)) * _SCALAR_SIZE
+    cap = _size_cap(list(sizes.values()), max_size - keys_size - scalars_size)
+    if cap is None:
+        return truncated
+
+    for key, size in sizes.items():
+        if size <= cap:
+            continue
+        budget = _Budget(cap, max_items)
+        fields[key] = _bound(originals.get(key, fields[key]), budget, 0)
+        truncated[key] = _notes(budget)
+    return truncated
@@ -0,0 +1,56 @@
+import threading
+import time
+
+from okdata.aws.background import BackgroundWorker
+
+
+class Collector(BackgroundWorker):
+    def __init__(self, max_queue_size=100):
+        super().__init__("test-worker", max_queue_size)
+        self.batches = []
+
+    def _process(self, items):
+        if "fail" in items:
+            raise ValueError("fail!")
+        self.batches.append(items)
+
+
+def test_processed_in_order():
+    worker = Collector()
+    for n in range(100):
+        assert worker.submit(n)
+
+    assert worker.flush(5)
+    assert worker.pending == 0
+    assert [n for batch in worker.batches for n in batch] == list(range(100))
+
+
+def test_submit_full_queue():
+    release = threading.Event()
+
+    class Blocked(Collector):
+        def _process(self, items):
+            release.wait()
+
+    worker = Blocked(max_queue_size=1)
+    assert worker.submit(1)
+    # Wait for the worker thread to take the first item off the queue.
+    while not worker._queue.empty():
+        time.sleep(0.001)
+    assert worker.submit(2)
+    assert not worker.submit(3)
+    assert worker.pending == 2
+
+    release.set()
+    assert worker.flush(5)
+
+
+def test_error_does_not_stop_worker(capsys):
+    worker = Collector()
+    worker.submit("fail")
+    assert worker.flush(5)
+    worker.submit("ok")
+    assert worker.flush(5)
+
+    assert worker.batches == [["ok"]]
+    assert "Error in test-worker: ValueError('fail!')" in capsys.readouterr().err
@@ -0,0 +1,184 @@
+import json
+import re
+import threading
+from time import sleep
+
+import pytest
+
+import okdata.aws.logging
+from okdata.aws.batch import process_batch
+from okdata.aws.logging import log_add, logging_wrapper
+from okdata.aws.status import status_add, status_wrapper
+
+
+def _sqs_event(n, queue="my-queue"):
+    return {
+        "Records": [
+            {
+                "messageId": f"message-{i}",
+                "body": json.dumps({"n": i}),
+                "eventSource": "aws:sqs",
+                "eventSourceARN": f"arn:aws:sqs:eu-west-1:123456789012:{queue}",
+            }
+            for i in range(n)
+        ]
+    }
+
+
+def _fail_on(*numbers):
+    def handler(record):
+        n = json.loads(record["body"])["n"]
+        if n in numbers:
+            raise ValueError(f"Bad record {n}")
+
+    return handler
+
+
+def test_process_batch():
+    processed = []
+
+    assert process_batch(_sqs_event(3), processed.append) == {"batchItemFailures": []}
+    assert [r["messageId"] for r in processed] == [
+        "message-0",
+        "message-1",
+        "message-2",
+    ]
+
+
+def test_process_batch_failures():
+    response = process_batch(_sqs_event(5), _fail_on(1, 3))
+
+    assert response == {
+        "batchItemFailures": [
+            {"itemIdentifier": "message-1"},
+            {"itemIdentifier": "message-3"},
+        ]
+    }
+
+
+def test_process_batch_fifo():
+    processed = []
+
+    def handler(record):
+        processed.append(record["messageId"])
+        _fail_on(1)(record)
+
+    response = process_batch(_sqs_event(4, queue="my-queue.fifo"), handler, 8)
+
+    assert processed == ["message-0", "message-1"]
+    assert response == {
+        "batchItemFailures": [
+            {"itemIdentifier": "message-1"},
+            {"itemIdentifier": "message-2"},
+            {"itemIdentifier": "message-3"},
+        ]
+    }
+
+
+def test_process_batch_kinesis():
+    event = {
+        "Records": [
+            {"kinesis": {"sequenceNumber": str(i), "data": ""}} for i in range(3)
+        ]
+    }
+
+    processed = []
+
+    def handler(record):
+        processed.append(record["kinesis"]["sequenceNumber"])
+        if record["kinesis"]["sequenceNumber"] == "1":
+            raise ValueError()
+
+    assert process_batch(event, handler, max_workers=4) == {
+        "batchItemFailures": [{"itemIdentifier": "1"}, {"itemIdentifier": "2"}]
+    }
+    assert processed == ["0", "1"]
+
+
+def test_process_batch_unsupported():
+    with pytest.raises(ValueError):
+        process_batch({"Records": [{"foo": "bar"}]}, lambda record: None)
+
+
+def test_process_batch_concurrently():
+    threads = set()
+
+    def handler(record):
+        threads.add(threading.current_thread())
+        sleep(0.01)
+        _fail_on(7)(record)
+
+    response = process_batch(_sqs_event(20), handler, max_workers=4)
+
+    assert len(threads) == 4
+    assert response == {"batchItemFailures": [{"itemIdentifier": "message-7"}]}
+
+
+def test_process_batch_logging(capsys, monkeypatch):
+    # The service name is global, so don't leave it behind for other tests.
+    monkeypatch.setattr(okdata.aws.logging, "SERVICE_NAME", "my-service")
+
+    @logging_wrapper
+    def handler(event, context):
+        def record_handler(record):
+            log_add(**{f"record_{record['messageId']}": True})
+            _fail_on(2, 3, 4)(record)
+
+        return process_batch(event, record_handler, max_workers=4)
+
+    handler(_sqs_event(10), None)
+
+    log = json.loads(capsys.readouterr().out)
+    assert log["batch_record_count"] == 10
+    assert log["batch_failure_count"] == 3
+    assert log["batch_error_types"] == {"ValueError": 3}
+    assert log["batch_record_ms"]["count"] == 10
+    assert log["batch_record_ms"]["max_ms"] >= log["batch_record_ms"]["min_ms"]
+    assert log["batch_duration_ms"] >= 0
+    assert all(log[f"record_message-{i}"] for i in range(10))
+
+
+def test_process_batch_status(requests_mock):
+    requests_mock.register_uri(
+        "POST", re.compile("openid-connect"), json={"access_token": "a"}
+    )
+    requests_mock.register_uri("POST", re.compile("/status-api/status/"), json={})
+
+    @status_wrapper()
+    def handler(event, context):
+        return process_batch(event, _fail_on(*range(150)))
+
+    handler({"execution_name": "my-trace-id", **_sqs_event(200)}, None)
+
+    payload = requests_mock.last_request.json()
+    batch = payload["status_body"]["batch"]
+    assert batch["records"] == 200
+    assert batch["failed"] == 150
+    assert len(batch["failures"]) == 100
+    assert batch["failures"][0] == {
+        "item_identifier": "message-0",
+        "error": "Bad record 0",
+    }
+    assert payload["errors"][0]["message"]["en"] == "150 of 200 records failed"
+    assert payload["trace_event_status"] == "OK"
+
+
+def test_process_batch_status_merged(requests_mock):
+    requests_mock.register_uri(
+        "POST", re.compile("openid-connect"), json={"access_token": "a"}
+    )
+    requests_mock.register_uri("POST", re.compile("/status-api/status/"), json={})
+    error = {"message": {"nb": "Noe gikk galt", "en": "Something went wrong"}}
+
+    @status_wrapper()
+    def handler(event, context):
+        status_add(status_body={"input": "my-input"}, errors=[error])
+        return process_batch(event, _fail_on(1))
+
+    handler({"execution_name": "my-trace-id", **_sqs_event(3)}, None)
+
+    payload = requests_mock.last_request.json()
+    assert payload["status_body"]["input"] == "my-input"
+    assert payload["status_body"]["batch"]["failed"] == 1
+    assert payload["errors"][0] == error
+    assert payload["errors"][1]["message"]["en"] == "1 of 3 records failed"
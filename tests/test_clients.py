@@ -0,0 +1,88 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+import pytest
+
+from okdata.aws import clients
+from okdata.aws.clients import get_client, warm_up
+from okdata.aws.ssm import SecretStore
+
+
+@pytest.fixture(autouse=True)
+def shared_clients(monkeypatch):
+    monkeypatch.setenv("AWS_REGION", "eu-west-1")
+    yield
+    clients.clear()
+
+
+def test_get_client_is_cached():
+    client = get_client("dynamodb")
+
+    assert get_client("dynamodb") is client
+    assert get_client("dynamodb", "eu-west-1") is client
+    assert get_client("dynamodb", "eu-north-1") is not client
+    assert get_client("ssm") is not client
+
+
+def test_get_client_config():
+    client = get_client("dynamodb")
+    assert client.meta.config.max_pool_connections == clients.MAX_POOL_CONNECTIONS
+    assert client.meta.config.tcp_keepalive is True
+    assert client.meta.config.retries["mode"] == "standard"
+
+    adaptive = get_client("dynamodb", retries={"mode": "adaptive"})
+    assert adaptive is not client
+    assert adaptive.meta.config.retries["mode"] == "adaptive"
+    # The retry settings not given are kept.
+    assert adaptive.meta.config.retries == {
+        **client.meta.config.retries,
+        "mode": "adaptive",
+    }
+    assert get_client("dynamodb", retries={"mode": "adaptive"}) is adaptive
+
+
+def test_configure(monkeypatch):
+    for name in ["MAX_POOL_CONNECTIONS", "RETRY_MODE"]:
+        monkeypatch.setattr(clients, name, getattr(clients, name))
+
+    clients.configure(max_pool_connections=50, retry_mode="adaptive")
+    client = get_client("dynamodb")
+
+    assert client.meta.config.max_pool_connections == 50
+    assert client.meta.config.retries["mode"] == "adaptive"
+
+
+def test_get_client_concurrently():
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        created = list(executor.map(lambda _: get_client("dynamodb"), range(32)))
+
+    assert all(client is created[0] for client in created)
+
+
+def test_warm_up():
+    warm_up(["dynamodb", "ssm", "dynamodb"]).join()
+
+    assert set(key[0] for key in clients._clients) == {"dynamodb", "ssm"}
+    assert get_client("ssm") is clients._clients[("ssm", "eu-west-1", "[]")]
+
+
+def test_clients_share_one_session(monkeypatch):
+    sessions = []
+
+    def session():
+        sessions.append(boto3_session())
+        return sessions[-1]
+
+    boto3_session = boto3.Session
+    monkeypatch.setattr(boto3, "Session", session)
+    monkeypatch.setattr(clients, "_session", None)
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        list(executor.map(get_client, ["dynamodb", "ssm", "s3", "sqs"]))
+
+    assert len(clients._clients) == 4
+    assert len(sessions) == 1
+
+
+def test_secret_store_uses_shared_client():
+    assert SecretStore()._client() is get_client("ssm")
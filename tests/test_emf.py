@@ -0,0 +1,164 @@
+import json
+from unittest.mock import patch
+
+from okdata.aws.emf import (
+    MAX_METRICS_PER_DOCUMENT,
+    MAX_VALUES_PER_METRIC,
+    UNIT_COUNT,
+    UNIT_MILLISECONDS,
+    MetricsEmitter,
+    documents,
+)
+
+UNITS = {
+    "Seconds",
+    "Microseconds",
+    "Milliseconds",
+    "Bytes",
+    "Kilobytes",
+    "Megabytes",
+    "Gigabytes",
+    "Terabytes",
+    "Bits",
+    "Kilobits",
+    "Megabits",
+    "Gigabits",
+    "Terabits",
+    "Percent",
+    "Count",
+    "Bytes/Second",
+    "Kilobytes/Second",
+    "Megabytes/Second",
+    "Gigabytes/Second",
+    "Terabytes/Second",
+    "Bits/Second",
+    "Kilobits/Second",
+    "Megabits/Second",
+    "Gigabits/Second",
+    "Terabits/Second",
+    "Count/Second",
+    "None",
+}
+
+
+def assert_valid_emf(document):
+    """Check `document` against the EMF specification."""
+    document = json.loads(json.dumps(document))
+    metadata = document["_aws"]
+    assert isinstance(metadata["Timestamp"], int)
+    assert metadata["CloudWatchMetrics"]
+    for directive in metadata["CloudWatchMetrics"]:
+        assert 1 <= len(directive["Namespace"]) <= 255
+        for dimension_set in directive["Dimensions"]:
+            assert len(dimension_set) <= 30
+            for dimension in dimension_set:
+                assert isinstance(document[dimension], str)
+                assert document[dimension]
+        assert 1 <= len(directive["Metrics"]) <= 100
+        for metric in directive["Metrics"]:
+            assert 1 <= len(metric["Name"]) <= 1024
+            assert metric["Unit"] in UNITS
+            value = document[metric["Name"]]
+            if isinstance(value, list):
+                assert 1 <= len(value) <= 100
+                assert all(isinstance(v, (int, float)) for v in value)
+            else:
+                assert isinstance(value, (int, float))
+
+
+def test_document():
+    [document] = documents(
+        "okdata",
+        {"service_name": "my-service", "function_stage": ""},
+        {"duration_ms": (UNIT_MILLISECONDS, 12.5), "cold_start": (UNIT_COUNT, 1)},
+        timestamp_ms=1600000000000,
+    )
+
+    assert_valid_emf(document)
+    assert document == {
+        "_aws": {
+            "Timestamp": 1600000000000,
+            "CloudWatchMetrics": [
+                {
+                    "Namespace": "okdata",
+                    "Dimensions": [["service_name"]],
+                    "Metrics": [
+                        {"Name": "duration_ms", "Unit": "Milliseconds"},
+                        {"Name": "cold_start", "Unit": "Count"},
+                    ],
+                }
+            ],
+        },
+        "service_name": "my-service",
+        "duration_ms": 12.5,
+        "cold_start": 1,
+    }
+
+
+def test_documents_split():
+    metrics = {
+        f"metric_{i}": (UNIT_COUNT, i) for i in range(MAX_METRICS_PER_DOCUMENT + 1)
+    }
+
+    docs = list(documents("okdata", {"service_name": "s"}, metrics))
+
+    assert len(docs) == 2
+    for document in docs:
+        assert_valid_emf(document)
+    assert docs[1]["metric_100"] == 100
+
+
+def test_emitter_unaggregated():
+    written = []
+    emitter = MetricsEmitter("okdata", written.append)
+
+    emitter.add({"service_name": "s"}, {"duration_ms": (UNIT_MILLISECONDS, 1.0)})
+    emitter.add({"service_name": "s"}, {"duration_ms": (UNIT_MILLISECONDS, 2.0)})
+
+    assert [d["duration_ms"] for d in written] == [1.0, 2.0]
+
+
+def test_emitter_aggregated():
+    written = []
+    emitter = MetricsEmitter("okdata", written.append, flush_interval=60)
+
+    for i in range(5):
+        emitter.add({"service_name": "a"}, {"duration_ms": (UNIT_MILLISECONDS, i)})
+    emitter.add({"service_name": "b"}, {"duration_ms": (UNIT_MILLISECONDS, 9)})
+    assert written == []
+
+    emitter.flush()
+
+    for document in written:
+        assert_valid_emf(document)
+    assert {d["service_name"]: d["duration_ms"] for d in written} == {
+        "a": [0, 1, 2, 3, 4],
+        "b": [9],
+    }
+
+
+def test_emitter_flushes_full_metrics():
+    written = []
+    emitter = MetricsEmitter("okdata", written.append, flush_interval=60)
+
+    for i in range(MAX_VALUES_PER_METRIC + 1):
+        emitter.add({"service_name": "a"}, {"count": (UNIT_COUNT, 1)})
+
+    [document] = written
+    assert_valid_emf(document)
+    assert len(document["count"]) == MAX_VALUES_PER_METRIC
+
+
+def test_emitter_flushes_periodically():
+    written = []
+    with patch("okdata.aws.emf.time.monotonic", return_value=0):
+        emitter = MetricsEmitter("okdata", written.append, flush_interval=10)
+        emitter.add({"service_name": "a"}, {"count": (UNIT_COUNT, 1)})
+        emitter.flush_if_due()
+    assert written == []
+
+    with patch("okdata.aws.emf.time.monotonic", return_value=10):
+        emitter.add({"service_name": "a"}, {"count": (UNIT_COUNT, 1)})
+        assert written == []
+        emitter.flush_if_due()
+    assert written[0]["count"] == [1, 1]
@@ -0,0 +1,119 @@
+import json
+import os
+
+import pytest
+
+from okdata.aws import events
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures", "events")
+
+
+def _fixture(name):
+    with open(os.path.join(FIXTURES, f"{name}.json")) as f:
+        return json.load(f)
+
+
+@pytest.mark.parametrize(
+    "fixture,source",
+    [
+        ("api_gateway", events.API_GATEWAY),
+        ("http_api", events.HTTP_API),
+        ("alb", events.ALB),
+        ("sqs", events.SQS),
+        ("sns", events.SNS),
+        ("s3", events.S3),
+        ("eventbridge", events.EVENTBRIDGE),
+        ("step_functions", events.STEP_FUNCTIONS),
+    ],
+)
+def test_event_source(fixture, source):
+    assert events.event_source(_fixture(fixture)) == source
+
+
+@pytest.mark.parametrize("event", [{}, {"foo": "bar"}, {"Records": []}, None, []])
+def test_unknown_event_source(event):
+    assert events.event_source(event) is None
+    assert events.extract(event) == {}
+
+
+def test_extract_api_gateway():
+    assert events.extract(_fixture("api_gateway")) == {}
+
+
+def test_extract_http_api():
+    assert events.extract(_fixture("http_api")) == {
+        "event_source": "http-api",
+        "request_resource": "GET /datasets/{dataset_id}",
+        "request_path": "/datasets/my-dataset",
+        "request_method": "GET",
+        "source_ip": "10.0.0.1",
+        "principal_id": "someuser",
+    }
+
+
+def test_extract_alb():
+    assert events.extract(_fixture("alb")) == {
+        "event_source": "alb",
+        "request_path": "/datasets",
+        "request_method": "POST",
+        "source_ip": "10.0.0.1",
+        "alb_target_group_arn": "arn:aws:elasticloadbalancing:eu-west-1:123456789012:targetgroup/my-target-group/6d0ecf831eec9f09",
+    }
+
+
+def test_extract_sqs():
+    assert events.extract(_fixture("sqs")) == {
+        "event_source": "aws:sqs",
+        "record_count": 2,
+        "sqs_queue_arn": "arn:aws:sqs:eu-west-1:123456789012:my-queue",
+    }
+
+
+def test_extract_sns():
+    assert events.extract(_fixture("sns")) == {
+        "event_source": "aws:sns",
+        "record_count": 1,
+        "sns_topic_arn": "arn:aws:sns:eu-west-1:123456789012:my-topic",
+    }
+
+
+def test_extract_s3():
+    assert events.extract(_fixture("s3")) == {
+        "event_source": "aws:s3",
+        "record_count": 1,
+        "s3_event_name": "ObjectCreated:Put",
+        "s3_bucket": "my-bucket",
+        "s3_key": "raw/green/my-dataset/version=1/data.csv",
+    }
+
+
+def test_extract_eventbridge():
+    assert events.extract(_fixture("eventbridge")) == {
+        "event_source": "eventbridge",
+        "eventbridge_source": "okdata.metadata",
+        "eventbridge_detail_type": "Dataset Created",
+    }
+
+
+def test_extract_step_functions():
+    assert events.extract(_fixture("step_functions")) == {
+        "event_source": "step-functions",
+        "execution_name": "my-dataset-1-uuid",
+        "task": "validate_input",
+    }
+
+
+def test_register_extractor(monkeypatch):
+    monkeypatch.setattr(events, "_extractors", dict(events._extractors))
+    monkeypatch.setattr(events, "_discriminators", [])
+
+    events.register_extractor(
+        "my-source",
+        lambda event: {"my_field": event["my_key"]},
+        discriminator=lambda event: "my_key" in event,
+    )
+
+    assert events.extract({"my_key": "a"}) == {
+        "event_source": "my-source",
+        "my_field": "a",
+    }
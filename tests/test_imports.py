@@ -0,0 +1,50 @@
+import subprocess
+import sys
+
+import pytest
+
+# Generous upper bound for the cumulative import time of a single module (in
+# microseconds), meant to catch heavy dependencies sneaking back into the
+# import path rather than to measure small variations.
+IMPORT_TIME_BUDGET_US = 250000
+
+
+def _import_times(module):
+    """Return a dict of the cumulative import time of every module imported
+    when importing `module` in a fresh interpreter."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, name = line.split(":", 1)[1].split("|")
+        times[name.strip()] = int(cumulative_us)
+    return times
+
+
+@pytest.mark.parametrize(
+    "module,lazy_dependencies",
+    [
+        ("okdata.aws.logging", ["starlette", "okdata.sdk", "boto3"]),
+        ("okdata.aws.status", ["okdata.sdk", "requests", "boto3"]),
+        ("okdata.aws.ssm", ["boto3", "botocore"]),
+        ("okdata.aws.clients", ["boto3", "botocore"]),
+    ],
+)
+def test_lazy_imports(module, lazy_dependencies):
+    times = _import_times(module)
+
+    assert module in times
+    for dependency in lazy_dependencies:
+        assert dependency not in times, f"{module} eagerly imports {dependency}"
+
+
+def test_logging_import_time():
+    times = _import_times("okdata.aws.logging")
+
+    assert times["okdata.aws.logging"] < IMPORT_TIME_BUDGET_US
@@ -0,0 +1,62 @@
+import io
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import structlog
+
+from okdata.aws.log_writer import LogWriter
+
+processors = [structlog.processors.JSONRenderer()]
+
+
+def test_no_lines_lost_on_flush():
+    file = io.StringIO()
+    # A small queue, so that some lines are written synchronously by the
+    # callers as well.
+    writer = LogWriter(processors, file=file, max_queue_size=10)
+
+    def write(i):
+        writer.write({"event": "", "n": i})
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(write, range(5000)))
+
+    assert writer.flush(5)
+    assert writer.pending == 0
+    lines = [json.loads(line) for line in file.getvalue().splitlines()]
+    assert sorted(line["n"] for line in lines) == list(range(5000))
+
+
+def test_flush_timeout():
+    release = threading.Event()
+
+    def slow_renderer(logger, method_name, event_dict):
+        release.wait()
+        return json.dumps(event_dict)
+
+    file = io.StringIO()
+    writer = LogWriter([slow_renderer], file=file)
+    writer.write({"event": "slow"})
+
+    assert not writer.flush(0.01)
+    assert writer.pending == 1
+
+    release.set()
+    assert writer.flush(5)
+    assert json.loads(file.getvalue()) == {"event": "slow"}
+
+
+def test_render_error_does_not_stop_writer():
+    def renderer(logger, method_name, event_dict):
+        if event_dict["fail"]:
+            raise ValueError("fail!")
+        return json.dumps(event_dict)
+
+    file = io.StringIO()
+    writer = LogWriter([renderer], file=file)
+    writer.write({"fail": True})
+    writer.write({"fail": False})
+
+    assert writer.flush(5)
+    assert json.loads(file.getvalue()) == {"fail": False}
@@ -1,16 +1,40 @@
+import asyncio
 import json
 import os
+import random
+import subprocess
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from time import sleep
-
-from fastapi import FastAPI
+from unittest.mock import patch
+
+import boto3
+import pytest
+import structlog
+from botocore.config import Config
+from botocore.stub import Stubber
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
 from fastapi.testclient import TestClient
 
+from okdata.aws import events
+from okdata.aws.redact import DEFAULT_PATTERNS
 from okdata.aws.logging import (
+    MAX_ERROR_BODY_SIZE,
     add_fastapi_logging,
+    configure,
+    flush,
+    flush_metrics,
     hide_suffix,
+    log_add,
+    log_aws_calls,
     log_duration,
     log_dynamodb,
     logging_wrapper,
+    sampling_stats,
+    timed,
 )
 
 empty_event = {}
@@ -243,6 +267,157 @@ def test_log_server_error(capsys):
     assert log["level"] == "error"
 
 
+def test_log_large_fields_truncated(capsys):
+    @logging_wrapper
+    def handler(event, context):
+        log_add(items=list(range(1000)), data=b"x" * 100000)
+        return {"statusCode": 400, "body": "x" * 1000000}
+
+    handler(empty_event, empty_context)
+
+    log = json.loads(capsys.readouterr().out)
+    assert log["response_status_code"] == 400
+    assert log["response_body"] == "x" * 16382
+    assert log["items"] == list(range(100))
+    assert log["data"] == "<100000 bytes>"
+    assert log["truncated_fields"] == {
+        "items": ["list of 1000 items cut to 100"],
+        "data": ["100000 bytes summarized"],
+        "response_body": ["string of 1000000 characters cut to 16382"],
+    }
+
+
+def test_log_line_size(capsys):
+    configure(max_field_size=1000, max_line_size=5000)
+    try:
+
+        @logging_wrapper
+        def handler(event, context):
+            log_add(**{f"field_{i}": "x" * 2000 for i in range(10)})
+
+        handler(empty_event, empty_context)
+    finally:
+        configure(max_field_size=16384, max_line_size=131072)
+
+    line = capsys.readouterr().out
+    assert len(line) < 6000
+    log = json.loads(line)
+    # The largest fields are cut down evenly, leaving the smaller ones.
+    assert log["level"] == "info"
+    assert log["timestamp"]
+    assert 0 < len(log["field_0"]) < 998
+    assert log["field_9"] == log["field_0"]
+    assert "field_9" in log["truncated_fields"]
+
+
+def test_log_exception_size(capsys):
+    @logging_wrapper
+    def handler(event, context):
+        raise ValueError("x" * 2000000)
+
+    with pytest.raises(ValueError):
+        handler(empty_event, empty_context)
+
+    line = capsys.readouterr().out
+    assert len(line) < 20000
+    log = json.loads(line)
+    assert log["exception"].startswith("Traceback")
+    assert len(log["exception"]) == 16382
+    [note] = log["truncated_fields"]["exception"]
+    assert note.endswith("characters cut to 16382")
+
+
+def test_log_exception_bounded_before_redaction(capsys):
+    @logging_wrapper
+    def handler(event, context):
+        raise ValueError('{"token": "' + "S" * 100000 + '"}')
+
+    with pytest.raises(ValueError):
+        handler(empty_event, empty_context)
+
+    log = json.loads(capsys.readouterr().out)
+    assert "SSS" not in log["exception"]
+    assert log["exception"].endswith('"token": "[REDACTED]"')
+    assert "exception" in log["truncated_fields"]
+
+
+def test_log_secrets_redacted(capsys):
+    @logging_wrapper
+    def handler(event, context):
+        log_add(
+            request_headers={"Authorization": "Bearer abc", "Accept": "*/*"},
+            client_secret="abc",
+        )
+        return {"statusCode": 400, "body": '{"token": "abc", "detail": "Bad"}'}
+
+    handler(empty_event, empty_context)
+
+    log = json.loads(capsys.readouterr().out)
+    assert log["request_headers"] == {"Authorization": "[REDACTED]", "Accept": "*/*"}
+    assert log["client_secret"] == "[REDACTED]"
+    assert log["response_body"] == '{"token": "[REDACTED]", "detail": "Bad"}'
+
+
+def test_log_secrets_redacted_from_truncated_body(capsys):
+    secret = "S" * 1000
+    body = json.dumps({"detail": "x" * 16350, "access_token": secret})
+
+    @logging_wrapper
+    def handler(event, context):
+        return {"statusCode": 400, "body": body}
+
+    handler(empty_event, empty_context)
+
+    log = json.loads(capsys.readouterr().out)
+    assert "response_body" in log["truncated_fields"]
+    assert "SSS" not in log["response_body"]
+    assert log["response_body"].endswith('"access_token": "[REDACTED]"')
+
+
+def test_log_instrumentation_not_redacted(capsys):
+    @logging_wrapper
+    def handler(event, context):
+        with timed("get_secret"):
+            pass
+        log_add(
+            batch_error_types={"InvalidTokenError": 1},
+            aws_calls={"sts.GetSessionToken": {"count": 1}},
+            client_secret="x" * 20000,
+        )
+
+    handler(empty_event, empty_context)
+
+    log = json.loads(capsys.readouterr().out)
+    assert log["timings"]["get_secret"]["count"] == 1
+    assert log["batch_error_types"] == {"InvalidTokenError": 1}
+    assert log["aws_calls"] == {"sts.GetSessionToken": {"count": 1}}
+    assert log["client_secret"] == "[REDACTED]"
+    assert log["truncated_fields"]["client_secret"] == [
+        "string of 20000 characters cut to 16382"
+    ]
+
+
+def test_log_redact_patterns(capsys):
+    @logging_wrapper
+    def handler(event, context):
+        log_add(ssn="12345678901", client_secret="abc")
+
+    configure(redact_patterns=["ssn"])
+    try:
+        handler(empty_event, empty_context)
+        configure(redact_patterns=[])
+        handler(empty_event, empty_context)
+    finally:
+        configure(redact_patterns=DEFAULT_PATTERNS)
+
+    custom, disabled = [
+        json.loads(line) for line in capsys.readouterr().out.splitlines()
+    ]
+    assert custom["ssn"] == "[REDACTED]"
+    assert custom["client_secret"] == "abc"
+    assert disabled["ssn"] == "12345678901"
+
+
 def test_log_exception(capsys):
     wrapper = logging_wrapper(throwing_handler)
     try:
@@ -341,4 +516,816 @@ def test_fastapi_logging(capsys):
 
     log = json.loads(capsys.readouterr().out)
     assert log["response_status_code"] == 200
+    assert log["response_size_bytes"] == len(b'{"msg":"Hello World"}')
+    assert log["handler_method"] == "async_handler"
+    assert "response_body" not in log
     assert "duration_ms" in log
+
+
+def test_fastapi_logging_error_body(capsys):
+    app = FastAPI()
+    add_fastapi_logging(app)
+
+    @app.get("/missing")
+    async def missing():
+        raise HTTPException(status_code=404, detail="x" * 5000)
+
+    with TestClient(app) as client:
+        response = client.get("/missing")
+        assert response.status_code == 404
+
+    log = json.loads(capsys.readouterr().out)
+    assert log["response_status_code"] == 404
+    assert log["level"] == "info"
+    assert log["response_body"] == response.text[:MAX_ERROR_BODY_SIZE]
+
+
+def test_fastapi_logging_error_body_redacted(capsys):
+    app = FastAPI()
+    add_fastapi_logging(app)
+
+    @app.get("/forbidden")
+    async def forbidden():
+        raise HTTPException(
+            status_code=403, detail={"info": "x" * 980, "token": "S" * 1000}
+        )
+
+    with TestClient(app) as client:
+        assert client.get("/forbidden").status_code == 403
+
+    log = json.loads(capsys.readouterr().out)
+    assert "SSS" not in log["response_body"]
+    assert log["response_body"].endswith('"token":"[REDACTED]"')
+
+
+def test_fastapi_logging_streaming_response(capsys):
+    app = FastAPI()
+    add_fastapi_logging(app)
+
+    @app.get("/stream")
+    async def stream():
+        async def chunks():
+            for i in range(10):
+                await asyncio.sleep(0.001)
+                yield b"chunk"
+
+        return StreamingResponse(chunks())
+
+    with TestClient(app) as client:
+        response = client.get("/stream")
+        assert response.content == b"chunk" * 10
+
+    log = json.loads(capsys.readouterr().out)
+    assert log["response_status_code"] == 200
+    assert log["response_size_bytes"] == 50
+    assert log["duration_ms"] >= 10.0
+
+
+def test_static_fields_bound_once(capsys, monkeypatch):
+    monkeypatch.setenv("GIT_REV", "abc123")
+    context = RequestContext(
+        function_name="my_static_function",
+        function_version="1",
+        aws_request_id="my_request_id",
+        memory_limit_in_mb=128,
+    )
+    wrapper = logging_wrapper(ok_handler)
+
+    wrapper(empty_event, context)
+    monkeypatch.setenv("GIT_REV", "def456")
+    context.aws_request_id = "my_other_request_id"
+    wrapper(empty_event, context)
+
+    first, second = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert first["git_rev"] == second["git_rev"] == "abc123"
+    assert first["function_name"] == second["function_name"] == "my_static_function"
+    assert first["aws_request_id"] == "my_request_id"
+    assert second["aws_request_id"] == "my_other_request_id"
+
+
+def log_add_handler(event, context):
+    log_add(foo="bar")
+    log_add(request_path="overridden", level="warning")
+    for i in range(3):
+        log_add(counter=i)
+    return {"statusCode": 404, "body": "Not Found"}
+
+
+def test_log_add_output_format(capsys):
+    wrapper = logging_wrapper(service_name="my_service")(log_add_handler)
+    wrapper({"path": "my_path"}, empty_context)
+
+    out = capsys.readouterr().out
+    log = json.loads(out)
+
+    # Fields keep the position where they were first added, just like when
+    # rebinding the fields of a structlog logger.
+    assert list(log) == [
+        "service_name",
+        "handler_method",
+        "function_name",
+        "function_version",
+        "git_rev",
+        "memory_limit_in_mb",
+        "function_stage",
+        "function_api_id",
+        "aws_account_id",
+        "aws_request_id",
+        "aws_trace_id",
+        "logged_in",
+        "principal_id",
+        "source_ip",
+        "request_domain_name",
+        "request_resource",
+        "request_path",
+        "request_method",
+        "request_path_parameters",
+        "request_query_string_parameters",
+        "cold_start",
+        "foo",
+        "level",
+        "counter",
+        "response_status_code",
+        "response_body",
+        "duration_ms",
+        "event",
+        "timestamp",
+    ]
+    assert log["request_path"] == "overridden"
+    assert log["counter"] == 2
+    assert log["level"] == "info"
+    assert log["event"] == ""
+    assert out.count("\n") == 1
+
+
+def test_fastapi_logging_exception(capsys):
+    app = FastAPI()
+    add_fastapi_logging(app)
+
+    @app.get("/fail")
+    async def fail():
+        raise Exception("fail!")
+
+    with TestClient(app, raise_server_exceptions=False) as client:
+        response = client.get("/fail")
+        assert response.status_code == 500
+
+    log = json.loads(capsys.readouterr().out)
+    assert log["level"] == "error"
+    assert "Exception: fail!" in log["exception"]
+
+
+def test_fastapi_logging_concurrent_requests(capsys):
+    app = FastAPI()
+    add_fastapi_logging(app)
+
+    @app.get("/items/{item_id}")
+    async def get_item(item_id: int):
+        log_add(item_id=item_id)
+        # Yield to the other requests in flight before adding more fields.
+        await asyncio.sleep(random.random() / 100)
+        log_add(**{f"item_{item_id}": True})
+        return {"item_id": item_id}
+
+    @app.get("/sync-items/{item_id}")
+    def get_sync_item(item_id: int):
+        log_add(item_id=item_id)
+        sleep(random.random() / 100)
+        log_add(**{f"item_{item_id}": True})
+        return {"item_id": item_id}
+
+    n_requests = 300
+    with TestClient(app) as client:
+
+        def request(item_id):
+            path = "items" if item_id % 2 else "sync-items"
+            return client.get(f"/{path}/{item_id}").json()
+
+        with ThreadPoolExecutor(max_workers=50) as executor:
+            responses = list(executor.map(request, range(n_requests)))
+
+    assert responses == [{"item_id": i} for i in range(n_requests)]
+
+    logs = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert sorted(log["item_id"] for log in logs) == list(range(n_requests))
+    for log in logs:
+        assert [k for k in log if k.startswith("item_")] == [
+            "item_id",
+            f"item_{log['item_id']}",
+        ]
+        assert log["response_status_code"] == 200
+
+
+@pytest.fixture
+def phase_timing():
+    configure(phase_timing=True)
+    yield
+    configure(phase_timing=False)
+
+
+def test_phase_timing_disabled_by_default(capsys):
+    logging_wrapper(ok_handler)(empty_event, empty_context)
+
+    log = json.loads(capsys.readouterr().out)
+    assert not [k for k in log if k.startswith("phase_")]
+
+
+def test_phase_timing(capsys, phase_timing):
+    @logging_wrapper
+    def handler(event, context):
+        sleep(0.01)
+        return {"statusCode": 200}
+
+    handler(empty_event, empty_context)
+
+    log = json.loads(capsys.readouterr().out)
+    assert log["phase_init_ms"] >= 0
+    assert log["phase_handler_ms"] >= 10.0
+    assert log["phase_total_ms"] >= log["duration_ms"] >= log["phase_handler_ms"]
+
+
+def test_phase_timing_status_delivery(capsys, phase_timing):
+    from okdata.aws.status.wrapper import status_wrapper
+
+    @logging_wrapper
+    @status_wrapper()
+    def handler(event, context):
+        return {"statusCode": 200}
+
+    # Without a trace ID nothing is sent, but the delivery is still timed.
+    handler(empty_event, empty_context)
+
+    log = json.loads(capsys.readouterr().out.splitlines()[-1])
+    assert log["phase_status_delivery_ms"] >= 0
+    assert log["phase_handler_ms"] >= log["phase_status_delivery_ms"]
+
+
+def test_fastapi_phase_timing(capsys, phase_timing):
+    app = FastAPI()
+    add_fastapi_logging(app)
+
+    @app.get("/stream")
+    async def stream():
+        async def chunks():
+            await asyncio.sleep(0.01)
+            yield b"chunk"
+
+        return StreamingResponse(chunks())
+
+    with TestClient(app) as client:
+        client.get("/stream")
+
+    log = json.loads(capsys.readouterr().out)
+    assert log["phase_ttfb_ms"] >= 10.0
+    assert log["phase_ttfb_ms"] >= log["phase_handler_ms"]
+    assert log["phase_total_ms"] >= log["phase_ttfb_ms"]
+
+
+@pytest.fixture
+def async_writer():
+    configure(fast_json=True, async_writer=True)
+    yield
+    configure(fast_json=False, async_writer=False)
+
+
+def test_async_writer(capsys, async_writer):
+    n_invocations = 200
+    for i in range(n_invocations):
+        logging_wrapper(log_add_handler)({"value": i}, empty_context)
+
+    # Every line is written by the end of its invocation.
+    logs = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert len(logs) == n_invocations
+    assert logs[0]["foo"] == "bar"
+    assert "timestamp" in logs[0]
+    assert flush()
+
+
+def test_async_writer_exception(capsys, async_writer):
+    with pytest.raises(Exception):
+        logging_wrapper(throwing_handler)(empty_event, empty_context)
+
+    log = json.loads(capsys.readouterr().out)
+    assert log["level"] == "error"
+    assert "Exception: fail!" in log["exception"]
+
+
+def test_async_writer_fastapi_flush_off_event_loop(capsys, async_writer):
+    from okdata.aws import logging as okdata_logging
+
+    writer = okdata_logging._writer
+    writer_flush = writer.flush
+    on_event_loop = []
+
+    def flush(timeout):
+        try:
+            asyncio.get_running_loop()
+            on_event_loop.append(True)
+        except RuntimeError:
+            on_event_loop.append(False)
+        return writer_flush(timeout)
+
+    app = FastAPI()
+    add_fastapi_logging(app)
+
+    @app.get("/")
+    def root():
+        return {"hello": "world"}
+
+    with TestClient(app) as client, patch.object(writer, "flush", flush):
+        client.get("/")
+
+    assert json.loads(capsys.readouterr().out)["response_status_code"] == 200
+    assert on_event_loop == [False]
+
+
+def test_async_writer_flushed_at_exit():
+    script = (
+        "import structlog\n"
+        "from okdata.aws.logging import configure\n"
+        "configure(async_writer=True)\n"
+        "for i in range(2000):\n"
+        "    structlog.get_logger().info('line', i=i)\n"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", script], capture_output=True, text=True, check=True
+    )
+
+    assert len(result.stdout.splitlines()) == 2000
+
+
+def test_async_writer_logger_exception(capsys, async_writer):
+    try:
+        raise ValueError("boom")
+    except ValueError:
+        structlog.get_logger().exception("failed")
+    assert flush()
+
+    log = json.loads(capsys.readouterr().out)
+    assert log["event"] == "failed"
+    assert "ValueError: boom" in log["exception"]
+
+
+def test_fast_json_same_output(capsys):
+    def handler(event, context):
+        log_add(number=1, nested={"list": [1, 2.5, None]}, large=2**70)
+        return {"statusCode": 200}
+
+    logging_wrapper(handler)(empty_event, empty_context)
+    configure(fast_json=True)
+    try:
+        logging_wrapper(handler)(empty_event, empty_context)
+    finally:
+        configure(fast_json=False)
+
+    slow, fast = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    for log in (slow, fast):
+        del log["timestamp"], log["duration_ms"], log["cold_start"]
+    assert fast == slow
+
+
+@pytest.fixture
+def sampling():
+    configure(sample_rate=0.5, slow_threshold_ms=50)
+    yield
+    configure(sample_rate=1.0, slow_threshold_ms=1000)
+
+
+def _trace_event(i):
+    return {"headers": {"X-Amzn-Trace-Id": f"Root=1-{i:08x}-abc;Parent={i}"}}
+
+
+def test_sampling(capsys, sampling):
+    before = sampling_stats()
+    n_invocations = 1000
+    for i in range(n_invocations):
+        logging_wrapper(ok_handler)(_trace_event(i), empty_context)
+
+    logs = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    stats = sampling_stats()
+    logged = stats["logged"] - before["logged"]
+    suppressed = stats["suppressed"] - before["suppressed"]
+    assert logged == len(logs)
+    assert logged + suppressed == n_invocations
+    assert 400 < logged < 600
+    assert all(log["sample_rate"] == 0.5 for log in logs)
+
+
+def test_sampling_deterministic_per_trace(capsys, sampling):
+    for i in range(100):
+        logging_wrapper(ok_handler)(_trace_event(i), empty_context)
+    first = capsys.readouterr().out.count("\n")
+
+    # The same traces, seen from another service.
+    for i in range(100):
+        event = _trace_event(i)
+        event["headers"]["X-Amzn-Trace-Id"] = f"Root=1-{i:08x}-abc;Parent=other"
+        logging_wrapper(ok_handler)(event, empty_context)
+    logs = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+
+    assert len(logs) == first
+
+
+def test_sampling_always_logs_errors_and_slow(capsys, sampling):
+    configure(sample_rate=0.0)
+
+    logging_wrapper(ok_handler)(_trace_event(1), empty_context)
+    assert capsys.readouterr().out == ""
+
+    logging_wrapper(server_error_handler)(_trace_event(2), empty_context)
+    with pytest.raises(Exception):
+        logging_wrapper(throwing_handler)(_trace_event(3), empty_context)
+
+    @logging_wrapper
+    def slow_handler(event, context):
+        sleep(0.06)
+        return {"statusCode": 200}
+
+    slow_handler(_trace_event(4), empty_context)
+
+    logs = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert [log["level"] for log in logs] == ["error", "error", "info"]
+    assert logs[2]["duration_ms"] >= 50
+    assert not [log for log in logs if "sample_rate" in log]
+
+
+@pytest.fixture
+def emf_output():
+    configure(emf=True, emf_dimensions=["service_name", "function_name"])
+    yield
+    configure(emf=False, emf_dimensions=["service_name", "function_stage"])
+
+
+def _split_emf(out):
+    lines = [json.loads(line) for line in out.splitlines()]
+    return (
+        [line for line in lines if "_aws" not in line],
+        [line for line in lines if "_aws" in line],
+    )
+
+
+def test_emf(capsys, emf_output):
+    context = RequestContext(
+        function_name="my_emf_function",
+        function_version="1",
+        aws_request_id="my_request_id",
+        memory_limit_in_mb=128,
+    )
+    logging_wrapper(timing_handler)(empty_event, context)
+    logging_wrapper(dynamodb_handler)({"Count": 3}, context)
+
+    logs, metrics = _split_emf(capsys.readouterr().out)
+    assert len(logs) == 2
+    for document in metrics:
+        [directive] = document["_aws"]["CloudWatchMetrics"]
+        assert directive["Dimensions"] == [["service_name", "function_name"]]
+        assert document["service_name"] == logs[0]["service_name"]
+        assert document["function_name"] == "my_emf_function"
+        assert document["cold_start"] in (0, 1)
+
+    timing, dynamodb = metrics
+    assert timing["my_timer"] == logs[0]["my_timer"]
+    assert timing["duration_ms"] == logs[0]["duration_ms"]
+    assert dynamodb["dynamodb_duration_ms"] == logs[1]["dynamodb_duration_ms"]
+    assert dynamodb["dynamodb_item_count"] == logs[1]["dynamodb_item_count"]
+
+
+def test_emf_async_writer(capsys, emf_output, async_writer):
+    for i in range(3):
+        logging_wrapper(timing_handler)(empty_event, empty_context)
+
+    lines = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    # Each invocation's metrics are written just before its log line.
+    assert ["_aws" in line for line in lines] == [True, False] * 3
+
+
+def test_emf_aggregated(capsys, emf_output, sampling):
+    configure(emf=True, emf_flush_interval=60, sample_rate=0.0)
+    for i in range(10):
+        logging_wrapper(ok_handler)(_trace_event(i), empty_context)
+
+    assert capsys.readouterr().out == ""
+
+    flush_metrics()
+
+    logs, [document] = _split_emf(capsys.readouterr().out)
+    assert logs == []
+    assert len(document["duration_ms"]) == 10
+
+
+def test_emf_aggregated_flushed_at_end_of_invocation(capsys, emf_output, sampling):
+    with patch("okdata.aws.emf.time.monotonic", return_value=0):
+        configure(emf=True, emf_flush_interval=60, sample_rate=0.0)
+        logging_wrapper(ok_handler)(_trace_event(0), empty_context)
+    assert capsys.readouterr().out == ""
+
+    with patch("okdata.aws.emf.time.monotonic", return_value=60):
+        logging_wrapper(ok_handler)(_trace_event(1), empty_context)
+
+    logs, [document] = _split_emf(capsys.readouterr().out)
+    assert logs == []
+    assert len(document["duration_ms"]) == 2
+
+
+def test_timed(capsys):
+    @timed("process_record")
+    def process_record(record):
+        with timed("write"):
+            sleep(0.001 * record)
+
+    @logging_wrapper
+    def handler(event, context):
+        for record in range(1, 4):
+            process_record(record)
+        return {"statusCode": 200}
+
+    handler(empty_event, empty_context)
+
+    timings = json.loads(capsys.readouterr().out)["timings"]
+    assert list(timings) == ["process_record/write", "process_record"]
+    outer = timings["process_record"]
+    inner = timings["process_record/write"]
+    assert outer["count"] == inner["count"] == 3
+    assert "parent" not in outer
+    assert inner["parent"] == "process_record"
+    assert 1.0 <= inner["min_ms"] <= inner["max_ms"]
+    assert inner["max_ms"] >= 3.0
+    assert outer["total_ms"] >= inner["total_ms"] >= 6.0
+
+
+def test_timed_exception(capsys):
+    @logging_wrapper
+    def handler(event, context):
+        with timed("failing"):
+            raise Exception("fail!")
+
+    with pytest.raises(Exception):
+        handler(empty_event, empty_context)
+
+    log = json.loads(capsys.readouterr().out)
+    assert log["timings"]["failing"]["count"] == 1
+
+
+def test_timed_outside_invocation():
+    with timed("nothing"):
+        pass
+
+
+def test_timed_async(capsys):
+    app = FastAPI()
+    add_fastapi_logging(app)
+
+    @timed("fetch")
+    async def fetch(i):
+        await asyncio.sleep(0.001)
+
+    @app.get("/fetch")
+    async def fetch_all():
+        async with timed("fetch_all"):
+            await asyncio.gather(*(fetch(i) for i in range(5)))
+        return {}
+
+    with TestClient(app) as client:
+        client.get("/fetch")
+
+    timings = json.loads(capsys.readouterr().out)["timings"]
+    assert timings["fetch_all"]["count"] == 1
+    assert timings["fetch_all/fetch"]["count"] == 5
+    assert timings["fetch_all/fetch"]["parent"] == "fetch_all"
+
+
+def _dynamodb_client(**kwargs):
+    return boto3.client(
+        "dynamodb",
+        region_name="eu-west-1",
+        aws_access_key_id="test",
+        aws_secret_access_key="test",
+        **kwargs,
+    )
+
+
+def test_log_aws_calls(capsys):
+    client = log_aws_calls(_dynamodb_client())
+    # Instrumenting twice has no effect.
+    log_aws_calls(client)
+
+    @logging_wrapper
+    def handler(event, context):
+        with Stubber(client) as stubber:
+            for count in [2, 3]:
+                stubber.add_response(
+                    "query",
+                    {
+                        "Items": [],
+                        "Count": count,
+                        "ConsumedCapacity": {"TableName": "t", "CapacityUnits": 0.5},
+                    },
+                )
+            stubber.add_response("get_item", {"Item": {"id": {"S": "a"}}})
+            stubber.add_client_error(
+                "get_item", "ResourceNotFoundException", http_status_code=400
+            )
+            for _ in range(2):
+                client.query(TableName="t", ReturnConsumedCapacity="TOTAL")
+            client.get_item(TableName="t", Key={"id": {"S": "a"}})
+            with pytest.raises(client.exceptions.ResourceNotFoundException):
+                client.get_item(TableName="t", Key={"id": {"S": "b"}})
+        return {"statusCode": 200}
+
+    handler(empty_event, empty_context)
+
+    aws_calls = json.loads(capsys.readouterr().out)["aws_calls"]
+    query = aws_calls["dynamodb.Query"]
+    assert query["count"] == 2
+    assert query["errors"] == 0
+    assert query["retries"] == 0
+    assert query["status_codes"] == {"200": 2}
+    assert query["consumed_capacity"] == 1.0
+    assert query["item_count"] == 5
+    assert query["total_ms"] >= query["max_ms"] > 0
+
+    get_item = aws_calls["dynamodb.GetItem"]
+    assert get_item["count"] == 2
+    assert get_item["errors"] == 1
+    assert get_item["status_codes"] == {"200": 1, "400": 1}
+    assert get_item["item_count"] == 1
+
+
+def test_log_aws_calls_outside_invocation():
+    client = log_aws_calls(_dynamodb_client())
+    with Stubber(client) as stubber:
+        stubber.add_response("query", {"Items": [], "Count": 0})
+        client.query(TableName="t")
+
+
+def test_log_aws_calls_session(capsys):
+    session = log_aws_calls(
+        boto3.Session(
+            region_name="eu-west-1",
+            aws_access_key_id="test",
+            aws_secret_access_key="test",
+        )
+    )
+    client = session.client("ssm")
+
+    @logging_wrapper
+    def handler(event, context):
+        with Stubber(client) as stubber:
+            stubber.add_response("get_parameter", {"Parameter": {"Value": "v"}})
+            client.get_parameter(Name="/foo")
+        return {"statusCode": 200}
+
+    handler(empty_event, empty_context)
+
+    aws_calls = json.loads(capsys.readouterr().out)["aws_calls"]
+    assert aws_calls["ssm.GetParameter"]["count"] == 1
+
+
+def test_log_aws_calls_retries(capsys):
+    responses = iter([500, 200])
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers["Content-Length"]))
+            body = b'{"Items": [], "Count": 4}'
+            self.send_response(next(responses))
+            self.send_header("Content-Type", "application/x-amz-json-1.0")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = log_aws_calls(
+        _dynamodb_client(
+            endpoint_url=f"http://127.0.0.1:{server.server_port}",
+            config=Config(retries={"mode": "standard", "max_attempts": 2}),
+        )
+    )
+
+    @logging_wrapper
+    def handler(event, context):
+        client.query(TableName="t")
+        return {"statusCode": 200}
+
+    try:
+        handler(empty_event, empty_context)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    query = json.loads(capsys.readouterr().out)["aws_calls"]["dynamodb.Query"]
+    assert query["count"] == 1
+    assert query["retries"] == 1
+    assert query["status_codes"] == {"200": 1}
+    assert query["item_count"] == 4
+
+
+def test_async_handler(capsys):
+    @logging_wrapper
+    async def handler(event, context):
+        async def fetch(i):
+            await asyncio.sleep(0.01)
+            log_add(**{f"fetched_{i}": True})
+            return i
+
+        results = await asyncio.gather(
+            log_duration(fetch(0), "fetch_0_duration"),
+            log_duration(lambda: fetch(1), "fetch_1_duration"),
+        )
+        return {"statusCode": 200, "body": results}
+
+    assert handler(empty_event, empty_context)["body"] == [0, 1]
+
+    log = json.loads(capsys.readouterr().out)
+    assert log["handler_method"] == "handler"
+    assert log["response_status_code"] == 200
+    assert log["fetched_0"] and log["fetched_1"]
+    assert log["fetch_0_duration"] >= 10.0
+    assert log["fetch_1_duration"] >= 10.0
+    assert log["duration_ms"] < 20.0 + log["fetch_0_duration"]
+
+
+def test_async_handler_exception(capsys):
+    @logging_wrapper
+    async def handler(event, context):
+        raise Exception("fail!")
+
+    with pytest.raises(Exception):
+        handler(empty_event, empty_context)
+
+    log = json.loads(capsys.readouterr().out)
+    assert log["level"] == "error"
+    assert "Exception: fail!" in log["exception"]
+
+
+def test_async_handler_keeps_event_loop(capsys):
+    loops = []
+
+    @logging_wrapper
+    async def handler(event, context):
+        loops.append(asyncio.get_running_loop())
+        return {"statusCode": 200}
+
+    handler(empty_event, empty_context)
+    handler(empty_event, empty_context)
+
+    assert loops[0] is loops[1]
+    assert not loops[0].is_running()
+
+
+def test_async_handler_from_running_loop():
+    @logging_wrapper
+    async def handler(event, context):
+        return {"statusCode": 200}
+
+    async def main():
+        handler(empty_event, empty_context)
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(main())
+
+
+def _event_fixture(name):
+    path = os.path.join(os.path.dirname(__file__), "fixtures", "events", name)
+    with open(f"{path}.json") as f:
+        return json.load(f)
+
+
+def test_log_http_api_event(capsys):
+    logging_wrapper(empty_handler)(_event_fixture("http_api"), empty_context)
+
+    log = json.loads(capsys.readouterr().out)
+    assert log["event_source"] == "http-api"
+    assert log["request_method"] == "GET"
+    assert log["request_path"] == "/datasets/my-dataset"
+    assert log["request_resource"] == "GET /datasets/{dataset_id}"
+    assert log["request_domain_name"] == "api.data.oslo.systems"
+    assert log["function_stage"] == "$default"
+    assert log["source_ip"] == "10.0.0.x"
+    assert log["principal_id"] == "someuxxx"
+    assert log["logged_in"] is True
+
+
+def test_log_sqs_event(capsys):
+    logging_wrapper(empty_handler)(_event_fixture("sqs"), empty_context)
+
+    log = json.loads(capsys.readouterr().out)
+    assert log["event_source"] == "aws:sqs"
+    assert log["record_count"] == 2
+    assert log["sqs_queue_arn"].endswith(":my-queue")
+
+
+def test_log_event_extraction_error(capsys, monkeypatch):
+    def failing_extractor(event):
+        raise KeyError("foo")
+
+    monkeypatch.setitem(events._extractors, events.SQS, failing_extractor)
+
+    logging_wrapper(empty_handler)(_event_fixture("sqs"), empty_context)
+
+    log = json.loads(capsys.readouterr().out)
+    assert log["event_extraction_error"] == "KeyError('foo')"
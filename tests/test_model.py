@@ -1,6 +1,14 @@
+import json
+from datetime import datetime, timezone
+
 import pytest
 
-from okdata.aws.status.model import StatusData
+from okdata.aws.status.model import (
+    StatusData,
+    StatusJSONEncoder,
+    StatusMeta,
+    TraceEventStatus,
+)
 
 OK_ERROR = {"message": {"nb": "Det er et problem", "en": "There is a problem"}}
 
@@ -31,3 +39,85 @@ class TestStatusData:
         params = {"errors": [OK_ERROR, {"message": {"Bad key": "foo", "en": "bar"}}]}
         with pytest.raises(ValueError):
             StatusData(**params)
+
+    def test_errors_validated_on_assignment(self):
+        status_data = StatusData()
+        status_data.errors = [OK_ERROR]
+        assert status_data.errors == [OK_ERROR]
+        status_data.errors = None
+        assert status_data.errors is None
+
+        with pytest.raises(TypeError):
+            status_data.errors = "foo"
+
+    def test_slots(self):
+        status_data = StatusData(meta=StatusMeta())
+        assert not hasattr(status_data, "__dict__")
+        assert not hasattr(status_data.meta, "__dict__")
+
+    def test_default_times(self):
+        status_data = StatusData()
+        assert status_data.start_time == status_data.end_time
+        assert status_data.start_time.tzinfo == timezone.utc
+
+        start_time = datetime(2020, 10, 10, tzinfo=timezone.utc)
+        status_data = StatusData(start_time=start_time)
+        assert status_data.start_time == start_time
+        assert status_data.end_time > start_time
+
+
+class TestStatusDataSerialization:
+    def _status_data(self):
+        return StatusData(
+            trace_id="my-trace-id",
+            domain="dataset",
+            trace_event_status=TraceEventStatus.FAILED,
+            meta=StatusMeta(function_name="foo", git_rev=None),
+            status_body={
+                "when": datetime(2020, 10, 10, 8, 55, 1, tzinfo=timezone.utc),
+                "items": ("a", "b"),
+                "nested": [{"none": None, "error": ValueError("oops")}],
+            },
+            exception=Exception("fail!"),
+            errors=[OK_ERROR],
+        )
+
+    @pytest.mark.parametrize("exclude_none", [True, False])
+    def test_json_dict_matches_json_round_trip(self, exclude_none):
+        status_data = self._status_data()
+        expected = json.loads(
+            json.dumps(
+                status_data.dict(exclude_none=exclude_none), cls=StatusJSONEncoder
+            )
+        )
+
+        assert status_data.json_dict(exclude_none=exclude_none) == expected
+
+    def test_json_dict_exclude_none(self):
+        result = self._status_data().json_dict(exclude_none=True)
+
+        assert "user" not in result
+        assert result["meta"] == {"function_name": "foo"}
+        # Only model fields are excluded, not values in the status body.
+        assert result["status_body"]["nested"][0]["none"] is None
+
+    def test_json(self):
+        status_data = self._status_data()
+
+        assert json.loads(status_data.json()) == status_data.json_dict()
+        assert json.loads(status_data.json(indent=2)) == status_data.json_dict()
+
+    def test_json_big_int_and_non_ascii(self):
+        status_data = StatusData(
+            domain_id="blåbær", status_body={"big": 2**64, "small": -(2**63) - 1}
+        )
+        result = status_data.json()
+
+        # Same output as the standard library, regardless of installed
+        # serializers.
+        assert result == json.dumps(status_data.json_dict())
+        assert '"domain_id": "bl\\u00e5b\\u00e6r"' in result
+        assert json.loads(result)["status_body"] == {
+            "big": 2**64,
+            "small": -(2**63) - 1,
+        }
@@ -0,0 +1,195 @@
+import time
+
+import pytest
+
+from okdata.aws.redact import MAX_CACHED_KEYS, REDACTED, Redactor
+
+SENSITIVE_KEYS = [
+    "token",
+    "access_token",
+    "refreshToken",
+    "id_token",
+    "X-Amz-Security-Token",
+    "password",
+    "db_password",
+    "PASSWORD",
+    "passwd",
+    "secret",
+    "client_secret",
+    "aws_secret_access_key",
+    "Authorization",
+    "proxy-authorization",
+    "Cookie",
+    "Set-Cookie",
+    "api_key",
+    "apiKey",
+    "x-api-key",
+    "credentials",
+    "private_key",
+    "privateKey",
+]
+
+NON_SENSITIVE_KEYS = [
+    "username",
+    "user_id",
+    "key",
+    "path",
+    "status",
+    "content-type",
+    "x-amzn-trace-id",
+    "pass",
+]
+
+
+@pytest.mark.parametrize("key", SENSITIVE_KEYS)
+def test_sensitive_keys(key):
+    assert Redactor().sensitive(key)
+
+
+@pytest.mark.parametrize("key", NON_SENSITIVE_KEYS)
+def test_non_sensitive_keys(key):
+    assert not Redactor().sensitive(key)
+
+
+def test_non_string_keys():
+    assert not Redactor().sensitive(42)
+    assert not Redactor().sensitive(None)
+
+
+def test_decisions_memoized():
+    redactor = Redactor()
+
+    assert redactor.sensitive("token")
+    assert redactor.sensitive("username") is False
+    assert redactor._decisions == {"token": True, "username": False}
+
+
+def test_decisions_cache_bounded():
+    redactor = Redactor()
+
+    for i in range(MAX_CACHED_KEYS + 10):
+        redactor.sensitive(f"key-{i}")
+
+    assert len(redactor._decisions) == MAX_CACHED_KEYS
+
+
+def test_redact_nested():
+    value = {
+        "headers": {"Authorization": "Bearer abc", "Accept": "*/*"},
+        "items": [{"id": 1, "api_key": "abc"}, ("x", {"password": "abc"})],
+        "token": {"nested": "abc"},
+        "count": 2,
+    }
+
+    assert Redactor().redact(value) == {
+        "headers": {"Authorization": REDACTED, "Accept": "*/*"},
+        "items": [{"id": 1, "api_key": REDACTED}, ["x", {"password": REDACTED}]],
+        "token": REDACTED,
+        "count": 2,
+    }
+
+
+def test_redact_copies_only_when_needed():
+    clean = {"a": [{"b": 1}], "c": {"d": "e"}}
+    value = {"clean": clean, "dirty": {"secret": "abc"}}
+
+    redacted = Redactor().redact(value)
+
+    assert redacted is not value
+    assert redacted["clean"] is clean
+    assert value["dirty"] == {"secret": "abc"}
+    assert Redactor().redact(clean) is clean
+
+
+def test_redact_text_json():
+    text = '{"user": "foo", "access_token": "abc\\"def", "nested": {"Password" : "x"}}'
+
+    assert Redactor().redact_text(text) == (
+        '{"user": "foo", "access_token": "[REDACTED]", '
+        '"nested": {"Password" : "[REDACTED]"}}'
+    )
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        '{"user": "foo", "access_token": "abcdef',
+        '{"user": "foo", "access_token": "abc\\',
+        '{"user": "foo", "access_token": "',
+    ],
+)
+def test_redact_text_json_cut_off(text):
+    assert Redactor().redact_text(text) == (
+        '{"user": "foo", "access_token": "[REDACTED]"'
+    )
+
+
+def test_redact_text_parameters():
+    text = "GET /path?user=foo&api_key=abc123&token=def#top failed; password=hunter2"
+
+    assert Redactor().redact_text(text) == (
+        "GET /path?user=foo&api_key=[REDACTED]&token=[REDACTED]#top failed; "
+        "password=[REDACTED]"
+    )
+
+
+@pytest.mark.parametrize(
+    "text",
+    [
+        "secret" * 20000,
+        "bad input: " + "secret" * 20000,
+        '{"detail": "' + "secret" * 20000,
+        '"' + "secret" * 20000 + '": "abc"',
+        "?" + "secret" * 20000 + "=abc",
+    ],
+)
+def test_redact_text_linear_time(text):
+    start_time = time.perf_counter()
+    Redactor().redact_text(text)
+
+    assert time.perf_counter() - start_time < 1.0
+
+
+def test_redact_fields():
+    fields = {
+        "token": "abc",
+        "request_headers": {"cookie": "abc"},
+        "response_body": '{"secret": "abc"}',
+        "other_body": '{"secret": "abc"}',
+    }
+
+    Redactor().redact_fields(fields)
+
+    assert fields == {
+        "token": REDACTED,
+        "request_headers": {"cookie": REDACTED},
+        "response_body": '{"secret": "[REDACTED]"}',
+        "other_body": '{"secret": "abc"}',
+    }
+
+
+def test_redact_fields_excluded():
+    fields = {"timings": {"get_secret": 1.0}, "secret": "abc"}
+
+    assert Redactor(exclude_fields=["timings"]).redact_fields(fields) == {
+        "timings": {"get_secret": 1.0},
+        "secret": REDACTED,
+    }
+
+
+def test_custom_patterns():
+    redactor = Redactor(["ssn", "^pin$"], replacement="***", text_fields=["body"])
+    fields = {"ssn": "1", "user_ssn": "2", "pin": "3", "pin_code": "4", "token": "5"}
+
+    assert redactor(None, "info", fields) == {
+        "ssn": "***",
+        "user_ssn": "***",
+        "pin": "***",
+        "pin_code": "4",
+        "token": "5",
+    }
+
+
+def test_redact_text_changing_length_in_lower_case():
+    assert Redactor().redact_text("İstanbul?token=abc") == REDACTED
+    assert Redactor().redact_text("İstanbul") == "İstanbul"
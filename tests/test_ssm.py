@@ -0,0 +1,270 @@
+import asyncio
+import threading
+from unittest.mock import patch
+
+import boto3
+import pytest
+from botocore.exceptions import ClientError
+from botocore.stub import Stubber
+
+from okdata.aws import ssm
+from okdata.aws.ssm import SecretStore
+
+
+def _parameter(name, value):
+    return {"Name": name, "Type": "SecureString", "Value": value, "Version": 1}
+
+
+@pytest.fixture
+def ssm_client():
+    client = boto3.client(
+        "ssm",
+        region_name="eu-west-1",
+        aws_access_key_id="test",
+        aws_secret_access_key="test",
+    )
+    with Stubber(client) as stubber:
+        client.stubber = stubber
+        yield client
+        stubber.assert_no_pending_responses()
+
+
+@pytest.fixture
+def store(ssm_client, monkeypatch):
+    monkeypatch.setenv("AWS_REGION", "eu-west-1")
+    return SecretStore(client_factory=lambda region_name: ssm_client)
+
+
+def test_get_secret_is_cached(store, ssm_client):
+    ssm_client.stubber.add_response(
+        "get_parameter",
+        {"Parameter": _parameter("/foo", "bar")},
+        {"Name": "/foo", "WithDecryption": True},
+    )
+
+    assert store.get_secret("/foo") == "bar"
+    assert store.get_secret("/foo") == "bar"
+
+
+def test_get_secret_expires(store, ssm_client):
+    for value in ["bar", "baz"]:
+        ssm_client.stubber.add_response(
+            "get_parameter",
+            {"Parameter": _parameter("/foo", value)},
+            {"Name": "/foo", "WithDecryption": True},
+        )
+
+    with patch("okdata.aws.ssm.time.monotonic", return_value=0):
+        assert store.get_secret("/foo") == "bar"
+    with patch("okdata.aws.ssm.time.monotonic", return_value=store.ttl):
+        assert store.get_secret("/foo") == "baz"
+
+
+def test_get_secret_error(store, ssm_client):
+    ssm_client.stubber.add_client_error("get_parameter", "ParameterNotFound")
+
+    with pytest.raises(ClientError):
+        store.get_secret("/foo")
+
+
+def test_get_secret_cached_per_region(store, ssm_client):
+    for value in ["bar", "baz"]:
+        ssm_client.stubber.add_response(
+            "get_parameter",
+            {"Parameter": _parameter("/foo", value)},
+            {"Name": "/foo", "WithDecryption": True},
+        )
+
+    assert store.get_secret("/foo") == "bar"
+    assert store.get_secret("/foo", region_name="eu-north-1") == "baz"
+    assert store.get_secret("/foo", region_name="eu-west-1") == "bar"
+    assert store.get_secret("/foo", region_name="eu-north-1") == "baz"
+
+
+def test_lru_eviction(ssm_client, monkeypatch):
+    monkeypatch.setenv("AWS_REGION", "eu-west-1")
+    store = SecretStore(max_size=2, client_factory=lambda region_name: ssm_client)
+    for name in ["/a", "/b", "/c", "/a"]:
+        ssm_client.stubber.add_response(
+            "get_parameter",
+            {"Parameter": _parameter(name, name)},
+            {"Name": name, "WithDecryption": True},
+        )
+
+    store.get_secret("/a")
+    store.get_secret("/b")
+    store.get_secret("/c")
+    # "/b" is still cached, while "/a" was evicted and must be fetched again.
+    assert store.get_secret("/b") == "/b"
+    assert store.get_secret("/a") == "/a"
+
+
+def test_get_secrets_chunked(store, ssm_client):
+    names = [f"/secret/{i}" for i in range(12)]
+    ssm_client.stubber.add_response(
+        "get_parameters",
+        {"Parameters": [_parameter(n, n.upper()) for n in names[:10]]},
+        {"Names": names[:10], "WithDecryption": True},
+    )
+    ssm_client.stubber.add_response(
+        "get_parameters",
+        {"Parameters": [_parameter(n, n.upper()) for n in names[10:]]},
+        {"Names": names[10:], "WithDecryption": True},
+    )
+
+    secrets = store.get_secrets(names)
+
+    assert list(secrets) == names
+    assert secrets["/secret/11"] == "/SECRET/11"
+    # Everything is cached now.
+    assert store.get_secrets(names) == secrets
+
+
+@pytest.mark.parametrize("options", [{"ttl": 0}, {"max_size": 1}])
+def test_get_secrets_not_kept_in_cache(ssm_client, monkeypatch, options):
+    monkeypatch.setenv("AWS_REGION", "eu-west-1")
+    store = SecretStore(**options, client_factory=lambda region_name: ssm_client)
+    ssm_client.stubber.add_response(
+        "get_parameters",
+        {"Parameters": [_parameter("/a", "1"), _parameter("/b", "2")]},
+        {"Names": ["/a", "/b"], "WithDecryption": True},
+    )
+
+    assert store.get_secrets(["/a", "/b"]) == {"/a": "1", "/b": "2"}
+
+
+def test_get_secrets_with_selectors(store, ssm_client):
+    arn = "arn:aws:ssm:eu-west-1:123456789012:parameter/b"
+    ssm_client.stubber.add_response(
+        "get_parameters",
+        {
+            "Parameters": [
+                {**_parameter("/a", "old"), "Selector": ":1"},
+                {**_parameter("/b", "2"), "ARN": arn},
+            ]
+        },
+        {"Names": ["/a:1", arn], "WithDecryption": True},
+    )
+
+    assert store.get_secrets(["/a:1", arn]) == {"/a:1": "old", arn: "2"}
+    # Cached under the names requested.
+    assert store.get_secrets(["/a:1", arn]) == {"/a:1": "old", arn: "2"}
+
+
+def test_get_secrets_only_fetches_uncached(store, ssm_client):
+    ssm_client.stubber.add_response(
+        "get_parameter",
+        {"Parameter": _parameter("/a", "1")},
+        {"Name": "/a", "WithDecryption": True},
+    )
+    ssm_client.stubber.add_response(
+        "get_parameters",
+        {"Parameters": [_parameter("/b", "2")]},
+        {"Names": ["/b"], "WithDecryption": True},
+    )
+
+    store.get_secret("/a")
+    assert store.get_secrets(["/a", "/b"]) == {"/a": "1", "/b": "2"}
+
+
+def test_get_secrets_missing(store, ssm_client):
+    ssm_client.stubber.add_response(
+        "get_parameters",
+        {"Parameters": [_parameter("/a", "1")], "InvalidParameters": ["/b"]},
+        {"Names": ["/a", "/b"], "WithDecryption": True},
+    )
+
+    with pytest.raises(ClientError) as e:
+        store.get_secrets(["/a", "/b"])
+    assert e.value.response["Error"]["Code"] == "ParameterNotFound"
+
+
+def test_get_secrets_by_path(store, ssm_client):
+    ssm_client.stubber.add_response(
+        "get_parameters_by_path",
+        {"Parameters": [_parameter("/app/a", "1")], "NextToken": "next"},
+        {"Path": "/app", "Recursive": True, "WithDecryption": True},
+    )
+    ssm_client.stubber.add_response(
+        "get_parameters_by_path",
+        {"Parameters": [_parameter("/app/b", "2")]},
+        {
+            "Path": "/app",
+            "Recursive": True,
+            "WithDecryption": True,
+            "NextToken": "next",
+        },
+    )
+
+    assert store.get_secrets_by_path("/app") == {"/app/a": "1", "/app/b": "2"}
+    # Prefetched secrets are served from the cache.
+    assert store.get_secret("/app/b") == "2"
+
+
+def test_prefetch(store, ssm_client):
+    ssm_client.stubber.add_response(
+        "get_parameters",
+        {"Parameters": [_parameter("/a", "1"), _parameter("/b", "2")]},
+        {"Names": ["/a", "/b"], "WithDecryption": True},
+    )
+
+    store.prefetch(["/a", "/b"]).join()
+
+    # Served from the cache without any further calls.
+    assert store.get_secret("/a") == "1"
+    assert store.get_secrets(["/a", "/b"]) == {"/a": "1", "/b": "2"}
+
+
+def test_get_secret_waits_for_prefetch(monkeypatch):
+    monkeypatch.setenv("AWS_REGION", "eu-west-1")
+    release = threading.Event()
+
+    class SlowClient:
+        def get_parameters(self, Names, WithDecryption):
+            release.wait()
+            return {"Parameters": [_parameter(n, n) for n in Names]}
+
+    store = SecretStore(client_factory=lambda region_name: SlowClient())
+    store.prefetch(["/a"])
+    threading.Timer(0.05, release.set).start()
+
+    assert store.get_secret("/a") == "/a"
+
+    stats = store.prefetch_stats()
+    assert stats["prefetch_wait_ms"] > 0
+    assert stats["prefetch_duration_ms"] >= stats["prefetch_wait_ms"]
+
+
+def test_prefetch_failure_falls_back(store, ssm_client):
+    ssm_client.stubber.add_client_error("get_parameters", "AccessDeniedException")
+    ssm_client.stubber.add_response(
+        "get_parameter",
+        {"Parameter": _parameter("/a", "1")},
+        {"Name": "/a", "WithDecryption": True},
+    )
+
+    store.prefetch(["/a"]).join()
+
+    assert store.get_secret("/a") == "1"
+
+
+def test_prefetch_secrets_from_env(monkeypatch):
+    monkeypatch.setenv("PREFETCH_SECRETS", "/a, /b")
+    with patch.object(ssm._store, "prefetch") as prefetch:
+        ssm.prefetch_secrets()
+    prefetch.assert_called_once_with(["/a", "/b"])
+
+
+def test_get_secrets_async(store, ssm_client, monkeypatch):
+    ssm_client.stubber.add_response(
+        "get_parameters",
+        {"Parameters": [_parameter("/a", "1"), _parameter("/b", "2")]},
+        {"Names": ["/a", "/b"], "WithDecryption": True},
+    )
+    monkeypatch.setattr(ssm, "_store", store)
+
+    async def main():
+        secrets = await ssm.get_secrets_async(["/a", "/b"])
+        return secrets, await ssm.get_secret_async("/a")
+
+    assert asyncio.run(main()) == ({"/a": "1", "/b": "2"}, "1")
@@ -1,9 +1,13 @@
+import asyncio
 import json
 import re
+import threading
+import time
 from copy import deepcopy
 from unittest.mock import patch
 
 import pytest
+import requests
 from freezegun import freeze_time
 from okdata.sdk.config import Config
 
@@ -13,8 +17,15 @@ from okdata.aws.status.model import (
     TraceStatus,
     TraceEventStatus,
 )
-from okdata.aws.status.sdk import Status
-from okdata.aws.status.wrapper import _status_from_lambda_context
+from okdata.aws.status.sdk import Status, StatusBatch, _shared_client
+from okdata.aws.status.sender import StatusSender
+from okdata.aws.status.stub_server import StatusAPIStub
+from okdata.aws.status.wrapper import (
+    _flush_timeout,
+    _status_from_lambda_context,
+    status_add,
+    status_wrapper,
+)
 
 utc_now = "2020-10-10T08:55:01+00:00"
 trace_id = "my-trace-id"
@@ -135,6 +146,12 @@ class TestStatusClass:
         s.add(domain_id="my-domain-id")
         assert s.status_data.domain_id == "my-domain-id"
 
+    def test_add_unknown_field(self):
+        s = Status(mock_status_data)
+        s.add(domain_id="my-domain-id", not_a_field="foo")
+        assert s.status_data.domain_id == "my-domain-id"
+        assert "not_a_field" not in s.status_data.json_dict()
+
     @freeze_time(utc_now)
     def test_status_data_as_json(self, mock_openid, mock_status_api):
         s = Status(mock_status_data)
@@ -156,3 +173,491 @@ class TestStatusClass:
             "meta": {"function_name": "foo-bar"},
             "exception": "This did not work as expected",
         }
+
+    def test_status_payload_truncated(self, requests_mock, mock_openid):
+        requests_mock.register_uri("POST", f"/status-api/status/{trace_id}", json={})
+        s = Status(mock_status_data)
+        s.add(
+            status_body={"records": list(range(1000))},
+            exception=Exception("x" * 100000),
+        )
+        s.done()
+
+        payload = requests_mock.last_request.json()
+        assert payload["status_body"] == {
+            "records": list(range(100)),
+            "truncated": {
+                "status_body": ["list of 1000 items cut to 100"],
+                "exception": ["string of 100000 characters cut to 65534"],
+            },
+        }
+        assert payload["exception"] == "x" * 65534
+        assert payload["domain_id"] == "my-dataset/1"
+
+    def test_status_payload_redacted(self, requests_mock, mock_openid):
+        requests_mock.register_uri("POST", f"/status-api/status/{trace_id}", json={})
+        s = Status(mock_status_data)
+        status_body = {"request": {"headers": {"x-api-key": "abc"}}}
+        s.add(
+            status_body=status_body,
+            exception=Exception("Request failed: /path?token=abc"),
+        )
+        s.done()
+
+        payload = requests_mock.last_request.json()
+        assert payload["status_body"] == {
+            "request": {"headers": {"x-api-key": "[REDACTED]"}}
+        }
+        assert payload["exception"] == "Request failed: /path?token=[REDACTED]"
+        assert status_body == {"request": {"headers": {"x-api-key": "abc"}}}
+
+    def test_status_payload_truncated_before_redaction(
+        self, requests_mock, mock_openid
+    ):
+        requests_mock.register_uri("POST", f"/status-api/status/{trace_id}", json={})
+        s = Status(mock_status_data)
+        s.add(exception=Exception('{"token": "' + "S" * 100000 + '"}'))
+        s.done()
+
+        payload = requests_mock.last_request.json()
+        assert payload["exception"] == '{"token": "[REDACTED]"'
+        assert "exception" in payload["status_body"]["truncated"]
+
+    def test_status_payload_not_truncated(self, requests_mock, mock_openid):
+        requests_mock.register_uri("POST", f"/status-api/status/{trace_id}", json={})
+        s = Status(mock_status_data)
+        s.add(status_body={"records": list(range(10))})
+        s.done()
+
+        payload = requests_mock.last_request.json()
+        assert payload["status_body"] == {"records": list(range(10))}
+
+
+class TestBackgroundDelivery:
+    def test_status_wrapper_background(self, requests_mock, mock_openid):
+        requests_mock.register_uri("POST", f"/status-api/status/{trace_id}", json={})
+
+        @status_wrapper(background=True)
+        def handler(event, context):
+            status_add(domain="dataset", domain_id="my-dataset/1")
+            return "ok"
+
+        assert handler({"execution_name": trace_id}, MockLambdaContext()) == "ok"
+
+        payload = requests_mock.last_request.json()
+        assert payload["trace_id"] == trace_id
+        assert payload["domain_id"] == "my-dataset/1"
+
+    def test_sender_delivers_in_order(self):
+        delivered = []
+
+        class FakeStatus:
+            def __init__(self, n):
+                self.n = n
+
+            def _process_payload(self):
+                delivered.append(self.n)
+
+        sender = StatusSender()
+        for n in range(10):
+            assert sender.submit(FakeStatus(n))
+
+        assert sender.flush(5)
+        assert delivered == list(range(10))
+        assert sender.pending == 0
+        timings = sender.delivery_timings()
+        assert set(timings) == {"status_queued_ms", "status_delivery_ms"}
+        assert sender.delivery_timings() == {}
+
+    def test_sender_flush_timeout(self):
+        release = threading.Event()
+
+        class SlowStatus:
+            def _process_payload(self):
+                release.wait()
+
+        sender = StatusSender()
+        sender.submit(SlowStatus())
+
+        assert not sender.flush(0.01)
+        assert sender.pending == 1
+
+        release.set()
+        assert sender.flush(5)
+
+    def test_done_falls_back_to_sync(self, requests_mock, mock_openid):
+        requests_mock.register_uri("POST", f"/status-api/status/{trace_id}", json={})
+
+        class FullSender:
+            def submit(self, status):
+                return False
+
+        s = Status(StatusData.parse_obj(mock_status_data))
+        s.done(sender=FullSender())
+
+        assert requests_mock.last_request.json()["trace_id"] == trace_id
+
+    def test_flush_timeout_bounded_by_remaining_time(self):
+        class Context:
+            def get_remaining_time_in_millis(self):
+                return 600
+
+        assert _flush_timeout(None, 2.0) == 2.0
+        assert _flush_timeout(Context(), 2.0) == 0.5
+        assert _flush_timeout(Context(), 0.1) == 0.1
+
+
+class TestStatusBatch:
+    def test_send(self, requests_mock, mock_openid):
+        requests_mock.register_uri(
+            "POST", re.compile("/status-api/status/trace-"), json={"ok": True}
+        )
+        batch = StatusBatch(max_concurrency=2)
+        for n in range(6):
+            batch.add({**mock_status_data, "trace_id": f"trace-{n % 3}"})
+        assert len(batch) == 6
+
+        results = batch.send()
+
+        assert len(batch) == 0
+        assert [r.ok for r in results] == [True] * 6
+        assert [r.status_data.trace_id for r in results] == [
+            f"trace-{n % 3}" for n in range(6)
+        ]
+        assert requests_mock.call_count == 6
+
+    def test_send_in_order_per_trace(self, requests_mock, mock_openid):
+        requests_mock.register_uri(
+            "POST", f"/status-api/status/{trace_id}", json={"ok": True}
+        )
+        batch = StatusBatch()
+        for n in range(5):
+            batch.add({**mock_status_data, "domain_id": f"my-dataset/{n}"})
+
+        batch.send()
+
+        assert [r.json()["domain_id"] for r in requests_mock.request_history] == [
+            f"my-dataset/{n}" for n in range(5)
+        ]
+
+    def test_send_errors(self, requests_mock, mock_openid):
+        requests_mock.register_uri(
+            "POST", "/status-api/status/good-trace", json={"ok": True}
+        )
+        requests_mock.register_uri(
+            "POST", "/status-api/status/bad-trace", status_code=500
+        )
+        batch = StatusBatch()
+        batch.add({**mock_status_data, "trace_id": "good-trace"})
+        batch.add({**mock_status_data, "trace_id": "bad-trace"})
+        batch.add({**mock_status_data, "trace_id": None})
+
+        good, bad, missing = batch.send()
+
+        assert good.ok
+        assert good.response == {"ok": True}
+        assert not bad.ok
+        assert bad.error.response.status_code == 500
+        assert isinstance(missing.error, ValueError)
+
+    def test_send_connection_error(self, requests_mock, mock_openid):
+        requests_mock.register_uri(
+            "POST",
+            "/status-api/status/bad-trace",
+            exc=requests.exceptions.ConnectionError,
+        )
+        requests_mock.register_uri(
+            "POST", "/status-api/status/good-trace", json={"ok": True}
+        )
+        batch = StatusBatch()
+        batch.add({**mock_status_data, "trace_id": "bad-trace"})
+        batch.add({**mock_status_data, "trace_id": "bad-trace"})
+        batch.add({**mock_status_data, "trace_id": "good-trace"})
+
+        results = batch.send()
+
+        assert [r.ok for r in results] == [False, False, True]
+        assert isinstance(results[0].error, requests.exceptions.ConnectionError)
+
+    def test_send_bounds_payloads(self, requests_mock, mock_openid):
+        requests_mock.register_uri(
+            "POST", f"/status-api/status/{trace_id}", json={"ok": True}
+        )
+        batch = StatusBatch()
+        batch.add(
+            {
+                **mock_status_data,
+                "status_body": {"password": "hunter2", "records": list(range(1000))},
+            }
+        )
+
+        batch.send()
+
+        assert requests_mock.last_request.json()["status_body"] == {
+            "password": "[REDACTED]",
+            "records": list(range(100)),
+            "truncated": {"status_body": ["list of 1000 items cut to 100"]},
+        }
+
+    def test_send_coalesced(self, requests_mock, mock_openid):
+        requests_mock.register_uri(
+            "POST", re.compile("/status-api/status/trace-"), json={"ok": True}
+        )
+        requests_mock.register_uri(
+            "POST", "/status-api/status/bad-trace", status_code=500
+        )
+        batch = StatusBatch(coalesce=True)
+        first = batch.add(
+            {**mock_status_data, "trace_id": "trace-1", "trace_status": "STARTED"}
+        )
+        batch.add({**mock_status_data, "trace_id": "trace-2"})
+        batch.add({**mock_status_data, "trace_id": "bad-trace"})
+        last = batch.add(
+            {
+                **mock_status_data,
+                "trace_id": "trace-1",
+                "domain_id": "my-dataset/2",
+                "trace_event_status": "FAILED",
+            }
+        )
+        batch.add({**mock_status_data, "trace_id": "bad-trace"})
+
+        results = batch.send()
+
+        assert [r.ok for r in results] == [True, True, False, True, False]
+        assert results[2].error is results[4].error
+        assert requests_mock.call_count == 3
+        payload = next(
+            r.json()
+            for r in requests_mock.request_history
+            if r.path.endswith("/trace-1")
+        )
+        assert payload["domain_id"] == "my-dataset/2"
+        assert payload["trace_status"] == "STARTED"
+        assert payload["trace_event_status"] == "FAILED"
+        assert payload["start_time"] == first.start_time.isoformat()
+        assert payload["end_time"] == last.end_time.isoformat()
+
+    def test_shared_session(self):
+        batch = StatusBatch(max_concurrency=8)
+        session = batch._client.sdk.prepared_request_with_retries(0)
+
+        assert batch._client.sdk.prepared_request_with_retries(0) is session
+        assert session.get_adapter("https://")._pool_maxsize == 8
+
+
+@pytest.fixture
+def status_api():
+    """A local status API, collecting the payloads posted to it."""
+    with StatusAPIStub() as server:
+        yield server
+
+
+def _config(**config):
+    return Config(config={"cacheCredentials": False, "env": "dev", **config})
+
+
+class TestSharedClient:
+    def test_client_shared_per_config(self):
+        assert Status(trace_id)._client is Status(trace_id)._client
+        assert (
+            Status(trace_id, _config(statusApiUrl="http://a"))._client
+            is Status(trace_id, _config(statusApiUrl="http://a"))._client
+        )
+        assert (
+            Status(trace_id, _config(statusApiUrl="http://a"))._client
+            is not Status(trace_id, _config(statusApiUrl="http://b"))._client
+        )
+
+    def test_token_reused(self, requests_mock):
+        requests_mock.register_uri(
+            "POST",
+            re.compile("openid-connect/token"),
+            json={**mock_token_response, "expires_in": 300},
+        )
+        requests_mock.register_uri(
+            "POST", re.compile("token-reuse-status-api"), json=mock_status_response
+        )
+        config = _config(
+            client_id="my-client",
+            client_secret="my-secret",
+            keycloakServerUrl="https://keycloak.example.org/auth",
+            keycloakRealm="my-realm",
+            statusApiUrl="https://token-reuse-status-api/status",
+        )
+
+        for _ in range(3):
+            Status(StatusData.parse_obj(mock_status_data), config).done()
+
+        assert _shared_client(config).token_refreshes == 1
+
+    def test_connections_reused(self, status_api):
+        config = _config(statusApiUrl=status_api.url)
+        for _ in range(3):
+            assert (
+                Status(StatusData.parse_obj(mock_status_data), config).done()
+                == mock_status_response
+            )
+
+        assert _shared_client(config).new_connections == 1
+
+
+class TestAsync:
+    def test_status_wrapper_async(self, status_api):
+        @status_wrapper(_config(statusApiUrl=status_api.url))
+        async def handler(event, context):
+            await asyncio.sleep(0)
+            status_add(domain="dataset", domain_id="my-dataset/1")
+            return "ok"
+
+        assert handler({"execution_name": trace_id}, MockLambdaContext()) == "ok"
+
+        [payload] = status_api.payloads
+        assert payload["trace_id"] == trace_id
+        assert payload["domain_id"] == "my-dataset/1"
+        assert payload["operation"] == "handler"
+
+    def test_status_wrapper_async_exception(self, status_api):
+        @status_wrapper(_config(statusApiUrl=status_api.url))
+        async def handler(event, context):
+            raise ValueError("fail!")
+
+        with pytest.raises(ValueError):
+            handler({"execution_name": trace_id}, MockLambdaContext())
+
+        [payload] = status_api.payloads
+        assert payload["trace_event_status"] == "FAILED"
+        assert payload["trace_status"] == "FINISHED"
+
+    def test_status_wrapper_async_background(self, status_api):
+        @status_wrapper(_config(statusApiUrl=status_api.url), background=True)
+        async def handler(event, context):
+            return "ok"
+
+        for _ in range(2):
+            handler({"execution_name": trace_id}, MockLambdaContext())
+
+        assert len(status_api.payloads) == 2
+
+    def test_status_wrapper_async_without_httpx(self, requests_mock, mock_openid):
+        requests_mock.register_uri("POST", f"/status-api/status/{trace_id}", json={})
+
+        @status_wrapper()
+        async def handler(event, context):
+            return "ok"
+
+        with patch("okdata.aws.status.sdk._httpx", return_value=None):
+            handler({"execution_name": trace_id}, MockLambdaContext())
+
+        assert requests_mock.last_request.json()["trace_id"] == trace_id
+
+    def test_logging_and_status_wrapper_async(self, status_api, capsys):
+        from okdata.aws.logging import log_add, logging_wrapper
+
+        @logging_wrapper("my-service")
+        @status_wrapper(_config(statusApiUrl=status_api.url))
+        async def handler(event, context):
+            log_add(foo="bar")
+            return {"statusCode": 200}
+
+        handler({"execution_name": trace_id}, MockLambdaContext())
+
+        log = json.loads(capsys.readouterr().out)
+        assert log["foo"] == "bar"
+        assert log["handler_method"] == "handler"
+        assert len(status_api.payloads) == 1
+
+    def test_logging_and_status_wrapper_background(self, status_api, capsys):
+        from okdata.aws.logging import logging_wrapper
+
+        @logging_wrapper("my-service")
+        @status_wrapper(_config(statusApiUrl=status_api.url), background=True)
+        def handler(event, context):
+            return {"statusCode": 200}
+
+        handler({"execution_name": trace_id}, MockLambdaContext())
+
+        log = json.loads(capsys.readouterr().out)
+        assert log["status_queued_ms"] >= 0
+        assert log["status_delivery_ms"] > 0
+        assert len(status_api.payloads) == 1
+
+    @pytest.mark.parametrize("background", [False, True])
+    def test_logging_and_status_wrapper_client_counters(
+        self, status_api, capsys, background
+    ):
+        from okdata.aws.logging import logging_wrapper
+
+        @logging_wrapper("my-service")
+        @status_wrapper(_config(statusApiUrl=status_api.url), background=background)
+        def handler(event, context):
+            return {"statusCode": 200}
+
+        for _ in range(2):
+            handler({"execution_name": trace_id}, MockLambdaContext())
+
+        logs = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+        assert [log["status_token_refreshes"] for log in logs] == [0, 0]
+        assert [log["status_new_connections"] for log in logs] == [1, 1]
+        assert len(status_api.payloads) == 2
+
+
+class TestStatusAPIStub:
+    def test_stats(self, status_api):
+        config = status_api.sdk_config()
+        for _ in range(3):
+            Status(StatusData.parse_obj(mock_status_data), config).done()
+
+        stats = status_api.stats()
+        assert stats["requests"] == 3
+        assert stats["retries"] == 0
+        assert stats["responses"] == {200: 3}
+        assert stats["payload_bytes_max"] > 0
+        assert stats["payload_bytes_total"] == 3 * stats["payload_bytes_mean"]
+
+        status_api.reset()
+        assert status_api.stats()["requests"] == 0
+        assert status_api.payloads == []
+
+    def test_errors(self):
+        with StatusAPIStub(error_rate=1.0) as stub:
+
+            @status_wrapper(stub.sdk_config())
+            def handler(event, context):
+                return "ok"
+
+            for i in range(2):
+                assert handler({"execution_name": f"trace-{i}"}, None) == "ok"
+
+            stats = stub.stats()
+            assert stats["responses"] == {500: 2}
+            assert stats["retries"] == 0
+            assert stub.payloads == []
+
+    def test_retries(self):
+        from requests.exceptions import RetryError
+
+        with StatusAPIStub(error_rate=1.0) as stub:
+            client = _shared_client(stub.sdk_config())
+            with pytest.raises(RetryError):
+                client.update_status(trace_id, mock_status_data, retries=1)
+
+            assert stub.stats()["retries"] == 1
+
+    def test_rate_limit(self):
+        with StatusAPIStub(rate_limit=2) as stub:
+            config = stub.sdk_config()
+            responses = [
+                Status(StatusData.parse_obj(mock_status_data), config).done()
+                for _ in range(3)
+            ]
+
+            assert responses[2] is None
+            assert stub.stats()["responses"] == {200: 2, 429: 1}
+
+    def test_latency(self):
+        with StatusAPIStub(latency=0.05) as stub:
+            start_time = time.monotonic()
+            Status(StatusData.parse_obj(mock_status_data), stub.sdk_config()).done()
+
+            assert time.monotonic() - start_time >= 0.05
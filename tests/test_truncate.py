@@ -0,0 +1,117 @@
+import json
+from datetime import datetime
+
+from okdata.aws.truncate import MAX_DEPTH, truncate, truncate_fields
+
+
+def test_truncate_small_values():
+    value = {"a": [1, 2.5, True, None, "foo"], "b": {"c": b"bar"}}
+
+    assert truncate(value, 1000) == (value, [])
+
+
+def test_truncate_string():
+    value, notes = truncate("x" * 1000, 100)
+
+    assert value == "x" * 98
+    assert notes == ["string of 1000 characters cut to 98"]
+
+
+def test_truncate_list():
+    value, notes = truncate(list(range(1000)), 100000, max_items=10)
+
+    assert value == list(range(10))
+    assert notes == ["list of 1000 items cut to 10"]
+
+
+def test_truncate_dict():
+    value, notes = truncate({f"key-{i}": "x" * 100 for i in range(100)}, 1000)
+
+    assert len(json.dumps(value)) <= 1000
+    assert len(value) < 100
+    assert notes[0].startswith("string of 100 characters cut to")
+    assert notes[1] == f"dict of 100 items cut to {len(value)}"
+
+
+def test_truncate_bytes():
+    assert truncate(b"abc", 100) == (b"abc", [])
+    assert truncate(b"x" * 1000, 100) == ("<1000 bytes>", ["1000 bytes summarized"])
+
+
+def test_truncate_deeply_nested():
+    value = []
+    for _ in range(MAX_DEPTH + 5):
+        value = [value]
+
+    truncated, notes = truncate(value, 1000)
+
+    for _ in range(MAX_DEPTH):
+        truncated = truncated[0]
+    assert truncated == "<list of 1 items>"
+    assert notes == [f"list nested deeper than {MAX_DEPTH} levels summarized"]
+
+
+def test_truncate_other_types_untouched():
+    error = ValueError("Oops")
+    now = datetime.now()
+
+    assert truncate([error, now], 100) == ([error, now], [])
+
+
+def test_truncate_notes_capped():
+    value, notes = truncate([[0] * 200] * 10, 100000)
+
+    assert notes == ["list of 200 items cut to 100"] * 3 + ["7 more"]
+
+
+def test_truncate_does_not_modify_value():
+    value = {"a": ["x" * 100]}
+
+    truncate(value, 10)
+
+    assert value == {"a": ["x" * 100]}
+
+
+def test_truncate_fields():
+    fields = {"small": "foo", "number": 42, "large": "x" * 1001, "list": [1] * 1000}
+
+    truncated = truncate_fields(fields, 1000, 100000)
+
+    assert fields["small"] == "foo"
+    assert fields["number"] == 42
+    assert len(fields["large"]) == 998
+    assert len(fields["list"]) == 100
+    assert truncated == {
+        "large": ["string of 1001 characters cut to 998"],
+        "list": ["list of 1000 items cut to 100"],
+    }
+
+
+def test_truncate_fields_line_budget():
+    fields = {f"field_{i}": "x" * 100 for i in range(100)}
+
+    truncated = truncate_fields(fields, 1000, 2000)
+
+    assert sum(len(value) for value in fields.values()) < 2000
+    # Cut down evenly.
+    assert len(set(map(len, fields.values()))) == 1
+    assert truncated["field_0"] == truncated["field_99"]
+
+
+def test_truncate_fields_line_budget_largest_first():
+    fields = {
+        "level": "error",
+        "large": "x" * 5000,
+        "status_code": 500,
+        "larger": ["y" * 100] * 100,
+        "message": "m" * 100,
+    }
+
+    truncated = truncate_fields(fields, 100000, 2000)
+
+    assert fields["level"] == "error"
+    assert fields["status_code"] == 500
+    assert fields["message"] == "m" * 100
+    assert len(json.dumps(fields)) < 2000
+    assert truncated["large"] == ["string of 5000 characters cut to 907"]
+    assert set(truncated) == {"large", "larger"}